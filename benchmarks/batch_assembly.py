@@ -0,0 +1,53 @@
+""" Compares the time taken to assemble padded feature batches using the
+original float64 zero_pad path with the float32 pad_batch/BatchAssembler
+path.
+
+Usage: python benchmarks/batch_assembly.py [--batch-size 64] [--repeats 20]
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+
+from persephone import utils
+
+def legacy_load_batch_x(utterances):
+    """ Batch assembly as previously done by utils.load_batch_x. """
+
+    utter_lens = [utterance.shape[0] for utterance in utterances]
+    max_len = max(utter_lens)
+    shape = (len(utterances), max_len) + tuple(utterances[0].shape[1:])
+    batch = np.zeros(shape)
+    for i, utt in enumerate(utterances):
+        batch[i] = utils.zero_pad(utt, max_len)
+    return batch, np.array(utter_lens)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--max-frames", type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    utterances = [rng.rand(rng.randint(50, args.max_frames), 41, 3)
+                  for _ in range(args.batch_size)]
+    assembler = utils.BatchAssembler()
+
+    candidates = [
+        ("zero_pad (float64)", lambda: legacy_load_batch_x(utterances)),
+        ("pad_batch (float32)", lambda: utils.pad_batch(utterances)),
+        ("BatchAssembler (float32)", lambda: assembler(utterances)),
+    ]
+    baseline = None
+    for name, fn in candidates:
+        seconds = min(timeit.repeat(fn, number=1, repeat=args.repeats))
+        batch, _ = fn()
+        if baseline is None:
+            baseline = seconds
+        print("{:<26} {:8.2f} ms  {:8.1f} MB  {:5.2f}x".format(
+            name, seconds * 1000, batch.nbytes / 2**20, baseline / seconds))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+""" Compares the time taken to compute fbank features one utterance at a time
+with python_speech_features against computing them in batches with
+FbankEngine.
+
+Usage: python benchmarks/fbank_extraction.py [--num-utterances 200] [--batch-size 16]
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+import python_speech_features
+
+from persephone.preprocess import feat_extract
+from persephone.preprocess.fbank_engine import FbankEngine
+
+def legacy_fbank(rate, sig):
+    """ fbank extraction as previously done by feat_extract.fbank. """
+
+    fbank_feat = python_speech_features.logfbank(sig, rate, nfilt=40)
+    energy = feat_extract.extract_energy(rate, sig)
+    feat = np.hstack([energy, fbank_feat])
+    delta_feat = python_speech_features.delta(feat, 2)
+    delta_delta_feat = python_speech_features.delta(delta_feat, 2)
+    return np.concatenate([feat, delta_feat, delta_delta_feat], axis=1)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--num-utterances", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--max-seconds", type=float, default=5.0)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    rate = 16000
+    rng = np.random.RandomState(0)
+    signals = [(rng.randn(rng.randint(rate // 2, int(args.max_seconds * rate)))
+                * 3000).astype(np.int16)
+               for _ in range(args.num_utterances)]
+    engine = FbankEngine(rate)
+
+    def batched():
+        for i in range(0, len(signals), args.batch_size):
+            engine(signals[i:i+args.batch_size])
+
+    candidates = [
+        ("python_speech_features", lambda: [legacy_fbank(rate, sig) for sig in signals]),
+        ("FbankEngine (1 per call)", lambda: [engine([sig]) for sig in signals]),
+        ("FbankEngine (batched)", batched),
+    ]
+    baseline = None
+    for name, fn in candidates:
+        seconds = min(timeit.repeat(fn, number=1, repeat=args.repeats))
+        if baseline is None:
+            baseline = seconds
+        print("{:<26} {:8.1f} ms  {:5.2f}x".format(
+            name, seconds * 1000, baseline / seconds))
+
+if __name__ == "__main__":
+    main()
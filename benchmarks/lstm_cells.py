@@ -0,0 +1,59 @@
+""" Compares the training step time of rnn_ctc.Model with each of its LSTM
+cell implementations, at the same numbers of layers and hidden units, on a
+synthetic corpus.
+
+Usage: python benchmarks/lstm_cells.py [--cell-types standard block fused]
+    [--num-layers 3] [--hidden-size 250]
+"""
+
+import argparse
+from pathlib import Path
+import tempfile
+
+from persephone.corpus_reader import CorpusReader
+from persephone.rnn_ctc import CELL_TYPES, Model
+from persephone.session_config import SessionConfig
+
+import synthetic
+from training_scaling import steps_per_second
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--cell-types", nargs="+", default=list(CELL_TYPES),
+                        choices=CELL_TYPES)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup-steps", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-layers", type=int, default=3)
+    parser.add_argument("--hidden-size", type=int, default=250)
+    parser.add_argument("--intra", type=int, default=0,
+                        help="Intra-op threads. If 0, TensorFlow chooses.")
+    parser.add_argument("--inter", type=int, default=0,
+                        help="Inter-op threads. If 0, TensorFlow chooses.")
+    parser.add_argument("--corpus-dir",
+                        help="Where to build the synthetic corpus. Defaults"
+                             " to a temporary directory.")
+    args = parser.parse_args()
+
+    session_config = SessionConfig(intra_op_threads=args.intra,
+                                   inter_op_threads=args.inter)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = Path(args.corpus_dir or tmp_dir) / "corpus"
+        corpus = synthetic.make_corpus(corpus_dir, num_train=args.batch_size * 4)
+        corpus_reader = CorpusReader(corpus, batch_size=args.batch_size)
+
+        baseline = None
+        print("{:>9} {:>12} {:>8}".format("cell", "ms/step", "speedup"))
+        for cell_type in args.cell_types:
+            model = Model(Path(tmp_dir) / "exp_{}".format(cell_type), corpus_reader,
+                          num_layers=args.num_layers, hidden_size=args.hidden_size,
+                          cell_type=cell_type, session_config=session_config)
+            step_time = 1 / steps_per_second(model, corpus_reader, args.steps,
+                                             args.warmup_steps)
+            if baseline is None:
+                baseline = step_time
+            print("{:>9} {:>12.1f} {:>7.2f}x".format(cell_type, step_time * 1000,
+                                                     baseline / step_time), flush=True)
+
+if __name__ == "__main__":
+    main()
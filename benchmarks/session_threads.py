@@ -0,0 +1,63 @@
+""" Measures training throughput of rnn_ctc.Model under different session
+thread settings, on a synthetic corpus.
+
+Each combination of intra-op and inter-op thread counts is timed on the same
+graph. A count of 0 lets TensorFlow choose.
+
+Usage: python benchmarks/session_threads.py [--intra 0 1 2 4] [--inter 0 1 2]
+    [--xla] [--towers 1]
+"""
+
+import argparse
+import itertools
+from pathlib import Path
+import tempfile
+
+from persephone.corpus_reader import CorpusReader
+from persephone.rnn_ctc import Model
+from persephone.session_config import SessionConfig
+
+import synthetic
+from training_scaling import steps_per_second
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--intra", type=int, nargs="+", default=[0, 1, 2, 4],
+                        help="Intra-op thread counts to try.")
+    parser.add_argument("--inter", type=int, nargs="+", default=[0, 1, 2],
+                        help="Inter-op thread counts to try.")
+    parser.add_argument("--xla", action="store_true",
+                        help="Also time each setting with XLA JIT compilation.")
+    parser.add_argument("--towers", type=int, default=1)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup-steps", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-layers", type=int, default=3)
+    parser.add_argument("--hidden-size", type=int, default=250)
+    parser.add_argument("--corpus-dir",
+                        help="Where to build the synthetic corpus. Defaults"
+                             " to a temporary directory.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = Path(args.corpus_dir or tmp_dir) / "corpus"
+        corpus = synthetic.make_corpus(corpus_dir, num_train=args.batch_size * 4)
+        corpus_reader = CorpusReader(corpus, batch_size=args.batch_size)
+        model = Model(Path(tmp_dir) / "exp", corpus_reader,
+                      num_layers=args.num_layers, hidden_size=args.hidden_size,
+                      num_towers=args.towers)
+
+        xla_settings = [False, True] if args.xla else [False]
+        print("{:>6} {:>6} {:>5} {:>10}".format("intra", "inter", "xla", "steps/s"))
+        for intra, inter, xla_jit in itertools.product(args.intra, args.inter,
+                                                       xla_settings):
+            session_config = SessionConfig(intra_op_threads=intra,
+                                           inter_op_threads=inter,
+                                           xla_jit=xla_jit)
+            rate = steps_per_second(model, corpus_reader, args.steps,
+                                    args.warmup_steps, session_config)
+            print("{:>6} {:>6} {:>5} {:>10.3f}".format(
+                intra, inter, "on" if xla_jit else "off", rate), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+""" Builds a synthetic corpus of noise and random transcriptions, for
+benchmarking training without any real data. """
+
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+import scipy.io.wavfile
+
+from persephone.corpus import Corpus
+
+LABELS = ("a", "b", "c", "d", "e", "f", "g", "h")
+
+def make_corpus(tgt_dir: Path, *, num_train: int = 64, num_valid: int = 8,
+                num_test: int = 8, max_seconds: float = 3.0,
+                labels: Sequence[str] = LABELS, seed: int = 0) -> Corpus:
+    """ Writes WAVs of white noise with random transcriptions of a few
+    labels per second to tgt_dir and returns the corpus made from them. If
+    the corpus has already been made in tgt_dir, it is reused. """
+
+    rate = 16000
+    rng = np.random.RandomState(seed)
+    wav_dir = Path(tgt_dir) / "wav"
+    label_dir = Path(tgt_dir) / "label"
+    wav_dir.mkdir(parents=True, exist_ok=True)
+    label_dir.mkdir(parents=True, exist_ok=True)
+
+    splits = {"train": num_train, "valid": num_valid, "test": num_test}
+    for split, num_utterances in splits.items():
+        prefixes = ["{}{}".format(split, i) for i in range(num_utterances)]
+        for prefix in prefixes:
+            wav_path = wav_dir / "{}.wav".format(prefix)
+            if wav_path.is_file():
+                continue
+            seconds = rng.uniform(0.5, max_seconds)
+            samples = (rng.randn(int(seconds * rate)) * 3000).astype(np.int16)
+            scipy.io.wavfile.write(str(wav_path), rate, samples)
+            num_labels = max(1, int(seconds * 4))
+            (label_dir / "{}.phonemes".format(prefix)).write_text(
+                " ".join(rng.choice(labels, num_labels)))
+        (Path(tgt_dir) / "{}_prefixes.txt".format(split)).write_text(
+            "\n".join(prefixes))
+
+    return Corpus("fbank", "phonemes", Path(tgt_dir), labels=set(labels))
@@ -0,0 +1,74 @@
+""" Measures how training throughput of rnn_ctc.Model scales with the number
+of data parallel towers, on a synthetic corpus.
+
+Usage: python benchmarks/training_scaling.py [--towers 1 2 4 8] [--steps 20]
+"""
+
+import argparse
+from pathlib import Path
+import tempfile
+import time
+from typing import Optional
+
+import tensorflow as tf
+
+from persephone.corpus_reader import CorpusReader
+from persephone.rnn_ctc import Model
+from persephone.session_config import SessionConfig
+
+import synthetic
+
+def steps_per_second(model: Model, corpus_reader: CorpusReader,
+                     num_steps: int, warmup_steps: int,
+                     session_config: Optional[SessionConfig] = None) -> float:
+    """ Runs training steps of the model on batches of the corpus, returning
+    the number of steps per second after warming up. The session is
+    configured by session_config, or else by the model's own. """
+
+    batches = []
+    while len(batches) < num_steps + warmup_steps:
+        batches.extend(corpus_reader.train_batch_gen())
+    with tf.Session(config=model.session_config_proto(session_config)) as sess:
+        sess.run(tf.global_variables_initializer())
+        for step, (batch_x, batch_x_lens, batch_y) in enumerate(
+                batches[:num_steps + warmup_steps]):
+            if step == warmup_steps:
+                start = time.perf_counter()
+            sess.run(model.optimizer, feed_dict={model.batch_x: batch_x,
+                                                 model.batch_x_lens: batch_x_lens,
+                                                 model.batch_y: batch_y})
+    return num_steps / (time.perf_counter() - start)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--towers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--warmup-steps", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-layers", type=int, default=3)
+    parser.add_argument("--hidden-size", type=int, default=250)
+    parser.add_argument("--corpus-dir",
+                        help="Where to build the synthetic corpus. Defaults"
+                             " to a temporary directory.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = Path(args.corpus_dir or tmp_dir) / "corpus"
+        corpus = synthetic.make_corpus(corpus_dir, num_train=args.batch_size * 4)
+        corpus_reader = CorpusReader(corpus, batch_size=args.batch_size)
+
+        baseline = None
+        print("{:>6} {:>10} {:>8}".format("towers", "steps/s", "speedup"))
+        for num_towers in args.towers:
+            model = Model(Path(tmp_dir) / "exp{}".format(num_towers), corpus_reader,
+                          num_layers=args.num_layers, hidden_size=args.hidden_size,
+                          num_towers=num_towers)
+            rate = steps_per_second(model, corpus_reader, args.steps,
+                                    args.warmup_steps)
+            if baseline is None:
+                baseline = rate
+            print("{:>6} {:>10.3f} {:>7.2f}x".format(num_towers, rate,
+                                                     rate / baseline), flush=True)
+
+if __name__ == "__main__":
+    main()
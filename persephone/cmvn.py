@@ -0,0 +1,249 @@
+""" Cepstral mean and variance normalization (CMVN) of input features.
+
+`compute()` sweeps once over the features of a corpus, accumulating the
+frame count, sum and sum of squares of each feature, both globally (over the
+training utterances) and for each speaker (over all of the speaker's
+utterances). The resulting `CMVNStats` are saved to
+`<tgt_dir>/cmvn.<feat_type>.npz` and used to normalize batches in place as
+they are loaded.
+"""
+
+import logging
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__) # type: ignore
+
+#: Variances are floored at this value to avoid dividing by zero for features
+#: that are constant, such as those of silent or padded audio.
+VAR_FLOOR = 1e-8
+
+class CMVNStats:
+    """ Accumulated feature statistics used to normalize features to zero
+    mean and unit variance. """
+
+    def __init__(self, feat_dir: Path, feat_type: str, *,
+                 per_speaker: bool = False,
+                 speakers: Optional[Dict[str, str]] = None) -> None:
+        """
+        Args:
+            feat_dir: The directory containing the feature files.
+            feat_type: The type of the features.
+            per_speaker: If True, utterances are normalized with the
+                statistics of their speaker, where known, rather than the
+                global statistics.
+            speakers: A dictionary mapping utterance prefixes to speakers.
+        """
+
+        self.feat_dir = Path(feat_dir)
+        self.feat_type = feat_type
+        self.per_speaker = per_speaker
+        self.speakers = dict(speakers) if speakers else {} # type: Dict[str, str]
+        self.prefixes = [] # type: List[str]
+        #: The sorted training prefixes the global statistics come from, or
+        #: `None` if unknown (as for statistics saved before they were kept).
+        self.train_prefixes = None # type: Optional[List[str]]
+        #: Frame count, sum and sum of squares, keyed by speaker. The global
+        #: statistics are keyed by `None`.
+        self.counts = {} # type: Dict[Optional[str], int]
+        self.sums = {} # type: Dict[Optional[str], np.ndarray]
+        self.sumsqs = {} # type: Dict[Optional[str], np.ndarray]
+        self._normalizers = {} # type: Dict[Optional[str], Tuple[np.ndarray, np.ndarray]]
+
+    def accumulate(self, feats: np.ndarray, key: Optional[str]) -> None:
+        """ Adds the frames of an utterance to the statistics of the speaker
+        (or, if key is `None`, the global statistics). """
+
+        feats = np.asarray(feats, dtype=np.float64)
+        if key not in self.counts:
+            self.counts[key] = 0
+            self.sums[key] = np.zeros(feats.shape[1:])
+            self.sumsqs[key] = np.zeros(feats.shape[1:])
+        self.counts[key] += len(feats)
+        self.sums[key] += feats.sum(axis=0)
+        self.sumsqs[key] += np.square(feats).sum(axis=0)
+        self._normalizers.pop(key, None)
+
+    def mean(self, key: Optional[str] = None) -> np.ndarray:
+        return self.sums[key] / self.counts[key]
+
+    def var(self, key: Optional[str] = None) -> np.ndarray:
+        mean = self.mean(key)
+        return np.maximum(self.sumsqs[key] / self.counts[key] - np.square(mean),
+                          VAR_FLOOR)
+
+    def normalizer(self, key: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """ Returns the (mean, 1/standard deviation) pair used to normalize
+        features of the speaker, or globally if key is `None`. """
+
+        if key not in self._normalizers:
+            self._normalizers[key] = (self.mean(key), 1 / np.sqrt(self.var(key)))
+        return self._normalizers[key]
+
+    def speaker_of(self, feat_path: Union[str, Path]) -> Optional[str]:
+        """ Returns the speaker whose statistics normalize the features at
+        feat_path, or `None` if the global statistics are to be used. """
+
+        if not self.per_speaker:
+            return None
+        feat_path = Path(feat_path)
+        suffix = ".{}.npy".format(self.feat_type)
+        if not feat_path.name.endswith(suffix):
+            return None
+        try:
+            prefix = str(feat_path.relative_to(self.feat_dir))[:-len(suffix)]
+        except ValueError:
+            return None
+        speaker = self.speakers.get(prefix)
+        return speaker if speaker in self.counts else None
+
+    def normalize(self, batch: np.ndarray, batch_lens: Sequence[int],
+                  feat_paths: Optional[Sequence[Union[str, Path]]] = None) -> None:
+        """ Normalizes a zero padded batch of features in place. Padding
+        frames are left as zeros.
+
+        Args:
+            batch: An array of shape (batch_size, max_len, ...).
+            batch_lens: The number of frames of each utterance.
+            feat_paths: The paths the utterances' features were loaded from,
+                used to identify their speakers. If `None`, the global
+                statistics are used for all of them.
+        """
+
+        if feat_paths is None or not self.per_speaker:
+            mean, inv_std = self.normalizer()
+            batch -= mean.astype(batch.dtype)
+            batch *= inv_std.astype(batch.dtype)
+        else:
+            normalizers = [self.normalizer(self.speaker_of(path))
+                           for path in feat_paths]
+            means = np.stack([mean for mean, _ in normalizers]).astype(batch.dtype)
+            inv_stds = np.stack([inv_std for _, inv_std in normalizers]).astype(batch.dtype)
+            batch -= means[:, np.newaxis]
+            batch *= inv_stds[:, np.newaxis]
+        padding = np.arange(batch.shape[1]) >= np.asarray(batch_lens)[:, np.newaxis]
+        batch[padding] = 0
+
+    def normalize_utterance(self, feats: np.ndarray,
+                            speaker: Optional[str] = None) -> np.ndarray:
+        """ Returns a normalized copy of the features of one utterance. """
+
+        mean, inv_std = self.normalizer(speaker if speaker in self.counts else None)
+        return (feats - mean) * inv_std
+
+    def save(self, path: Path) -> None:
+        """ Saves the statistics to an .npz file. """
+
+        speakers = sorted(key for key in self.counts if key is not None)
+        keys = [None] + speakers # type: List[Optional[str]]
+        np.savez(str(path),
+                 feat_type=np.array(self.feat_type),
+                 per_speaker=np.array(self.per_speaker),
+                 prefixes=np.array(self.prefixes, dtype=str),
+                 train_prefixes=np.array(self.train_prefixes or [], dtype=str),
+                 prefix_speakers=np.array(
+                     [self.speakers.get(prefix, "") for prefix in self.prefixes],
+                     dtype=str),
+                 speakers=np.array(speakers, dtype=str),
+                 counts=np.array([self.counts[key] for key in keys]),
+                 sums=np.stack([self.sums[key] for key in keys]),
+                 sumsqs=np.stack([self.sumsqs[key] for key in keys]))
+
+    @classmethod
+    def from_file(cls, path: Path, feat_dir: Path) -> "CMVNStats":
+        with np.load(str(path)) as npz:
+            stats = cls(feat_dir, str(npz["feat_type"]),
+                        per_speaker=bool(npz["per_speaker"]),
+                        speakers={str(prefix): str(speaker) for prefix, speaker
+                                  in zip(npz["prefixes"], npz["prefix_speakers"])
+                                  if speaker})
+            stats.prefixes = [str(prefix) for prefix in npz["prefixes"]]
+            if "train_prefixes" in npz.files:
+                stats.train_prefixes = [str(prefix) for prefix in npz["train_prefixes"]]
+            keys = [None] + [str(speaker) for speaker in npz["speakers"]]
+            for i, key in enumerate(keys):
+                stats.counts[key] = int(npz["counts"][i])
+                stats.sums[key] = npz["sums"][i]
+                stats.sumsqs[key] = npz["sumsqs"][i]
+        return stats
+
+    def __repr__(self) -> str:
+        return "{}(feat_type={!r}, per_speaker={}, num_speakers={})".format(
+            self.__class__.__name__, self.feat_type, self.per_speaker,
+            len(self.counts) - 1)
+
+def stats_path(tgt_dir: Path, feat_type: str) -> Path:
+    return Path(tgt_dir) / "cmvn.{}.npz".format(feat_type)
+
+def compute(feat_dir: Path, feat_type: str, prefixes: Sequence[str],
+            train_prefixes: Set[str], *,
+            speakers: Optional[Dict[str, str]] = None,
+            per_speaker: bool = False,
+            load_fn: Optional[Callable[[Path], np.ndarray]] = None) -> CMVNStats:
+    """ Computes CMVN statistics in a single pass over the features of the
+    given utterances.
+
+    Args:
+        feat_dir: The directory containing `<prefix>.<feat_type>.npy` files.
+        feat_type: The type of the features.
+        prefixes: The utterances to sweep over.
+        train_prefixes: The utterances that contribute to the global
+            statistics.
+        speakers: A dictionary mapping prefixes to speakers. Utterances with
+            a speaker contribute to that speaker's statistics.
+        per_speaker: Whether the statistics normalize by speaker.
+        load_fn: Loads the features at a path, for example from a
+            `PackedFeatStore`. Defaults to `np.load`.
+    """
+
+    if load_fn is None:
+        load_fn = lambda path: np.load(str(path))
+    speakers = speakers or {}
+    stats = CMVNStats(feat_dir, feat_type, per_speaker=per_speaker,
+                      speakers=speakers)
+    stats.prefixes = list(prefixes)
+    stats.train_prefixes = sorted(train_prefixes)
+    for prefix in prefixes:
+        feats = load_fn(Path(feat_dir) / "{}.{}.npy".format(prefix, feat_type))
+        if prefix in train_prefixes:
+            stats.accumulate(feats, None)
+        if prefix in speakers:
+            stats.accumulate(feats, speakers[prefix])
+    if None not in stats.counts:
+        raise ValueError("No training utterances to compute CMVN statistics from.")
+    return stats
+
+def load_or_compute(tgt_dir: Path, feat_dir: Path, feat_type: str,
+                    prefixes: Sequence[str], train_prefixes: Sequence[str], *,
+                    speakers: Optional[Dict[str, str]] = None,
+                    per_speaker: bool = False,
+                    load_fn: Optional[Callable[[Path], np.ndarray]] = None
+                    ) -> CMVNStats:
+    """ Loads the statistics saved in tgt_dir if they cover the same
+    utterances, training utterances and speakers and are newer than all of
+    the feature files. Otherwise computes and saves new statistics. """
+
+    path = stats_path(tgt_dir, feat_type)
+    prefixes = sorted(prefixes)
+    prefix_set = set(prefixes)
+    speakers = {prefix: speaker for prefix, speaker in (speakers or {}).items()
+                if prefix in prefix_set}
+    if path.is_file():
+        stats = CMVNStats.from_file(path, feat_dir)
+        stats_mtime = path.stat().st_mtime
+        if (stats.prefixes == list(prefixes)
+                and stats.train_prefixes == sorted(train_prefixes)
+                and stats.speakers == speakers
+                and all((Path(feat_dir) / "{}.{}.npy".format(prefix, feat_type)
+                        ).stat().st_mtime <= stats_mtime
+                        for prefix in prefixes)):
+            stats.per_speaker = per_speaker
+            return stats
+    logger.info("Computing CMVN statistics of %d utterances into %s",
+                len(prefixes), path)
+    stats = compute(feat_dir, feat_type, prefixes, set(train_prefixes),
+                    speakers=speakers, per_speaker=per_speaker, load_fn=load_fn)
+    stats.save(path)
+    return stats
@@ -40,10 +40,12 @@ TEST_DATA_PATH = os.path.join(TEST_ROOT, "data/")
 # replace with pydub. Actually, the pydub approach is slow so now
 # wav.trim_wav_ms tries to use sox and then fallsback to pydub/ffmpeg
 SOX_PATH = config_file.get("PATHS", "SOX_PATH", fallback="sox")
+# The directory of the feature cache shared between corpora and experiments,
+# and the size it is trimmed to. Leave the directory empty to disable the cache.
+FEAT_CACHE_DIR = config_file.get("PATHS", "FEAT_CACHE_DIR", fallback="")
+FEAT_CACHE_MAX_GB = config_file.getfloat("PATHS", "FEAT_CACHE_MAX_GB", fallback=10.0)
 # FFMPEG is used for normalizing WAVs
 FFMPEG_PATH = config_file.get("PATHS", "FFMPEG_PATH", fallback="ffmpeg")
-# Kaldi is used for pitch extraction
-KALDI_ROOT = config_file.get("PATHS", "KALDI_ROOT_PATH", fallback="/home/oadams/tools/kaldi")
 
 # Fetch the path of the logging.ini file installed by setuptools.
 logging_ini_path = resource_filename(Requirement.parse("persephone"), "persephone/logging.ini")
@@ -10,15 +10,16 @@ from pathlib import Path
 import pickle
 import random
 import subprocess
-from typing import Any, List, Callable, Optional, Set, Sequence, Tuple, Type, TypeVar
-
-import numpy as np
+from typing import Any, Dict, List, Callable, Optional, Set, Sequence, Tuple, Type, TypeVar
 
 from .config import ENCODING
+from . import cmvn
+from . import feat_store
+from . import label_store
 from .preprocess import feat_extract
-from . import utils
 from .exceptions import PersephoneException
 from .exceptions import LabelMismatchException
+from .manifest import FeatManifest
 from .preprocess import elan, wav
 from . import utterance
 from .utterance import Utterance
@@ -28,6 +29,9 @@ logger = logging.getLogger(__name__) # type: ignore
 
 CorpusT = TypeVar("CorpusT", bound="Corpus")
 
+#: The ways features can be normalized; see `Corpus`.
+CMVN_MODES = (None, "global", "speaker")
+
 def ensure_no_set_overlap(train: Sequence[str], valid: Sequence[str], test: Sequence[str]) -> None:
     """ Ensures no test set data has creeped into the training set."""
 
@@ -66,6 +70,26 @@ def find_untranscribed_wavs(wav_path: Path, transcription_path: Path, label_type
             untranscribed_prefixes.append(a_file.stem)
     return untranscribed_prefixes
 
+def get_speakers_from_file(target_directory: Path) -> Dict[str, str]:
+    """
+    The file "speakers.txt" in the target directory may specify the speaker
+    of each utterance, with one "<prefix> <speaker>" pair per line.
+
+    Returns:
+        A dictionary mapping prefixes to speakers, which is empty if the file
+        does not exist.
+    """
+
+    speakers_fn = target_directory / "speakers.txt"
+    speakers = {} # type: Dict[str, str]
+    if speakers_fn.exists():
+        with speakers_fn.open() as f:
+            for line in f:
+                fields = line.split(maxsplit=1)
+                if len(fields) == 2:
+                    speakers[fields[0]] = fields[1].strip()
+    return speakers
+
 def get_untranscribed_prefixes_from_file(target_directory: Path) -> List[str]:
     """
     The file "untranscribed_prefixes.txt" will specify prefixes which
@@ -117,7 +141,10 @@ class Corpus:
                  *,
                  labels: Optional[Set[str]] = None,
                  max_samples: int=1000,
-                 speakers: Optional[Sequence[str]] = None) -> None:
+                 speakers: Optional[Sequence[str]] = None,
+                 packed_feats: bool = False,
+                 keep_mono16k_wavs: bool = False,
+                 cmvn_mode: Optional[str] = None) -> None:
         """ Construct a `Corpus` instance from preprocessed data.
 
         Assumes that the corpus data has been preprocessed and is
@@ -149,11 +176,24 @@ class Corpus:
             max_samples: The maximum number of samples an utterance in the
                 corpus may have. If an utterance is longer than this, it is not
                 included in the corpus.
+            packed_feats: If True, the features of all utterances are
+                additionally packed into a single memory mapped file in
+                `<tgt_dir>/feat/`, which is then used when loading batches.
+            keep_mono16k_wavs: If True, the 16kHz mono audio that features are
+                computed from is also saved as `<tgt_dir>/feat/<prefix>.wav`.
+            cmvn_mode: If "global", features are normalized to zero mean and
+                unit variance using statistics of the training set as they are
+                loaded. If "speaker", the statistics of each utterance's
+                speaker are used instead, where its speaker is given in
+                `<tgt_dir>/speakers.txt`. If `None`, features are used as is.
 
         """
 
         if speakers:
             raise NotImplementedError("Speakers not implemented")
+        if cmvn_mode not in CMVN_MODES:
+            raise PersephoneException("Unknown CMVN mode {!r}; expected one of"
+                                      " {}".format(cmvn_mode, CMVN_MODES))
 
         logger.debug("Creating a new Corpus object with feature type {}, label type {},"
                      "target directory {}, label set {}, max_samples {}, speakers {}".format(
@@ -194,12 +234,23 @@ class Corpus:
         self.LABEL_TO_INDEX, self.INDEX_TO_LABEL = self.initialize_labels(self.labels)
         logger.info("Corpus label set: \n\t{}".format(self.labels))
 
+        #: Whether to read features from a single packed file.
+        self.packed_feats = packed_feats
+        #: Whether to save the normalized WAVs alongside the features.
+        self.keep_mono16k_wavs = keep_mono16k_wavs
+        #: The `PackedFeatStore` features are read from, if `packed_feats`.
+        self.feat_store = None # type: Optional[feat_store.PackedFeatStore]
+
         # This is a lazy function that assumes wavs are already in the WAV dir
         # but only creates features if necessary
         logger.debug("Preparing features")
         self.prepare_feats()
         self._num_feats = None
 
+        #: Records the number of frames and labels of each utterance so that
+        #: utterances can be sorted and filtered without loading features.
+        self.manifest = FeatManifest(self.tgt_dir, feat_type, label_type)
+
         self.train_prefixes = [] # type: List[str]
         self.valid_prefixes = [] # type: List[str]
         self.test_prefixes = [] # type: List[str]
@@ -208,8 +259,13 @@ class Corpus:
 
         # Sort the training prefixes by size for more efficient training
         logger.debug("Training prefixes")
-        self.train_prefixes = utils.sort_by_size(
-            self.feat_dir, self.train_prefixes, feat_type)
+        self.train_prefixes = self.manifest.sort_by_size(self.train_prefixes)
+
+        #: The transcriptions of the train, valid and test sets encoded as
+        #: label indices.
+        self.label_store = label_store.load_or_build(
+            self.tgt_dir, label_type, self.LABEL_TO_INDEX,
+            self.train_prefixes + self.valid_prefixes + self.test_prefixes)
 
         # Ensure no overlap between training and test sets
         try:
@@ -227,6 +283,13 @@ class Corpus:
 
         self.untranscribed_prefixes = list(set(untranscribed_from_file) | set(untranscribed_found))
 
+        #: How features are normalized; see `cmvn_mode` above.
+        self.cmvn_mode = cmvn_mode
+        #: The `CMVNStats` features are normalized with, if cmvn_mode is set.
+        self.cmvn_stats = None # type: Optional[cmvn.CMVNStats]
+        if cmvn_mode:
+            self.cmvn_stats = self.prepare_cmvn_stats()
+
         # TODO Need to contemplate whether Corpus objects have Utterance
         # objects or # not. Some of the TestBKW tests currently rely on this
         # for testing.
@@ -241,14 +304,18 @@ class Corpus:
                   utterance_filter: Callable[[Utterance], bool] = None,
                   label_segmenter: Optional[LabelSegmenter] = None,
                   speakers: List[str] = None, lazy: bool = True,
-                  tier_prefixes: Tuple[str, ...] = ("xv", "rf")) -> CorpusT:
+                  tier_prefixes: Tuple[str, ...] = ("xv", "rf"),
+                  packed_feats: bool = False,
+                  cmvn_mode: Optional[str] = None) -> CorpusT:
         """ Construct a `Corpus` from ELAN files.
 
         Args:
             org_dir: A path to the directory containing the unpreprocessed
                 data.
             tgt_dir: A path to the directory where the preprocessed data will
-                be stored.
+                be stored. The utterances parsed from each ELAN file are
+                cached in `<tgt_dir>/elan_cache.json`, so only files that
+                have changed are parsed again when the corpus is recreated.
             feat_type: A string describing the input speech features. For
                        example, "fbank" for log Mel filterbank features.
             label_type: A string describing the transcription labels. For example,
@@ -269,6 +336,11 @@ class Corpus:
                 filter for. For example, if this is `("xv", "rf")`, then tiers
                 named "xv", "xv@Mark", "rf@Rose" would be extracted if they
                 existed.
+            packed_feats: If True, pack the features into a single memory
+                mapped file. See `__init__()`.
+            cmvn_mode: How to normalize the features. See `__init__()`. The
+                speakers of the utterances are written to
+                `<tgt_dir>/speakers.txt` for per-speaker normalization.
 
         """
         # This currently bails out if label_segmenter is not provided
@@ -280,8 +352,11 @@ class Corpus:
             tgt_dir = Path(tgt_dir)
 
         # Read utterances from org_dir.
-        utterances = elan.utterances_from_dir(org_dir,
-                                              tier_prefixes=tier_prefixes)
+        # Files that haven't changed since the last call are read from the
+        # parse cache rather than parsed again.
+        utterances = elan.utterances_from_dir(
+            org_dir, tier_prefixes=tier_prefixes,
+            cache_path=tgt_dir / "elan_cache.json")
 
         # Filter utterances based on some criteria (such as codeswitching).
         if utterance_filter:
@@ -311,9 +386,11 @@ class Corpus:
                                label_type, lazy=lazy)
         # Extracts utterance level WAV information from the input file.
         wav.extract_wavs(utterances, (tgt_dir / "wav"), lazy=lazy)
+        utterance.write_speakers(utterances, tgt_dir / "speakers.txt")
 
         corpus = cls(feat_type, label_type, tgt_dir,
-                     labels=label_segmenter.labels, speakers=speakers)
+                     labels=label_segmenter.labels, speakers=speakers,
+                     packed_feats=packed_feats, cmvn_mode=cmvn_mode)
         corpus.utterances = utterances
         return corpus
 
@@ -374,25 +451,39 @@ class Corpus:
         logger.debug("Preparing input features")
         self.feat_dir.mkdir(parents=True, exist_ok=True)
 
-        should_extract_feats = False
-        for path in self.wav_dir.iterdir():
+        wav_paths = [] # type: List[Path]
+        for path in sorted(self.wav_dir.iterdir()):
             if not path.suffix == ".wav":
                 logger.info("Non wav file found in wav directory: %s", path)
                 continue
-            prefix = os.path.basename(os.path.splitext(str(path))[0])
-            mono16k_wav_path = self.feat_dir / "{}.wav".format(prefix)
-            feat_path = self.feat_dir / "{}.{}.npy".format(prefix, self.feat_type)
-            if not feat_path.is_file():
-                # Then we should extract feats
-                should_extract_feats = True
-                if not mono16k_wav_path.is_file():
-                    feat_extract.convert_wav(path, mono16k_wav_path)
-
-        # TODO Should be extracting feats on a per-file basis. Right now we
-        # check if any feats files don't exist and then do all the feature
-        # extraction.
-        if should_extract_feats:
-            feat_extract.from_dir(self.feat_dir, self.feat_type)
+            wav_paths.append(path)
+        # Only the WAVs lacking feature files are processed.
+        feat_extract.extract_from_wavs(wav_paths, self.feat_dir, self.feat_type,
+                                       keep_wavs=self.keep_mono16k_wavs)
+
+        if self.packed_feats:
+            prefixes = feat_store.feat_prefixes(self.feat_dir, self.feat_type)
+            if feat_store.is_up_to_date(self.feat_dir, self.feat_type, prefixes):
+                self.feat_store = feat_store.PackedFeatStore(self.feat_dir,
+                                                             self.feat_type)
+            else:
+                self.feat_store = feat_store.build(self.feat_dir,
+                                                   self.feat_type, prefixes)
+
+    def prepare_cmvn_stats(self) -> "cmvn.CMVNStats":
+        """ Loads, or computes in a single pass over the features, the
+        global and per-speaker CMVN statistics of the corpus. """
+
+        prefixes = [prefix for prefix in
+                    (self.train_prefixes + self.valid_prefixes + self.test_prefixes
+                     + self.untranscribed_prefixes)
+                    if (self.feat_dir / "{}.{}.npy".format(prefix, self.feat_type)
+                       ).is_file()]
+        load_fn = self.feat_store.load if self.feat_store is not None else None
+        return cmvn.load_or_compute(
+            self.tgt_dir, self.feat_dir, self.feat_type, prefixes,
+            self.train_prefixes, speakers=get_speakers_from_file(self.tgt_dir),
+            per_speaker=self.cmvn_mode == "speaker", load_fn=load_fn)
 
     def make_data_splits(self, max_samples: int) -> None:
         """ Splits the utterances into training, validation and test sets."""
@@ -411,8 +502,7 @@ class Corpus:
         # Otherwise we now need to load prefixes for other cases addressed
         # below
         prefixes = self.determine_prefixes()
-        prefixes = utils.filter_by_size(
-            self.feat_dir, prefixes, self.feat_type, max_samples)
+        prefixes = self.manifest.filter_by_size(prefixes, max_samples)
 
         if not train_f_exists and not valid_f_exists and not test_f_exists:
             logger.debug("No files supplied to define the split for training, validation"
@@ -511,18 +601,18 @@ class Corpus:
     def num_feats(self):
         """ The number of features per time step in the corpus. """
         if not self._num_feats:
-            filename = self.get_train_fns()[0][0]
-            feats = np.load(filename)
-            # pylint: disable=maybe-no-member
-            if len(feats.shape) == 3:
+            [entry] = self.manifest.get(self.train_prefixes[:1])
+            frame_shape = entry.feat_shape
+            if len(frame_shape) == 2:
                 # Then there are multiple channels of multiple feats
-                self._num_feats = feats.shape[1] * feats.shape[2]
-            elif len(feats.shape) == 2:
+                self._num_feats = frame_shape[0] * frame_shape[1]
+            elif len(frame_shape) == 1:
                 # Otherwise it is just of shape time x feats
-                self._num_feats = feats.shape[1]
+                self._num_feats = frame_shape[0]
             else:
                 raise ValueError(
-                    "Feature matrix of shape %s unexpected" % str(feats.shape))
+                    "Feature matrix of shape %s unexpected" % str(
+                        (entry.num_frames,) + frame_shape))
         return self._num_feats
 
     def prefixes_to_fns(self, prefixes: List[str]) -> Tuple[List[str], List[str]]:
@@ -594,7 +684,7 @@ class Corpus:
 
         for prefix in self.determine_prefixes():
             print("Utterance: {}".format(prefix))
-            wav_fn = self.feat_dir / "{}.wav".format(prefix)
+            wav_fn = self.wav_dir / "{}.wav".format(prefix)
             label_fn = self.label_dir / "{}.{}".format(prefix,self.label_type)
             with label_fn.open() as f:
                 transcript = f.read().strip()
@@ -3,15 +3,15 @@ from __future__ import generator_stop
 
 import logging
 import logging.config
+import math
 from pathlib import Path
 import pprint
 import random
-from typing import List, Sequence, Iterator
+from typing import Dict, List, Optional, Sequence, Iterator
 
 import numpy as np
 
 from . import utils
-from .config import ENCODING
 from .exceptions import PersephoneException
 
 logger = logging.getLogger(__name__) # type: ignore
@@ -25,7 +25,11 @@ class CorpusReader:
 
     rand = True
 
-    def __init__(self, corpus, num_train=None, batch_size=None, max_samples=None, rand_seed=0):
+    def __init__(self, corpus, num_train=None, batch_size=None, max_samples=None, rand_seed=0,
+                 *, prefetch_batches: int = 0, num_loaders: int = 1,
+                 max_batch_frames: Optional[int] = None,
+                 reuse_batch_buffers: bool = False,
+                 eval_max_frames: Optional[int] = None) -> None:
         """ Construct a new `CorpusReader` instance.
 
             corpus: The Corpus object that interfaces with a given corpus.
@@ -36,54 +40,75 @@ class CorpusReader:
                          Longer utterances are filtered out.
             rand_seed: The seed for the random number generator. If None, then
                        no randomization is used.
+            prefetch_batches: The number of training batches to load ahead in
+                              background threads while the model trains on
+                              the current batch. If 0, batches are loaded
+                              synchronously.
+            num_loaders: The number of threads used to load batches when
+                         prefetching.
+            max_batch_frames: If supplied, training batches are formed from
+                              utterances of similar length, with each batch
+                              holding as many utterances as fit in this many
+                              padded frames, rather than batch_size
+                              utterances.
+            reuse_batch_buffers: If True, training batches are assembled into
+                                 buffers that are reused between batches of
+                                 the same shape, rather than allocated anew.
+                                 Can't be combined with prefetching.
+            eval_max_frames: The frame budget of the sub-batches that the
+                             validation and test sets are evaluated in by
+                             `valid_batch_gen()` and `test_batch_gen()`.
+                             Utterances are sorted by length and each
+                             sub-batch holds as many as fit in this many
+                             padded frames. If None, sub-batches of
+                             batch_size utterances are used.
         """
 
         self.corpus = corpus
+        self.prefetch_batches = prefetch_batches
+        self.num_loaders = num_loaders
+        #: Time spent waiting for training batches in the most recent epoch.
+        self.prefetch_stats = utils.PrefetchStats()
+        if reuse_batch_buffers and prefetch_batches:
+            raise PersephoneException("Batch buffers can't be reused when"
+                                      " prefetching batches.")
+        self.assembler = utils.BatchAssembler() if reuse_batch_buffers else None
 
         if max_samples:
             logger.critical("max_samples not yet implemented in CorpusReader")
             raise NotImplementedError("Not yet implemented.")
 
-        # TODO This logic should be changed. The number of training instances
-        # doesn't need to be divisible by batch size. The remainder can just go
-        # in its own, smaller batch.
+        # The number of training instances doesn't need to be divisible by
+        # batch size. The remainder goes in its own, smaller batch.
         if not num_train:
             if not batch_size:
                 batch_size = 64
             num_train = len(corpus.get_train_fns()[0])
-            num_batches = int(num_train / batch_size)
-            num_train = int(num_batches * batch_size)
         self.num_train = num_train
-        logger.info("Number of training utterances: {}".format(num_train))
-        logger.info("Batch size: {}".format(batch_size))
-        logger.info("Batches per epoch: {}".format(int(num_train/batch_size)))
-        print("Number of training utterances: {}".format(num_train))
-        print("Batch size: {}".format(batch_size))
-        print("Batches per epoch: {}".format(int(num_train/batch_size)))
 
         if batch_size:
             self.batch_size = batch_size
-            if num_train % batch_size != 0:
-                logger.error("Number of training examples {} not divisible"
-                             " by batch size {}.".format(num_train, batch_size))
-                raise PersephoneException("Number of training examples {} not divisible"
-                                          " by batch size {}.".format(num_train, batch_size))
         else:
             # Dynamically change batch size based on number of training
             # examples.
-            self.batch_size = int(num_train / 32.0)
+            self.batch_size = max(1, int(num_train / 32.0))
             if self.batch_size > 64:
                 # I was getting OOM errors when training with 4096 sents, as
                 # the batch size jumped to 128
                 self.batch_size = 64
-            # For now we hope that training numbers are powers of two or
-            # something... If not, crash before anything else happens.
+        self.max_batch_frames = max_batch_frames
+        self.eval_max_frames = eval_max_frames
 
-            if num_train % self.batch_size != 0:
-                logger.error("Number of training examples {} not divisible"
-                             " by batch size {}.".format(num_train, self.batch_size))
-                raise PersephoneException("Number of training examples {} not divisible"
-                                          " by batch size {}.".format(num_train, batch_size))
+        num_batches = math.ceil(num_train / self.batch_size)
+        logger.info("Number of training utterances: {}".format(num_train))
+        logger.info("Batch size: {}".format(self.batch_size))
+        logger.info("Batches per epoch: {}".format(num_batches))
+        print("Number of training utterances: {}".format(num_train))
+        print("Batch size: {}".format(self.batch_size))
+        print("Batches per epoch: {}".format(num_batches))
+        if max_batch_frames:
+            logger.info("Batching by length with at most %d padded frames per"
+                        " batch", max_batch_frames)
 
         random.seed(rand_seed)
 
@@ -96,9 +121,10 @@ class CorpusReader:
             random.shuffle(self.train_fns)
         self.train_fns = self.train_fns[:self.num_train]
 
-    def load_batch(self, fn_batch):
+    def load_batch(self, fn_batch, assembler=None):
         """ Loads a batch with the given prefixes. The prefixes is the full path to the
-        training example minus the extension.
+        training example minus the extension. If an assembler is supplied, it
+        is used to build the batch of features.
         """
 
         # TODO Assumes targets are available, which is how its distinct from
@@ -110,12 +136,14 @@ class CorpusReader:
         target_fn_batch = inverse[1]
 
         batch_inputs, batch_inputs_lens = utils.load_batch_x(feat_fn_batch,
-                                                             flatten=False)
-        batch_targets_list = []
-        for targets_path in target_fn_batch:
-            with open(targets_path, encoding=ENCODING) as targets_f:
-                target_indices = self.corpus.labels_to_indices(targets_f.readline().split())
-                batch_targets_list.append(target_indices)
+                                                             flatten=False,
+                                                             feat_store=self.corpus.feat_store,
+                                                             assembler=assembler,
+                                                             cmvn_stats=self.corpus.cmvn_stats)
+        # Label indices come from the corpus's pre-encoded label store rather
+        # than re-reading and tokenizing the label files.
+        batch_targets_list = [self.corpus.label_store.load(targets_path)
+                              for targets_path in target_fn_batch]
         batch_targets = utils.target_list_to_sparse_tensor(batch_targets_list)
 
         return batch_inputs, batch_inputs_lens, batch_targets
@@ -126,6 +154,13 @@ class CorpusReader:
 
         return utils.make_batches(utterance_fns, self.batch_size)
 
+    def train_prefixes(self) -> List[str]:
+        """ The prefixes of the utterances in `train_fns`, in the same order."""
+
+        feat_fn_to_prefix = dict(zip(self.corpus.get_train_fns()[0],
+                                     self.corpus.train_prefixes)) # type: Dict[str, str]
+        return [feat_fn_to_prefix[train_fn[0]] for train_fn in self.train_fns]
+
     def train_batch_gen(self) -> Iterator:
         """ Returns a generator that outputs batches in the training data."""
 
@@ -133,17 +168,37 @@ class CorpusReader:
             raise PersephoneException("""No training data available; cannot
                                        generate training batches.""")
 
-        # Create batches of batch_size and shuffle them.
-        fn_batches = self.make_batches(self.train_fns)
-
+        # Create batches of batch_size, or batches of similar length utterances
+        # within a frame budget, and shuffle them.
+        if self.max_batch_frames:
+            train_prefixes = self.train_prefixes()
+            train_lens = [num_frames for _, num_frames in
+                          self.corpus.manifest.prefix_lens(train_prefixes)]
+            fn_batches = utils.make_bucketed_batches(
+                self.train_fns, train_lens, self.max_batch_frames)
+        else:
+            fn_batches = self.make_batches(self.train_fns)
 
         if self.rand:
             random.shuffle(fn_batches)
 
+        if self.prefetch_batches:
+            # The batch order is fixed above, so prefetching doesn't affect
+            # which batches are yielded or in what order.
+            self.prefetch_stats = utils.PrefetchStats()
+            yield from utils.prefetch(self.load_batch, fn_batches,
+                                      buffer_size=self.prefetch_batches,
+                                      num_workers=self.num_loaders,
+                                      stats=self.prefetch_stats)
+            logger.info("Waited %0.3fs for %d prefetched training batches",
+                        self.prefetch_stats.wait_seconds,
+                        self.prefetch_stats.num_items)
+            return
+
         for fn_batch in fn_batches:
             logger.debug("Batch of training filenames: %s",
                           pprint.pformat(fn_batch))
-            yield self.load_batch(fn_batch)
+            yield self.load_batch(fn_batch, assembler=self.assembler)
         else:
             # Python 3.7 compatible way to mark generator as exhausted
             return
@@ -160,6 +215,39 @@ class CorpusReader:
         test_fns = list(zip(*self.corpus.get_test_fns()))
         return self.load_batch(test_fns)
 
+    def eval_index_batches(self, prefixes: Sequence[str]) -> List[List[int]]:
+        """ Splits utterances into sub-batches of similar length for
+        evaluation, returning the indices of the utterances in each. See
+        `eval_max_frames` in `__init__()`. """
+
+        lens = [num_frames for _, num_frames in
+                self.corpus.manifest.prefix_lens(prefixes)]
+        indices = list(range(len(prefixes)))
+        if self.eval_max_frames:
+            return utils.make_bucketed_batches(indices, lens, self.eval_max_frames)
+        indices.sort(key=lambda i: lens[i])
+        return [list(batch) for batch in utils.make_batches(indices, self.batch_size)]
+
+    def _eval_batch_gen(self, fns, prefixes: Sequence[str]) -> Iterator:
+        fns = list(zip(*fns))
+        for index_batch in self.eval_index_batches(prefixes):
+            yield index_batch, self.load_batch([fns[i] for i in index_batch])
+
+    def valid_batch_gen(self) -> Iterator:
+        """ Yields the validation set in memory bounded sub-batches of
+        similar length utterances. Each item is a pair of the indices of the
+        sub-batch's utterances in the validation set and the batch itself, as
+        returned by `load_batch()`. """
+
+        return self._eval_batch_gen(self.corpus.get_valid_fns(),
+                                    self.corpus.valid_prefixes)
+
+    def test_batch_gen(self) -> Iterator:
+        """ As with `valid_batch_gen()`, but for the test set. """
+
+        return self._eval_batch_gen(self.corpus.get_test_fns(),
+                                    self.corpus.test_prefixes)
+
     def untranscribed_batch_gen(self):
         """ A batch generator for all the untranscribed data. """
 
@@ -168,7 +256,9 @@ class CorpusReader:
 
         for fn_batch in fn_batches:
             batch_inputs, batch_inputs_lens = utils.load_batch_x(fn_batch,
-                                                             flatten=False)
+                                                             flatten=False,
+                                                             feat_store=self.corpus.feat_store,
+                                                             cmvn_stats=self.corpus.cmvn_stats)
             yield batch_inputs, batch_inputs_lens, fn_batch
 
     def human_readable_hyp_ref(self, dense_decoded, dense_y):
@@ -205,6 +295,8 @@ class CorpusReader:
         return ("%s(" % self.__class__.__name__ +
                 "num_train=%s,\n" % repr(self.num_train) +
                 "\tbatch_size=%s,\n" % repr(self.batch_size) +
+                "\tmax_batch_frames=%s,\n" % repr(self.max_batch_frames) +
+                "\teval_max_frames=%s,\n" % repr(self.eval_max_frames) +
                 "\tcorpus=\n%s)" % repr(self.corpus))
 
     def calc_time(self) -> None:
@@ -213,17 +305,6 @@ class CorpusReader:
         corpus.
         """
 
-        def get_number_of_frames(feat_fns):
-            """ fns: A list of numpy files which contain a number of feature
-            frames. """
-
-            total = 0
-            for feat_fn in feat_fns:
-                num_frames = len(np.load(feat_fn))
-                total += num_frames
-
-            return total
-
         def numframes_to_minutes(num_frames):
             # TODO Assumes 10ms strides for the frames. This should generalize to
             # different frame stride widths, as should feature preparation.
@@ -232,12 +313,14 @@ class CorpusReader:
 
         total_frames = 0
 
-        train_fns = [train_fn[0] for train_fn in self.train_fns]
-        num_train_frames = get_number_of_frames(train_fns)
+        # The number of frames is read from the corpus manifest rather than
+        # by loading each feature file.
+        manifest = self.corpus.manifest
+        num_train_frames = manifest.total_frames(self.train_prefixes())
         total_frames += num_train_frames
-        num_valid_frames = get_number_of_frames(self.corpus.get_valid_fns()[0])
+        num_valid_frames = manifest.total_frames(self.corpus.valid_prefixes)
         total_frames += num_valid_frames
-        num_test_frames = get_number_of_frames(self.corpus.get_test_fns()[0])
+        num_test_frames = manifest.total_frames(self.corpus.test_prefixes)
         total_frames += num_test_frames
 
         print("Train duration: %0.3f" % numframes_to_minutes(num_train_frames))
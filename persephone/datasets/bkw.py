@@ -12,7 +12,7 @@ from pympi.Elan import Eaf
 
 from .. import corpus
 from .. import config
-from ..preprocess.labels import segment_into_tokens
+from ..preprocess.labels import TokenSegmenter
 from ..utterance import Utterance
 from ..preprocess.labels import LabelSegmenter
 from ..corpus import Corpus
@@ -23,6 +23,7 @@ BASIC_PHONEMES = set(["a", "b", "d", "dj", "rd", "e", "h", "i", "k", "l",
 DOUBLE_STOPS = set(["bb", "dd", "djdj", "rdd", "kk"])
 DIPHTHONGS = set(["ay", "aw", "ey", "ew", "iw", "oy", "ow", "uy"])
 PHONEMES = BASIC_PHONEMES | DOUBLE_STOPS | DIPHTHONGS
+PHONEME_SEGMENTER = TokenSegmenter(PHONEMES)
 
 def pull_en_words() -> None:
     """ Fetches a repository containing English words. """
@@ -101,8 +102,12 @@ def segment_str(text: str, phoneme_inventory: Set[str] = PHONEMES) -> str:
     http://bininjgunwok.org.au/
     """
 
+    if phoneme_inventory is PHONEMES:
+        segmenter = PHONEME_SEGMENTER
+    else:
+        segmenter = TokenSegmenter(phoneme_inventory)
     text = text.lower()
-    text = segment_into_tokens(text, phoneme_inventory)
+    text = segmenter(text)
     return text
 
 bkw_label_segmenter = LabelSegmenter(segment_utterance, PHONEMES)
@@ -221,7 +221,8 @@ def preprocess_french(trans, fr_nlp, remove_brackets_content=True):
 
 def trim_wavs(org_wav_dir=ORG_WAV_DIR,
               tgt_wav_dir=TGT_WAV_DIR,
-              org_xml_dir=ORG_XML_DIR):
+              org_xml_dir=ORG_XML_DIR,
+              sents_cache=None):
     """ Extracts sentence-level transcriptions, translations and wavs from the
     Na Pangloss XML and WAV files. But otherwise doesn't preprocess them."""
 
@@ -243,10 +244,11 @@ def trim_wavs(org_wav_dir=ORG_WAV_DIR,
 
         logging.info("Trimming wavs from {}".format(fn))
 
-        rec_type, _, times, _ = pangloss.get_sents_times_and_translations(path)
+        rec_type, sents = pangloss.load_sents(path, sents_cache)
 
         # Extract the wavs given the times.
-        for i, (start_time, end_time) in enumerate(times):
+        for i, sent in enumerate(sents):
+            start_time, end_time = sent.start_time, sent.end_time
             if prefix.endswith("PLUSEGG"):
                 in_wav_path = os.path.join(org_wav_dir, prefix.upper()[:-len("PLUSEGG")]) + ".wav"
             else:
@@ -264,7 +266,8 @@ def trim_wavs(org_wav_dir=ORG_WAV_DIR,
                             start_time.to(ureg.milliseconds).magnitude,
                             end_time.to(ureg.milliseconds).magnitude)
 
-def prepare_labels(label_type, org_xml_dir=ORG_XML_DIR, label_dir=LABEL_DIR):
+def prepare_labels(label_type, org_xml_dir=ORG_XML_DIR, label_dir=LABEL_DIR,
+                   sents_cache=None):
     """ Prepare the neural network output targets."""
 
     if not os.path.exists(os.path.join(label_dir, "TEXT")):
@@ -276,9 +279,10 @@ def prepare_labels(label_type, org_xml_dir=ORG_XML_DIR, label_dir=LABEL_DIR):
         fn = path.name
         prefix, _ = os.path.splitext(fn)
 
-        rec_type, sents, _, _ = pangloss.get_sents_times_and_translations(str(path))
+        rec_type, pangloss_sents = pangloss.load_sents(path, sents_cache)
         # Write the sentence transcriptions to file
-        sents = [preprocess_na(sent, label_type) for sent in sents]
+        sents = [preprocess_na(sent.transcription, label_type)
+                 for sent in pangloss_sents]
         for i, sent in enumerate(sents):
             if sent.strip() == "":
                 # Then there's no transcription, so ignore this.
@@ -338,7 +342,7 @@ def prepare_untran(feat_type, tgt_dir, untran_dir):
 
 # TODO Consider factoring out as non-Na specific
 def prepare_feats(feat_type, org_wav_dir=ORG_WAV_DIR, feat_dir=FEAT_DIR, tgt_wav_dir=TGT_WAV_DIR,
-                  org_xml_dir=ORG_XML_DIR, label_dir=LABEL_DIR):
+                  org_xml_dir=ORG_XML_DIR, label_dir=LABEL_DIR, sents_cache=None):
     """ Prepare the input features."""
 
     if not os.path.isdir(TGT_DIR):
@@ -355,7 +359,8 @@ def prepare_feats(feat_type, org_wav_dir=ORG_WAV_DIR, feat_dir=FEAT_DIR, tgt_wav
     # Extract utterances from WAVS.
     trim_wavs(org_wav_dir=org_wav_dir,
               tgt_wav_dir=tgt_wav_dir,
-              org_xml_dir=org_xml_dir)
+              org_xml_dir=org_xml_dir,
+              sents_cache=sents_cache)
 
     # TODO Currently assumes that the wav trimming from XML has already been
     # done.
@@ -522,10 +527,14 @@ class Corpus(corpus.Corpus):
         tgt_label_dir = str(tgt_dir / "label")
         tgt_wav_dir = str(tgt_dir / "wav")
         tgt_feat_dir = str(tgt_dir / "feat")
-        prepare_labels(label_type, label_dir=tgt_label_dir)
+        # Shared so that each XML file is only parsed once.
+        sents_cache = pangloss.SentsCache()
+        prepare_labels(label_type, label_dir=tgt_label_dir,
+                       sents_cache=sents_cache)
         prepare_feats(feat_type, tgt_wav_dir=tgt_wav_dir,
                                  feat_dir=tgt_feat_dir,
-                                 label_dir=tgt_label_dir)
+                                 label_dir=tgt_label_dir,
+                                 sents_cache=sents_cache)
         untran_dir = Path(config.NA_PATH) / "untranscribed_wav"
         logging.debug(untran_dir)
         if untran_dir.is_dir(): # pylint: disable=no-member
@@ -0,0 +1,150 @@
+""" A content-addressed cache of extracted features, shared between corpora
+and experiments.
+
+Features are stored under a key derived from a hash of the audio file's
+bytes, the feature type and the parameters of the extraction, so the same
+audio found in different target directories (or decoded again) needn't have
+its features recomputed. Entries are `.npy` files in `<cache_dir>/<xx>/`,
+where `xx` is the first two characters of the key. The modification time of
+an entry records when it was last used, and once the cache grows beyond its
+size cap the least recently used entries are evicted.
+
+The cache is enabled by setting `FEAT_CACHE_DIR` (and optionally
+`FEAT_CACHE_MAX_GB`) in the `[PATHS]` section of settings.ini.
+"""
+
+import hashlib
+import logging
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import List, Optional, Tuple, Union
+
+from . import config
+
+logger = logging.getLogger(__name__) # type: ignore
+
+# Bump this when the feature extraction code changes in a way that changes
+# its output, so that stale features aren't served from existing caches.
+FEATURE_VERSION = 1
+
+class FeatCache:
+    """ A directory of cached feature files with a size cap. """
+
+    def __init__(self, cache_dir: Union[str, Path],
+                 max_bytes: int = 10 * 2**30) -> None:
+        """
+        Args:
+            cache_dir: The directory to keep the cached features in.
+            max_bytes: The size the cache is trimmed to by `evict()`.
+        """
+
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, audio_path: Union[str, Path], feat_type: str,
+            params: str = "") -> str:
+        """ Returns the cache key of the features of the given type extracted
+        from an audio file with the given extraction parameters. """
+
+        digest = hashlib.sha256()
+        with open(str(audio_path), "rb") as audio_f:
+            for block in iter(lambda: audio_f.read(2**20), b""):
+                digest.update(block)
+        audio_hash = digest.hexdigest()
+        return hashlib.sha256("{}:{}:{}:{}".format(
+            audio_hash, feat_type, params, FEATURE_VERSION).encode("utf8")
+                             ).hexdigest()
+
+    def entry_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / "{}.npy".format(key)
+
+    def __contains__(self, key: str) -> bool:
+        return self.entry_path(key).is_file()
+
+    def fetch(self, key: str, feat_path: Union[str, Path]) -> bool:
+        """ Copies the cached features with the given key to feat_path.
+        Returns False if there is no such entry. """
+
+        entry_path = self.entry_path(key)
+        try:
+            shutil.copyfile(str(entry_path), str(feat_path))
+        except FileNotFoundError:
+            return False
+        try:
+            # Mark the entry as recently used.
+            os.utime(str(entry_path))
+        except FileNotFoundError:
+            # Evicted concurrently, but we already have a copy.
+            pass
+        return True
+
+    def put(self, key: str, feat_path: Union[str, Path]) -> None:
+        """ Adds a copy of the feature file at feat_path to the cache. """
+
+        entry_path = self.entry_path(key)
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        # Copy then rename, so that concurrent readers never see a partly
+        # written entry.
+        fd, tmp_path = tempfile.mkstemp(dir=str(entry_path.parent),
+                                        suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(str(feat_path), tmp_path)
+            os.replace(tmp_path, str(entry_path))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def entries(self) -> List[Tuple[float, int, Path]]:
+        """ Returns a (last used time, size, path) triple for each entry. """
+
+        entries = []
+        for entry_path in self.cache_dir.glob("*/*.npy"):
+            try:
+                stat = entry_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry_path))
+        return entries
+
+    def size(self) -> int:
+        """ The total size of the cached features in bytes. """
+
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self) -> int:
+        """ Removes the least recently used entries until the cache is no
+        larger than max_bytes. Returns the number of entries removed. """
+
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        num_evicted = 0
+        for _, size, entry_path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                entry_path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+            num_evicted += 1
+        if num_evicted:
+            logger.info("Evicted %d entries from the feature cache at %s",
+                        num_evicted, self.cache_dir)
+        return num_evicted
+
+    def __repr__(self) -> str:
+        return "{}(cache_dir={!r}, max_bytes={})".format(
+            self.__class__.__name__, str(self.cache_dir), self.max_bytes)
+
+def default_cache() -> Optional[FeatCache]:
+    """ Returns the cache configured in settings.ini, or `None` if no cache
+    directory is configured. """
+
+    if not config.FEAT_CACHE_DIR:
+        return None
+    return FeatCache(config.FEAT_CACHE_DIR,
+                     int(config.FEAT_CACHE_MAX_GB * 2**30))
@@ -0,0 +1,186 @@
+""" A packed store of the features of a corpus, held in a single file so that
+loading utterances doesn't require opening a file per utterance.
+
+The features of all utterances are concatenated along the time axis into one
+float32 array, `<feat_type>.packed.npy`, alongside an index,
+`<feat_type>.packed.json`, which maps each prefix to the offset and number of
+frames of its utterance. The array is memory mapped, so reading an utterance
+is a slice of the mapping rather than a file open.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from . import utils
+from .config import ENCODING
+
+logger = logging.getLogger(__name__) # type: ignore
+
+class PackedFeatStore:
+    """ Read access to the packed features of a corpus. Use `build()` to create
+    the store on disk. """
+
+    def __init__(self, feat_dir: Path, feat_type: str) -> None:
+        self.feat_dir = Path(feat_dir)
+        self.feat_type = feat_type
+        self.index = {} # type: Dict[str, Tuple[int, int]]
+        self._data = None # type: Optional[np.ndarray]
+        with self.index_path.open(encoding=ENCODING) as index_f:
+            self.index = {prefix: (offset, length)
+                          for prefix, (offset, length) in json.load(index_f).items()}
+
+    @property
+    def data_path(self) -> Path:
+        return packed_data_path(self.feat_dir, self.feat_type)
+
+    @property
+    def index_path(self) -> Path:
+        return packed_index_path(self.feat_dir, self.feat_type)
+
+    @property
+    def data(self) -> np.ndarray:
+        """ The memory mapped array of all frames. Mapped on first access."""
+
+        if self._data is None:
+            self._data = np.load(str(self.data_path), mmap_mode="r")
+        return self._data
+
+    def __getstate__(self) -> Dict:
+        # Don't pickle the memory map; it gets remapped when next needed.
+        state = self.__dict__.copy()
+        state["_data"] = None
+        return state
+
+    def __contains__(self, prefix: str) -> bool:
+        return prefix in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get(self, prefix: str) -> np.ndarray:
+        """ Returns the features of the utterance as a read-only view into the
+        memory mapped store. """
+
+        offset, length = self.index[prefix]
+        return self.data[offset:offset+length]
+
+    def path_to_prefix(self, feat_path: Union[str, Path]) -> Optional[str]:
+        """ Converts the path to a per-utterance feature file in the feature
+        directory into the prefix of that utterance, or `None` if the path
+        isn't of that form. """
+
+        feat_path = Path(feat_path)
+        suffix = ".{}.npy".format(self.feat_type)
+        if not feat_path.name.endswith(suffix):
+            return None
+        try:
+            rel_path = feat_path.relative_to(self.feat_dir)
+        except ValueError:
+            return None
+        return str(rel_path)[:-len(suffix)]
+
+    def load(self, feat_path: Union[str, Path]) -> np.ndarray:
+        """ Loads the features found at a per-utterance feature file path,
+        reading from the store if it contains the utterance and falling back to
+        the `.npy` file otherwise. """
+
+        prefix = self.path_to_prefix(feat_path)
+        if prefix is not None and prefix in self.index:
+            return self.get(prefix)
+        return np.load(str(feat_path))
+
+    def __repr__(self) -> str:
+        return "{}(feat_dir={!r}, feat_type={!r})".format(
+            self.__class__.__name__, str(self.feat_dir), self.feat_type)
+
+def packed_data_path(feat_dir: Path, feat_type: str) -> Path:
+    return Path(feat_dir) / "{}.packed.npy".format(feat_type)
+
+def packed_index_path(feat_dir: Path, feat_type: str) -> Path:
+    return Path(feat_dir) / "{}.packed.json".format(feat_type)
+
+def feat_prefixes(feat_dir: Path, feat_type: str) -> List[str]:
+    """ Returns the prefixes of all the per-utterance feature files in a
+    directory, searching recursively, in sorted order. """
+
+    feat_dir = Path(feat_dir)
+    suffix = ".{}.npy".format(feat_type)
+    return sorted(str(path.relative_to(feat_dir))[:-len(suffix)]
+                  for path in feat_dir.glob("**/*" + suffix))
+
+def is_up_to_date(feat_dir: Path, feat_type: str,
+                  prefixes: Sequence[str]) -> bool:
+    """ True if a packed store exists that holds exactly the given prefixes
+    and is newer than all of their feature files; False otherwise. """
+
+    data_path = packed_data_path(feat_dir, feat_type)
+    index_path = packed_index_path(feat_dir, feat_type)
+    if not data_path.is_file() or not index_path.is_file():
+        return False
+    with index_path.open(encoding=ENCODING) as index_f:
+        if set(json.load(index_f)) != set(prefixes):
+            return False
+    packed_mtime = data_path.stat().st_mtime
+    feat_dir = Path(feat_dir)
+    for prefix in prefixes:
+        feat_path = feat_dir / "{}.{}.npy".format(prefix, feat_type)
+        if feat_path.stat().st_mtime > packed_mtime:
+            return False
+    return True
+
+def build(feat_dir: Path, feat_type: str,
+          prefixes: Optional[Sequence[str]] = None) -> PackedFeatStore:
+    """ Packs the per-utterance feature files in feat_dir into a single
+    float32 array and writes its index. The per-utterance files are left in
+    place.
+
+    Args:
+        feat_dir: The directory containing `<prefix>.<feat_type>.npy` files.
+        feat_type: The type of features to pack.
+        prefixes: The utterances to pack. If `None`, every feature file of
+            the given type in feat_dir is packed.
+
+    Returns:
+        A `PackedFeatStore` for reading from the newly built store.
+    """
+
+    feat_dir = Path(feat_dir)
+    if prefixes is None:
+        prefixes = feat_prefixes(feat_dir, feat_type)
+    feat_paths = [feat_dir / "{}.{}.npy".format(prefix, feat_type)
+                  for prefix in prefixes]
+    shapes = [utils.npy_shape(path) for path in feat_paths]
+    frame_shapes = set(shape[1:] for shape in shapes)
+    if len(frame_shapes) > 1:
+        raise ValueError("Feature files in {} have inconsistent frame shapes:"
+                         " {}".format(feat_dir, frame_shapes))
+    frame_shape = frame_shapes.pop() if frame_shapes else ()
+
+    logger.info("Packing %s features of %d utterances in %s",
+                feat_type, len(feat_paths), feat_dir)
+    index = {} # type: Dict[str, Tuple[int, int]]
+    data_path = packed_data_path(feat_dir, feat_type)
+    tmp_data_path = data_path.with_name(data_path.name + ".tmp")
+    total_frames = sum(shape[0] for shape in shapes)
+    data = np.lib.format.open_memmap(
+        str(tmp_data_path), mode="w+", dtype=np.float32,
+        shape=(total_frames,) + tuple(frame_shape))
+    offset = 0
+    for prefix, feat_path, shape in zip(prefixes, feat_paths, shapes):
+        data[offset:offset+shape[0]] = np.load(str(feat_path))
+        index[prefix] = (offset, shape[0])
+        offset += shape[0]
+    data.flush()
+    del data
+    os.replace(str(tmp_data_path), str(data_path))
+
+    index_path = packed_index_path(feat_dir, feat_type)
+    with index_path.open("w", encoding=ENCODING) as index_f:
+        json.dump(index, index_f)
+
+    return PackedFeatStore(feat_dir, feat_type)
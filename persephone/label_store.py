@@ -0,0 +1,153 @@
+""" A store of the transcriptions of a corpus, pre-encoded as label indices so
+that label files needn't be re-read and re-tokenized every epoch.
+
+The indices of all transcriptions are concatenated into a single int32
+array, with an array of offsets delimiting the transcription of each prefix.
+The store is saved to `<tgt_dir>/labels.<label_type>.npz`.
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from .config import ENCODING
+
+logger = logging.getLogger(__name__) # type: ignore
+
+class LabelStore:
+    """ Label indices of the transcriptions of a set of utterances. """
+
+    def __init__(self, label_dir: Path, label_type: str,
+                 prefixes: Sequence[str], values: np.ndarray,
+                 offsets: np.ndarray, labels: Sequence[str]) -> None:
+        """
+        Args:
+            label_dir: The directory containing the label files.
+            label_type: The extension of the label files.
+            prefixes: The prefixes of the utterances in the store.
+            values: The label indices of all utterances, concatenated.
+            offsets: An array of len(prefixes) + 1 positions in values, where
+                the indices of the ith utterance are
+                values[offsets[i]:offsets[i+1]].
+            labels: The label set used for the encoding, in index order.
+        """
+
+        self.label_dir = Path(label_dir)
+        self.label_type = label_type
+        self.prefix_to_i = {prefix: i for i, prefix in enumerate(prefixes)} # type: Dict[str, int]
+        self.values = values
+        self.offsets = offsets
+        self.labels = list(labels)
+
+    @property
+    def prefixes(self) -> List[str]:
+        return sorted(self.prefix_to_i, key=self.prefix_to_i.__getitem__)
+
+    def __contains__(self, prefix: str) -> bool:
+        return prefix in self.prefix_to_i
+
+    def __len__(self) -> int:
+        return len(self.prefix_to_i)
+
+    def get(self, prefix: str) -> np.ndarray:
+        """ Returns the label indices of the utterance's transcription. """
+
+        i = self.prefix_to_i[prefix]
+        return self.values[self.offsets[i]:self.offsets[i+1]]
+
+    def path_to_prefix(self, label_path: Union[str, Path]) -> Optional[str]:
+        """ Converts the path to a label file in the label directory into the
+        prefix of that utterance, or `None` if the path isn't of that form."""
+
+        label_path = Path(label_path)
+        suffix = ".{}".format(self.label_type)
+        if not label_path.name.endswith(suffix):
+            return None
+        try:
+            rel_path = label_path.relative_to(self.label_dir)
+        except ValueError:
+            return None
+        return str(rel_path)[:-len(suffix)]
+
+    def load(self, label_path: Union[str, Path]) -> np.ndarray:
+        """ Returns the label indices for the transcription at the given label
+        file path, reading and encoding the file if the utterance isn't in
+        the store. """
+
+        prefix = self.path_to_prefix(label_path)
+        if prefix is not None and prefix in self.prefix_to_i:
+            return self.get(prefix)
+        label_to_index = {label: index for index, label in enumerate(self.labels)}
+        return encode_label_file(Path(label_path), label_to_index)
+
+    def save(self, path: Path) -> None:
+        """ Saves the store to an .npz file. """
+
+        np.savez(str(path), prefixes=np.array(self.prefixes, dtype=str),
+                 values=self.values, offsets=self.offsets,
+                 labels=np.array(self.labels, dtype=str))
+
+    @classmethod
+    def from_file(cls, path: Path, label_dir: Path,
+                  label_type: str) -> "LabelStore":
+        with np.load(str(path)) as npz:
+            return cls(label_dir, label_type, list(npz["prefixes"]),
+                       npz["values"], npz["offsets"], list(npz["labels"]))
+
+    def __repr__(self) -> str:
+        return "{}(label_dir={!r}, label_type={!r}, num_utterances={})".format(
+            self.__class__.__name__, str(self.label_dir), self.label_type,
+            len(self))
+
+def encode_label_file(label_path: Path, label_to_index: Dict[str, int]) -> np.ndarray:
+    """ Reads a label file and converts its tokens into label indices. """
+
+    with label_path.open(encoding=ENCODING) as label_f:
+        return np.array([label_to_index[label]
+                         for label in label_f.readline().split()],
+                        dtype=np.int32)
+
+def store_path(tgt_dir: Path, label_type: str) -> Path:
+    return Path(tgt_dir) / "labels.{}.npz".format(label_type)
+
+def build(label_dir: Path, label_type: str, label_to_index: Dict[str, int],
+          prefixes: Sequence[str]) -> LabelStore:
+    """ Encodes the label files of the given prefixes into a `LabelStore`. """
+
+    label_dir = Path(label_dir)
+    encoded = [encode_label_file(
+                   label_dir / "{}.{}".format(prefix, label_type), label_to_index)
+               for prefix in prefixes]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(indices) for indices in encoded], out=offsets[1:])
+    if encoded:
+        values = np.concatenate(encoded).astype(np.int32)
+    else:
+        values = np.zeros(0, dtype=np.int32)
+    labels = sorted(label_to_index, key=label_to_index.__getitem__)
+    return LabelStore(label_dir, label_type, prefixes, values, offsets, labels)
+
+def load_or_build(tgt_dir: Path, label_type: str, label_to_index: Dict[str, int],
+                  prefixes: Sequence[str]) -> LabelStore:
+    """ Loads the label store saved in tgt_dir if it holds the given prefixes,
+    uses the same label encoding and is newer than all the label files.
+    Otherwise builds and saves a new store. """
+
+    label_dir = Path(tgt_dir) / "label"
+    path = store_path(tgt_dir, label_type)
+    labels = sorted(label_to_index, key=label_to_index.__getitem__)
+    if path.is_file():
+        store = LabelStore.from_file(path, label_dir, label_type)
+        store_mtime = path.stat().st_mtime
+        if (store.labels == labels and set(store.prefixes) == set(prefixes)
+                and all((label_dir / "{}.{}".format(prefix, label_type)
+                        ).stat().st_mtime <= store_mtime
+                        for prefix in prefixes)):
+            return store
+    logger.info("Encoding %d %s label files into %s", len(prefixes),
+                label_type, path)
+    store = build(label_dir, label_type, label_to_index, prefixes)
+    store.save(path)
+    return store
@@ -0,0 +1,172 @@
+""" A persisted record of the size of each utterance in a corpus, so that
+sorting and filtering utterances by length doesn't require loading every
+feature matrix from disk."""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from . import utils
+from .config import ENCODING
+
+logger = logging.getLogger(__name__) # type: ignore
+
+ManifestEntry = NamedTuple("ManifestEntry",
+                           [("num_frames", int),
+                            ("feat_shape", Tuple[int, ...]),
+                            ("label_len", Optional[int]),
+                            ("feat_mtime", float),
+                            ("feat_size", int),
+                            ("label_mtime", Optional[float]),
+                            ("label_size", Optional[int])])
+ManifestEntry.__doc__ = (
+    """ An immutable record of the size of a single utterance.
+
+    Attributes:
+        num_frames: The number of feature frames in the utterance.
+        feat_shape: The shape of each frame of the feature matrix (ie. the
+            shape of the matrix excluding the time dimension).
+        label_len: The number of tokens in the transcription, or `None` if the
+            utterance is untranscribed.
+        feat_mtime: The modification time of the feature file when the entry
+            was recorded.
+        feat_size: The size in bytes of the feature file when the entry was
+            recorded.
+        label_mtime: As with `feat_mtime`, but for the label file.
+        label_size: As with `feat_size`, but for the label file.
+    """)
+
+class FeatManifest:
+    """ A per-corpus manifest of utterance sizes, stored as JSON in the target
+    directory of the corpus and keyed by utterance prefix.
+
+    Entries are created lazily when requested and are refreshed if the
+    modification time or size of the underlying feature or label file has
+    changed. Feature matrices are never fully loaded; only the `.npy` header
+    is read.
+    """
+
+    def __init__(self, tgt_dir: Path, feat_type: str, label_type: str) -> None:
+        self.tgt_dir = Path(tgt_dir)
+        self.feat_type = feat_type
+        self.label_type = label_type
+        self.entries = {} # type: Dict[str, ManifestEntry]
+        self.load()
+
+    @property
+    def path(self) -> Path:
+        return self.tgt_dir / "manifest.{}.{}.json".format(
+            self.feat_type, self.label_type)
+
+    def feat_path(self, prefix: str) -> Path:
+        return self.tgt_dir / "feat" / "{}.{}.npy".format(prefix, self.feat_type)
+
+    def label_path(self, prefix: str) -> Path:
+        return self.tgt_dir / "label" / "{}.{}".format(prefix, self.label_type)
+
+    def load(self) -> None:
+        """ Reads previously recorded entries from disk, if there are any."""
+
+        if not self.path.is_file():
+            return
+        try:
+            with self.path.open(encoding=ENCODING) as manifest_f:
+                raw_entries = json.load(manifest_f)
+        except ValueError:
+            logger.warning("Ignoring corrupt manifest %s", self.path)
+            return
+        for prefix, fields in raw_entries.items():
+            fields["feat_shape"] = tuple(fields["feat_shape"])
+            self.entries[prefix] = ManifestEntry(**fields)
+
+    def save(self) -> None:
+        """ Writes the entries to disk. """
+
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with tmp_path.open("w", encoding=ENCODING) as manifest_f:
+            json.dump({prefix: entry._asdict()
+                       for prefix, entry in self.entries.items()},
+                      manifest_f)
+        os.replace(str(tmp_path), str(self.path))
+
+    def _is_current(self, entry: ManifestEntry, feat_stat: os.stat_result,
+                    label_stat: Optional[os.stat_result]) -> bool:
+        if (entry.feat_mtime, entry.feat_size) != (feat_stat.st_mtime,
+                                                   feat_stat.st_size):
+            return False
+        if label_stat is None:
+            return entry.label_len is None
+        return (entry.label_mtime, entry.label_size) == (label_stat.st_mtime,
+                                                         label_stat.st_size)
+
+    def _make_entry(self, prefix: str, feat_stat: os.stat_result,
+                    label_stat: Optional[os.stat_result]) -> ManifestEntry:
+        shape = utils.npy_shape(self.feat_path(prefix))
+        label_len = None
+        if label_stat is not None:
+            with self.label_path(prefix).open(encoding=ENCODING) as label_f:
+                label_len = len(label_f.readline().split())
+        return ManifestEntry(num_frames=shape[0],
+                             feat_shape=tuple(shape[1:]),
+                             label_len=label_len,
+                             feat_mtime=feat_stat.st_mtime,
+                             feat_size=feat_stat.st_size,
+                             label_mtime=label_stat.st_mtime if label_stat else None,
+                             label_size=label_stat.st_size if label_stat else None)
+
+    def get(self, prefixes: Sequence[str]) -> List[ManifestEntry]:
+        """ Returns the entries for the given prefixes, creating or refreshing
+        entries for those whose files are new or have changed. The manifest is
+        saved to disk if anything was updated."""
+
+        entries = []
+        updated = 0
+        for prefix in prefixes:
+            feat_stat = os.stat(str(self.feat_path(prefix)))
+            try:
+                label_stat = os.stat(str(self.label_path(prefix))) # type: Optional[os.stat_result]
+            except FileNotFoundError:
+                label_stat = None
+            entry = self.entries.get(prefix)
+            if entry is None or not self._is_current(entry, feat_stat, label_stat):
+                entry = self._make_entry(prefix, feat_stat, label_stat)
+                self.entries[prefix] = entry
+                updated += 1
+            entries.append(entry)
+        if updated:
+            logger.debug("Updated %d manifest entries in %s", updated, self.path)
+            self.save()
+        return entries
+
+    def prefix_lens(self, prefixes: Sequence[str]) -> List[Tuple[str, int]]:
+        """ Returns (prefix, number of frames) pairs for the given prefixes."""
+
+        return [(prefix, entry.num_frames)
+                for prefix, entry in zip(prefixes, self.get(prefixes))]
+
+    def filter_by_size(self, prefixes: Sequence[str],
+                       max_samples: int) -> List[str]:
+        """ Returns the prefixes of utterances with at most max_samples
+        frames, preserving order."""
+
+        return [prefix for prefix, length in self.prefix_lens(prefixes)
+                if length <= max_samples]
+
+    def sort_by_size(self, prefixes: Sequence[str]) -> List[str]:
+        """ Returns the prefixes sorted by number of frames."""
+
+        prefix_lens = self.prefix_lens(prefixes)
+        prefix_lens.sort(key=lambda prefix_len: prefix_len[1])
+        return [prefix for prefix, _ in prefix_lens]
+
+    def total_frames(self, prefixes: Sequence[str]) -> int:
+        """ The total number of frames across the given prefixes."""
+
+        return sum(entry.num_frames for entry in self.get(prefixes))
+
+    def __repr__(self) -> str:
+        return "{}(tgt_dir={!r}, feat_type={!r}, label_type={!r})".format(
+            self.__class__.__name__, str(self.tgt_dir), self.feat_type,
+            self.label_type)
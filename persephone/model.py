@@ -7,7 +7,8 @@ import math
 import os
 from pathlib import Path
 import sys
-from typing import Callable, Optional, Union, Sequence, Set, List, Dict
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
 
 import tensorflow as tf
 
@@ -15,12 +16,13 @@ from .preprocess import labels, feat_extract
 from . import utils
 from . import config
 from .config import ENCODING
+from .cmvn import CMVNStats
 from .corpus import Corpus
 from .exceptions import PersephoneException
 from .corpus_reader import CorpusReader
+from .session_config import SessionConfig, config_proto
 
-allow_growth_config = tf.ConfigProto(log_device_placement=False)
-allow_growth_config.gpu_options.allow_growth = True #pylint: disable=no-member
+allow_growth_config = SessionConfig().to_proto()
 
 logger = logging.getLogger(__name__) # type: ignore
 
@@ -31,6 +33,9 @@ def load_metagraph(model_path_prefix: Union[str, Path]) -> tf.train.Saver:
     """
 
     model_path_prefix = str(model_path_prefix)
+    # tf.contrib is loaded lazily, but its ops must be registered before a
+    # graph using block or fused LSTM cells can be imported.
+    tf.contrib.rnn # pylint: disable=pointless-statement
     metagraph = tf.train.import_meta_graph(model_path_prefix + ".meta")
     return metagraph
 
@@ -53,18 +58,45 @@ def decode_corpus(model_path_prefix: Union[str, Path],
                   feat_dir: Optional[Path]=None,
                   batch_x_name: str="batch_x:0",
                   batch_x_lens_name: str="batch_x_lens:0",
-                  output_name: str="hyp_dense_decoded:0") -> List[List[str]]:
+                  output_name: str="hyp_dense_decoded:0",
+                  session_config: Union[None, SessionConfig, tf.ConfigProto]=None
+                  ) -> List[List[str]]:
+    return [transcript for _, transcript in decode_corpus_iter(
+        model_path_prefix,
+        corpus,
+        batch_size=batch_size,
+        feat_dir=feat_dir,
+        batch_x_name=batch_x_name,
+        batch_x_lens_name=batch_x_lens_name,
+        output_name=output_name,
+        session_config=session_config)]
+
+def decode_corpus_iter(model_path_prefix: Union[str, Path],
+                       corpus: Corpus,
+                       *,
+                       batch_size: int = 64,
+                       feat_dir: Optional[Path]=None,
+                       batch_x_name: str="batch_x:0",
+                       batch_x_lens_name: str="batch_x_lens:0",
+                       output_name: str="hyp_dense_decoded:0",
+                       session_config: Union[None, SessionConfig, tf.ConfigProto]=None
+                       ) -> Iterator[Tuple[Path, List[str]]]:
+    """ Decodes the untranscribed WAVs of a corpus, yielding (WAV path,
+    transcript) pairs as they are decoded. See `decode_iter()`."""
+
     input_paths = [Path(corpus.tgt_dir) / "wav" / Path(prefix + ".wav")
                    for prefix in corpus.untranscribed_prefixes]
-    return decode(model_path_prefix,
-           input_paths,
-           label_set=corpus.labels,
-           feature_type=corpus.feat_type,
-           batch_size=batch_size,
-           feat_dir=feat_dir,
-           batch_x_name=batch_x_name,
-           batch_x_lens_name=batch_x_lens_name,
-           output_name=output_name)
+    return decode_iter(model_path_prefix,
+                       input_paths,
+                       label_set=corpus.labels,
+                       feature_type=corpus.feat_type,
+                       batch_size=batch_size,
+                       feat_dir=feat_dir,
+                       batch_x_name=batch_x_name,
+                       batch_x_lens_name=batch_x_lens_name,
+                       output_name=output_name,
+                       cmvn_stats=corpus.cmvn_stats,
+                       session_config=session_config)
 
 def decode(model_path_prefix: Union[str, Path],
            input_paths: Sequence[Path],
@@ -75,10 +107,51 @@ def decode(model_path_prefix: Union[str, Path],
            feat_dir: Optional[Path]=None,
            batch_x_name: str="batch_x:0",
            batch_x_lens_name: str="batch_x_lens:0",
-           output_name: str="hyp_dense_decoded:0") -> List[List[str]]:
+           output_name: str="hyp_dense_decoded:0",
+           cmvn_stats: Optional[CMVNStats]=None,
+           session_config: Union[None, SessionConfig, tf.ConfigProto]=None
+           ) -> List[List[str]]:
     """Use an existing tensorflow model that exists on disk to decode
     WAV files.
 
+    Returns a transcript for each of the input_paths, in order. See
+    `decode_iter()` for the arguments, and for a version that yields
+    transcripts as they are decoded rather than collecting them.
+    """
+
+    return [transcript for _, transcript in decode_iter(
+        model_path_prefix,
+        input_paths,
+        label_set,
+        feature_type=feature_type,
+        batch_size=batch_size,
+        feat_dir=feat_dir,
+        batch_x_name=batch_x_name,
+        batch_x_lens_name=batch_x_lens_name,
+        output_name=output_name,
+        cmvn_stats=cmvn_stats,
+        session_config=session_config)]
+
+def decode_iter(model_path_prefix: Union[str, Path],
+                input_paths: Sequence[Path],
+                label_set: Set[str],
+                *,
+                feature_type: str = "fbank",
+                batch_size: int = 64,
+                feat_dir: Optional[Path]=None,
+                batch_x_name: str="batch_x:0",
+                batch_x_lens_name: str="batch_x_lens:0",
+                output_name: str="hyp_dense_decoded:0",
+                cmvn_stats: Optional[CMVNStats]=None,
+                session_config: Union[None, SessionConfig, tf.ConfigProto]=None
+                ) -> Iterator[Tuple[Path, List[str]]]:
+    """Use an existing tensorflow model that exists on disk to decode
+    WAV files, yielding an (input path, transcript) pair for each WAV file.
+
+    Features are loaded and decoded one batch at a time, and the transcripts
+    of a batch are yielded as soon as it has been decoded, so memory use is
+    bounded by the batch size rather than the number of input paths.
+
     Args:
         model_path_prefix: The path to the saved tensorflow model.
                            This is the full prefix to the ".ckpt" file.
@@ -88,11 +161,16 @@ def decode(model_path_prefix: Union[str, Path],
         feature_type: The type of features this model uses.
                       Note that this MUST match the type of features that the
                       model was trained on initially.
+        batch_size: The number of WAV files decoded at a time.
         feat_dir: Any files that require preprocessing will be
                                   saved to the path specified by this.
         batch_x_name: The name of the tensorflow input for batch_x
         batch_x_lens_name: The name of the tensorflow input for batch_x_lens
         output_name: The name of the tensorflow output
+        cmvn_stats: The `CMVNStats` that the model's training features were
+                    normalized with, if any.
+        session_config: The `SessionConfig` (or `tf.ConfigProto`) of the
+                        session the model is restored into.
     """
 
     if not input_paths:
@@ -107,6 +185,7 @@ def decode(model_path_prefix: Union[str, Path],
             )
 
     preprocessed_file_paths = []
+    wavs_to_extract = []
     for p in input_paths:
         prefix = p.stem
         # Check the "feat" directory as per the filesystem conventions of a Corpus
@@ -118,40 +197,37 @@ def decode(model_path_prefix: Union[str, Path],
         else:
             if not feat_dir:
                 feat_dir = p.parent.parent / "feat"
-            if not feat_dir.is_dir():
-                os.makedirs(str(feat_dir))
-
-            mono16k_wav_path = feat_dir / "{}.wav".format(prefix)
             feat_path = feat_dir / "{}.{}.npy".format(prefix, feature_type)
-            feat_extract.convert_wav(p, mono16k_wav_path)
+            wavs_to_extract.append(p)
             preprocessed_file_paths.append(feat_path)
     # preprocess the file that weren't found in the features directory
     # as per the filesystem conventions
-    if feat_dir:
-        feat_extract.from_dir(feat_dir, feature_type)
+    if wavs_to_extract:
+        feat_extract.extract_from_wavs(wavs_to_extract, feat_dir, feature_type)
 
     fn_batches = utils.make_batches(preprocessed_file_paths, batch_size)
+    input_path_batches = utils.make_batches(input_paths, batch_size)
+    indices_to_labels = labels.make_indices_to_labels(label_set)
     # Load the model and perform decoding.
     metagraph = load_metagraph(model_path_prefix)
-    with tf.Session() as sess:
+    with tf.Session(config=config_proto(session_config)) as sess:
         metagraph.restore(sess, model_path_prefix)
 
-        for fn_batch in fn_batches:
-            batch_x, batch_x_lens = utils.load_batch_x(fn_batch)
-
-        # TODO These placeholder names should be a backup if names from a newer
-        # naming scheme aren't present. Otherwise this won't generalize to
-        # different architectures.
-        feed_dict = {batch_x_name: batch_x,
-                     batch_x_lens_name: batch_x_lens}
+        for fn_batch, input_path_batch in zip(fn_batches, input_path_batches):
+            batch_x, batch_x_lens = utils.load_batch_x(fn_batch,
+                                                       cmvn_stats=cmvn_stats)
 
-        dense_decoded = sess.run(output_name, feed_dict=feed_dict)
+            # TODO These placeholder names should be a backup if names from a newer
+            # naming scheme aren't present. Otherwise this won't generalize to
+            # different architectures.
+            feed_dict = {batch_x_name: batch_x,
+                         batch_x_lens_name: batch_x_lens}
 
-    # Create a human-readable representation of the decoded.
-    indices_to_labels = labels.make_indices_to_labels(label_set)
-    human_readable = dense_to_human_readable(dense_decoded, indices_to_labels)
+            dense_decoded = sess.run(output_name, feed_dict=feed_dict)
 
-    return human_readable
+            # Create a human-readable representation of the decoded.
+            human_readable = dense_to_human_readable(dense_decoded, indices_to_labels)
+            yield from zip(input_path_batch, human_readable)
 
 class Model:
     """ Generic model for our ASR tasks.
@@ -174,10 +250,28 @@ class Model:
         ler: Label error rate.
         dense_decoded: Dense representation of the model transcription output.
         dense_ref: Dense representation of the reference transcription.
+        valid_ler: Label error rate from the (typically cheaper) decoder used
+                   to monitor training. If `None`, `ler` is used.
+        valid_dense_decoded: As with `dense_decoded`, but from the decoder
+                             used to monitor training. If `None`,
+                             `dense_decoded` is used.
+        edit_distances: The unnormalized edit distance of each utterance's
+                        hypothesis from its reference. If `None`, edit
+                        distances are computed from `dense_decoded`.
+        valid_edit_distances: As with `edit_distances`, but from the decoder
+                              used to monitor training.
+        train_ler: The label error rate of a training batch, computed
+                   alongside `optimizer`. If `None`, the LER used to monitor
+                   training is run on the batch instead.
         saved_model_path: Path to where the Tensorflow model is being saved on disk.
+        session_config: The `SessionConfig` of the sessions that the model is
+                        trained, evaluated and decoded in, unless overridden
+                        by the method's own session_config argument.
     """
 
-    def __init__(self, exp_dir: Union[Path, str], corpus_reader: CorpusReader) -> None:
+    def __init__(self, exp_dir: Union[Path, str], corpus_reader: CorpusReader,
+                 session_config: Union[None, SessionConfig, tf.ConfigProto]=None
+                 ) -> None:
         self.exp_dir = str(exp_dir) if isinstance(exp_dir, Path) else exp_dir # type: str
         self.corpus_reader = corpus_reader
         self.log_softmax = None
@@ -188,15 +282,33 @@ class Model:
         self.ler = None
         self.dense_decoded = None
         self.dense_ref = None
+        self.valid_ler = None
+        self.valid_dense_decoded = None
+        self.valid_decoder = "full"
+        self.edit_distances = None
+        self.valid_edit_distances = None
+        self.train_ler = None
         self.saved_model_path = "" # type: str
+        self.session_config = session_config
+
+    def session_config_proto(self, session_config: Union[
+            None, SessionConfig, tf.ConfigProto]=None) -> tf.ConfigProto:
+        """ Returns the `tf.ConfigProto` of session_config, falling back to
+        the model's own session configuration. """
+
+        if session_config is None:
+            session_config = self.session_config
+        return config_proto(session_config)
 
-    def transcribe(self, restore_model_path: Optional[str]=None) -> None:
+    def transcribe(self, restore_model_path: Optional[str]=None,
+                   session_config: Union[None, SessionConfig, tf.ConfigProto]=None
+                   ) -> None:
         """ Transcribes an untranscribed dataset. Similar to eval() except
         no reference translation is assumed, thus no LER is calculated.
         """
 
         saver = tf.train.Saver()
-        with tf.Session(config=allow_growth_config) as sess:
+        with tf.Session(config=self.session_config_proto(session_config)) as sess:
             if restore_model_path:
                 saver.restore(sess, restore_model_path)
             else:
@@ -233,10 +345,10 @@ class Model:
                         print(" ".join(hyp), file=hyps_f)
                         print("", file=hyps_f)
 
-    def decode(self):
+    def decode(self, session_config: Union[None, SessionConfig, tf.ConfigProto]=None):
         model_path_prefix = Path(self.exp_dir) / "model" / "model_best.ckpt"
         prefixes = self.corpus_reader.corpus.untranscribed_prefixes
-        input_paths = [self.corpus_reader.corpus.tgt_dir / "feat" / Path(p + ".wav")
+        input_paths = [self.corpus_reader.corpus.wav_dir / Path(p + ".wav")
                        for p in prefixes]
         label_set = self.corpus_reader.corpus.labels
         feature_type = self.corpus_reader.corpus.feat_type
@@ -251,13 +363,67 @@ class Model:
                batch_size=batch_size,
                batch_x_name=batch_x_name,
                batch_x_lens_name=batch_x_lens_name,
-               output_name=output_name)
+               output_name=output_name,
+               cmvn_stats=self.corpus_reader.corpus.cmvn_stats,
+               session_config=self.session_config_proto(session_config))
  
-    def eval(self, restore_model_path: Optional[str]=None) -> None:
+    def evaluate_batches(self, sess: tf.Session, batch_gen: Iterator,
+                         dense_decoded: tf.Tensor,
+                         edit_distances: Optional[tf.Tensor]
+                         ) -> Tuple[float, List[List[str]], List[List[str]]]:
+        """ Decodes a dataset one sub-batch at a time, so that memory use is
+        bounded by the size of the largest sub-batch rather than of the whole
+        dataset.
+
+        Args:
+            sess: The session holding the model's variables.
+            batch_gen: Yields (indices, (batch_x, batch_x_lens, batch_y))
+                pairs, as from `CorpusReader.valid_batch_gen()`.
+            dense_decoded: The decoder output to fetch.
+            edit_distances: The edit distances of the same decoder, or `None`
+                to compute them from the hypotheses.
+
+        Returns:
+            The label error rate over the whole dataset, and the hypotheses
+            and references in the dataset's original order.
+        """
+
+        totals = utils.EditDistanceTotals()
+        hyp_refs = {} # type: Dict[int, Tuple[List[str], List[str]]]
+        for index_batch, (batch_x, batch_x_lens, batch_y) in batch_gen:
+            feed_dict = {self.batch_x: batch_x,
+                         self.batch_x_lens: batch_x_lens,
+                         self.batch_y: batch_y}
+            fetches = [dense_decoded, self.dense_ref]
+            if edit_distances is not None:
+                fetches.append(edit_distances)
+            try:
+                results = sess.run(fetches, feed_dict=feed_dict)
+            except tf.errors.ResourceExhaustedError:
+                logger.critical("Ran out of memory decoding a sub-batch of %d"
+                                " utterances of shape %s. Try a smaller"
+                                " eval_max_frames.", len(index_batch),
+                                batch_x.shape)
+                raise
+            hyps, refs = self.corpus_reader.human_readable_hyp_ref(
+                results[0], results[1])
+            if edit_distances is not None:
+                totals.add(results[2], [len(ref) for ref in refs])
+            else:
+                totals.add_transcripts(hyps, refs)
+            for i, hyp, ref in zip(index_batch, hyps, refs):
+                hyp_refs[i] = (hyp, ref)
+        ordered = [hyp_refs[i] for i in sorted(hyp_refs)]
+        return (totals.ler(), [hyp for hyp, _ in ordered],
+                [ref for _, ref in ordered])
+
+    def eval(self, restore_model_path: Optional[str]=None,
+             session_config: Union[None, SessionConfig, tf.ConfigProto]=None
+             ) -> None:
         """ Evaluates the model on a test set."""
 
         saver = tf.train.Saver()
-        with tf.Session(config=allow_growth_config) as sess:
+        with tf.Session(config=self.session_config_proto(session_config)) as sess:
             if restore_model_path:
                 logger.info("restoring model from %s", restore_model_path)
                 saver.restore(sess, restore_model_path)
@@ -266,17 +432,9 @@ class Model:
                 logger.info("restoring model from %s", self.saved_model_path)
                 saver.restore(sess, self.saved_model_path)
 
-            test_x, test_x_lens, test_y = self.corpus_reader.test_batch()
-
-            feed_dict = {self.batch_x: test_x,
-                         self.batch_x_lens: test_x_lens,
-                         self.batch_y: test_y}
-
-            test_ler, dense_decoded, dense_ref = sess.run(
-                [self.ler, self.dense_decoded, self.dense_ref],
-                feed_dict=feed_dict)
-            hyps, refs = self.corpus_reader.human_readable_hyp_ref(
-                dense_decoded, dense_ref)
+            test_ler, hyps, refs = self.evaluate_batches(
+                sess, self.corpus_reader.test_batch_gen(),
+                self.dense_decoded, self.edit_distances)
             # Log hypotheses
             hyps_dir = os.path.join(self.exp_dir, "test")
             if not os.path.isdir(hyps_dir):
@@ -309,7 +467,9 @@ class Model:
     def train(self, *, early_stopping_steps: int = 10, min_epochs: int = 30,
               max_valid_ler: float = 1.0, max_train_ler: float = 0.3,
               max_epochs: int = 100, restore_model_path: Optional[str]=None,
-              epoch_callback: Optional[Callable[[Dict], None]]=None) -> None:
+              epoch_callback: Optional[Callable[[Dict], None]]=None,
+              session_config: Union[None, SessionConfig, tf.ConfigProto]=None
+              ) -> None:
         """ Train the model.
 
             min_epochs: minimum number of epochs to run training for.
@@ -327,6 +487,13 @@ class Model:
                             The parameters passed to the callable will be the epoch number,
                             the current training LER and the current validation LER.
                             This can be useful for progress reporting.
+            session_config: The `SessionConfig` to train (and then evaluate)
+                            in, overriding the model's own.
+
+        The training and validation LERs are measured with the model's
+        validation decoder (`valid_ler`) where it has one. The validation LER
+        of the best checkpoint under the full decoder is written to
+        train_log.txt at the end of training.
         """
         logger.info("Training model")
         best_valid_ler = 2.0
@@ -345,19 +512,30 @@ class Model:
                             values[arg], type(None)):
                         print("%s=%s" % (arg, values[arg]), file=desc_f)
                     else:
-                        print("%s=%s" % (arg, values[arg].__dict__), file=desc_f)
+                        # Protocol buffers, such as a tf.ConfigProto, have
+                        # no __dict__.
+                        print("%s=%s" % (arg, getattr(values[arg], "__dict__",
+                                                      values[arg])), file=desc_f)
                 print("num_train=%s" % (self.corpus_reader.num_train), file=desc_f)
                 print("batch_size=%s" % (self.corpus_reader.batch_size), file=desc_f)
         else:
             logger.error("Couldn't find frame information, failed to write train_description.txt")
 
 
-        # Load the validation set
-        valid_x, valid_x_lens, valid_y = self.corpus_reader.valid_batch()
+        # The LERs reported during training (and so the choice of the best
+        # checkpoint) come from the model's cheaper validation decoder, if it
+        # has one. The full decoder is kept for eval() and transcribe().
+        if self.valid_ler is not None:
+            monitor_ler, monitor_decoded = self.valid_ler, self.valid_dense_decoded
+            monitor_distances = self.valid_edit_distances
+        else:
+            monitor_ler, monitor_decoded = self.ler, self.dense_decoded
+            monitor_distances = self.edit_distances
+        train_ler = self.train_ler if self.train_ler is not None else monitor_ler
 
         saver = tf.train.Saver()
 
-        with tf.Session(config=allow_growth_config) as sess:
+        with tf.Session(config=self.session_config_proto(session_config)) as sess:
 
             if restore_model_path:
                 logger.info("Restoring model from path %s", restore_model_path)
@@ -392,30 +570,27 @@ class Model:
                                     self.batch_x_lens: batch_x_lens,
                                     self.batch_y: batch_y}
 
-                        _, ler, = sess.run([self.optimizer, self.ler],
+                        _, ler, = sess.run([self.optimizer, train_ler],
                                         feed_dict=feed_dict)
 
                         train_ler_total += ler
+                    if self.corpus_reader.prefetch_batches:
+                        print("Waited %0.3fs for training batches" % (
+                            self.corpus_reader.prefetch_stats.wait_seconds),
+                            file=out_file)
                     #else:
                     #    raise PersephoneException("No training data was provided."
                     #                              " Check your batch generation.")
 
-                    feed_dict = {self.batch_x: valid_x,
-                                self.batch_x_lens: valid_x_lens,
-                                self.batch_y: valid_y}
-
-                    try:
-                        valid_ler, dense_decoded, dense_ref = sess.run(
-                            [self.ler, self.dense_decoded, self.dense_ref],
-                            feed_dict=feed_dict)
-                    except tf.errors.ResourceExhaustedError:
-                        import pprint
-                        print("Ran out of memory allocating a batch:")
-                        pprint.pprint(feed_dict)
-                        logger.critical("Ran out of memory allocating a batch: %s", pprint.pformat(feed_dict))
-                        raise
-                    hyps, refs = self.corpus_reader.human_readable_hyp_ref(
-                        dense_decoded, dense_ref)
+                    # The validation set is decoded in sub-batches of
+                    # similar length utterances, to bound memory use.
+                    valid_start = time.perf_counter()
+                    valid_ler, hyps, refs = self.evaluate_batches(
+                        sess, self.corpus_reader.valid_batch_gen(),
+                        monitor_decoded, monitor_distances)
+                    print("Validation decoding (%s) took %0.3fs" % (
+                        self.valid_decoder, time.perf_counter() - valid_start),
+                        file=out_file)
                     # Log hypotheses
                     with open(os.path.join(hyps_dir, "epoch%d_hyps" % epoch),
                               "w", encoding=ENCODING) as hyps_f:
@@ -498,5 +673,20 @@ class Model:
                     raise PersephoneException(
                         "No checkpoint was saved so model evaluation cannot be performed. "
                         "This can happen if the validaion LER never converges.")
+
+                if monitor_ler is not self.ler:
+                    # Record how the validation decoder compares with the full
+                    # decoder on the best checkpoint.
+                    saver.restore(sess, self.saved_model_path)
+                    full_start = time.perf_counter()
+                    full_valid_ler, _, _ = self.evaluate_batches(
+                        sess, self.corpus_reader.valid_batch_gen(),
+                        self.dense_decoded, self.edit_distances)
+                    print("Best checkpoint validation LER: %f with the %s decoder,"
+                          " %f with the full decoder (%0.3fs)" % (
+                              best_valid_ler, self.valid_decoder, full_valid_ler,
+                              time.perf_counter() - full_start),
+                          file=out_file, flush=True)
                 # Finally, run evaluation on the test set.
-                self.eval(restore_model_path=self.saved_model_path)
+                self.eval(restore_model_path=self.saved_model_path,
+                          session_config=session_config)
@@ -1,15 +1,30 @@
-""" Provides a Corpus class that can read ELAN .eaf XML files. """
+""" Provides a Corpus class that can read ELAN .eaf XML files.
 
+Parsing an archive of thousands of .eaf files is slow, so
+`utterances_from_dir()` parses them across a pool of worker processes and can
+keep a JSON cache of the utterances extracted from each file. Entries are
+keyed by the path of the .eaf file and the tier prefixes searched, and are
+only reused while the file's modification time and size are unchanged.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import json
 import logging
+import os
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
 import pympi.Elan
 
+from ..config import ENCODING
 from ..utterance import Utterance
 
 logger = logging.getLogger(__name__) # type: ignore
 
+# Bump this if the utterances extracted from an .eaf file change, so that
+# existing parse caches are discarded.
+PARSE_CACHE_VERSION = 1
+
 class Eaf(pympi.Elan.Eaf):
     """ This subclass exists because eaf MEDIA_DESCRIPTOR elements typically
     have RELATIVE_MEDIA_URL that contains the path of the media file relative
@@ -113,8 +128,58 @@ def utterances_from_eaf(eaf_path: Path, tier_prefixes: Tuple[str, ...]) -> List[
     return utterances
 
 
+def _utterances_from_eafs(jobs: Sequence[Tuple[Path, Tuple[str, ...]]]
+                         ) -> List[List[Utterance]]:
+    """ Extracts the utterances of a chunk of .eaf files. Module level so that
+    it can be sent to worker processes. """
+
+    return [utterances_from_eaf(eaf_path, tier_prefixes)
+            for eaf_path, tier_prefixes in jobs]
+
+def _cache_key(eaf_path: Path, tier_prefixes: Tuple[str, ...]) -> str:
+    return json.dumps([str(eaf_path), list(tier_prefixes)])
+
+def _utterance_to_json(utter: Utterance) -> List[Any]:
+    return [str(utter.org_media_path), str(utter.org_transcription_path),
+            utter.prefix, utter.start_time, utter.end_time, utter.text,
+            utter.speaker]
+
+def _utterance_from_json(fields: List[Any]) -> Utterance:
+    media_path, eaf_path, prefix, start_time, end_time, text, speaker = fields
+    return Utterance(Path(media_path), Path(eaf_path), prefix, start_time,
+                     end_time, text, speaker)
+
+def load_parse_cache(cache_path: Path) -> Dict[str, Dict[str, Any]]:
+    """ Reads the cached utterances of previously parsed .eaf files. Returns
+    an empty cache if the file is missing, corrupt or from another version. """
+
+    if not cache_path.is_file():
+        return {}
+    try:
+        with cache_path.open(encoding=ENCODING) as cache_f:
+            raw_cache = json.load(cache_f)
+    except ValueError:
+        logger.warning("Ignoring corrupt ELAN parse cache %s", cache_path)
+        return {}
+    if raw_cache.get("version") != PARSE_CACHE_VERSION:
+        return {}
+    return raw_cache["entries"]
+
+def save_parse_cache(cache_path: Path,
+                     entries: Dict[str, Dict[str, Any]]) -> None:
+    """ Writes the cache of parsed .eaf files to disk. """
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix(".json.tmp")
+    with tmp_path.open("w", encoding=ENCODING) as cache_f:
+        json.dump({"version": PARSE_CACHE_VERSION, "entries": entries}, cache_f)
+    os.replace(str(tmp_path), str(cache_path))
+
 def utterances_from_dir(eaf_dir: Path,
-                        tier_prefixes: Tuple[str, ...]) -> List[Utterance]:
+                        tier_prefixes: Tuple[str, ...], *,
+                        cache_path: Optional[Path] = None,
+                        num_workers: Optional[int] = None,
+                        chunksize: int = 8) -> List[Utterance]:
     """ Returns the utterances found in ELAN files in a directory.
 
     Recursively explores the directory, gathering ELAN files and extracting
@@ -125,6 +190,13 @@ def utterances_from_dir(eaf_dir: Path,
         tier_prefixes: Stings matching the start of ELAN tier names that are to
             be extracted. For example, if you want to extract from tiers "xv-Jane"
             and "xv-Mark", then tier_prefixes = ["xv"] would do the job.
+        cache_path: A JSON file in which to cache the utterances extracted
+            from each ELAN file. Files whose modification time and size
+            haven't changed since they were cached aren't parsed again. If
+            `None`, every file is parsed.
+        num_workers: The number of processes to parse files with. Defaults to
+            the number of CPUs. If 1, files are parsed in this process.
+        chunksize: The number of files sent to a worker at a time.
 
     Returns:
         A list of Utterance objects.
@@ -135,8 +207,55 @@ def utterances_from_dir(eaf_dir: Path,
         "EAF from directory: {}, searching with tier_prefixes {}".format(
             eaf_dir, tier_prefixes))
 
-    utterances = []
-    for eaf_path in eaf_dir.glob("**/*.eaf"):
-        eaf_utterances = utterances_from_eaf(eaf_path, tier_prefixes)
-        utterances.extend(eaf_utterances)
+    tier_prefixes = tuple(tier_prefixes)
+    eaf_paths = list(eaf_dir.glob("**/*.eaf"))
+    cache = load_parse_cache(cache_path) if cache_path else {}
+    # Entries for other tier prefixes are kept, unless their file is gone.
+    new_cache = {key: entry for key, entry in cache.items()
+                 if Path(json.loads(key)[0]).is_file()}
+
+    eaf_utterances = {} # type: Dict[int, List[Utterance]]
+    to_parse = [] # type: List[int]
+    # Stat before parsing, so that a file modified while it's being parsed
+    # is parsed again next time.
+    stats = [eaf_path.stat() for eaf_path in eaf_paths]
+    for i, (eaf_path, stat) in enumerate(zip(eaf_paths, stats)):
+        key = _cache_key(eaf_path, tier_prefixes)
+        entry = cache.get(key)
+        if (entry is not None
+                and (entry["mtime"], entry["size"]) == (stat.st_mtime, stat.st_size)):
+            eaf_utterances[i] = [_utterance_from_json(fields)
+                                 for fields in entry["utterances"]]
+        else:
+            to_parse.append(i)
+
+    jobs = [(eaf_paths[i], tier_prefixes) for i in to_parse]
+    chunksize = max(1, chunksize)
+    chunks = [jobs[i:i+chunksize] for i in range(0, len(jobs), chunksize)]
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(chunks))
+    if num_workers <= 1:
+        parsed = [utters for chunk in chunks
+                  for utters in _utterances_from_eafs(chunk)]
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            chunk_results = executor.map(_utterances_from_eafs, chunks) # type: Iterable[List[List[Utterance]]]
+            parsed = [utters for chunk_utters in chunk_results
+                      for utters in chunk_utters]
+    logger.info("Parsed %d of %d ELAN files using %d workers",
+                len(to_parse), len(eaf_paths), max(num_workers, 1))
+
+    for i, utters in zip(to_parse, parsed):
+        eaf_utterances[i] = utters
+        new_cache[_cache_key(eaf_paths[i], tier_prefixes)] = {
+            "mtime": stats[i].st_mtime,
+            "size": stats[i].st_size,
+            "utterances": [_utterance_to_json(utter) for utter in utters]}
+    if cache_path and (to_parse or len(new_cache) != len(cache)):
+        save_parse_cache(cache_path, new_cache)
+
+    utterances = [] # type: List[Utterance]
+    for i in range(len(eaf_paths)):
+        utterances.extend(eaf_utterances[i])
     return utterances
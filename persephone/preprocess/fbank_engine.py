@@ -0,0 +1,138 @@
+""" Computes log Mel filterbank features for many utterances at once.
+
+`FbankEngine` gives the same features as `feat_extract.fbank()`: the log
+frame energy and 40 log Mel filterbank energies, followed by their deltas and
+double deltas, concatenated along the feature axis. The frames of all the
+utterances in a batch are stacked into a single array, so the FFT and Mel
+projection run once per batch instead of once per utterance, and the energy
+comes from the same power spectrum as the filterbanks rather than from a
+second pass through `python_speech_features.mfcc`.
+"""
+
+import math
+from typing import List, Sequence
+
+import numpy as np
+import python_speech_features
+
+class FbankEngine:
+    """ Computes flat fbank features for batches of signals of one sample
+    rate. The parameters default to those used by `feat_extract.fbank()`. """
+
+    def __init__(self, rate: int = 16000, *,
+                 nfilt: int = 40,
+                 nfft: int = 512,
+                 winlen: float = 0.025,
+                 winstep: float = 0.01,
+                 preemph: float = 0.97,
+                 delta_width: int = 2,
+                 max_frames: int = 8192) -> None:
+        """
+        Args:
+            rate: The sample rate of the signals.
+            nfilt: The number of Mel filters.
+            nfft: The FFT size.
+            winlen: The frame length in seconds.
+            winstep: The frame shift in seconds.
+            preemph: The preemphasis filter coefficient.
+            delta_width: The number of frames either side of a frame used to
+                compute its deltas.
+            max_frames: The number of frames whose spectra are computed at a
+                time, bounding the memory used by the FFT.
+        """
+
+        self.rate = rate
+        self.nfilt = nfilt
+        self.nfft = nfft
+        self.winlen = winlen
+        self.winstep = winstep
+        self.frame_len = _round_half_up(winlen * rate)
+        self.frame_step = _round_half_up(winstep * rate)
+        self.preemph = preemph
+        self.delta_width = delta_width
+        self.max_frames = max_frames
+        # Transposed, so that power spectra can be projected with one matmul.
+        self.filterbanks_t = python_speech_features.get_filterbanks(
+            nfilt, nfft, rate).T
+
+    def __repr__(self) -> str:
+        # Leaves out max_frames, which doesn't affect the output.
+        return ("{}(rate={}, nfilt={}, nfft={}, winlen={}, winstep={},"
+                " preemph={}, delta_width={})".format(
+                    self.__class__.__name__, self.rate, self.nfilt, self.nfft,
+                    self.winlen, self.winstep, self.preemph, self.delta_width))
+
+    def num_frames(self, num_samples: int) -> int:
+        if num_samples <= self.frame_len:
+            return 1
+        return 1 + int(math.ceil((num_samples - self.frame_len) / self.frame_step))
+
+    def frames(self, sig: np.ndarray) -> np.ndarray:
+        """ Applies preemphasis to a signal and splits it into overlapping
+        frames, zero padding the end. """
+
+        sig = np.asarray(sig, dtype=np.float64)
+        n_frames = self.num_frames(len(sig))
+        padded = np.zeros((n_frames - 1) * self.frame_step + self.frame_len)
+        if len(sig):
+            padded[0] = sig[0]
+            padded[1:len(sig)] = sig[1:] - self.preemph * sig[:-1]
+        stride = padded.strides[0]
+        return np.lib.stride_tricks.as_strided(
+            padded, shape=(n_frames, self.frame_len),
+            strides=(self.frame_step * stride, stride), writeable=False)
+
+    def log_energies(self, frames: np.ndarray) -> np.ndarray:
+        """ Returns the log energy followed by the log filterbank energies of
+        each frame, working through the frames in blocks of max_frames. """
+
+        eps = np.finfo(float).eps
+        out = np.empty((len(frames), self.filterbanks_t.shape[1] + 1))
+        for start in range(0, len(frames), self.max_frames):
+            block = frames[start:start+self.max_frames]
+            pspec = np.square(np.abs(np.fft.rfft(block, self.nfft))) / self.nfft
+            energy = np.sum(pspec, axis=1)
+            out[start:start+len(block), 0] = np.log(
+                np.where(energy == 0, eps, energy))
+            fbanks = np.dot(pspec, self.filterbanks_t)
+            out[start:start+len(block), 1:] = np.log(
+                np.where(fbanks == 0, eps, fbanks))
+        return out
+
+    def deltas(self, feats: np.ndarray, starts: np.ndarray,
+               ends: np.ndarray) -> np.ndarray:
+        """ Computes deltas of the stacked features of several utterances,
+        where the utterance of frame i spans frames starts[i] to ends[i].
+        As in `python_speech_features.delta`, each utterance's first and
+        last frames are repeated beyond its edges. """
+
+        frame_indices = np.arange(len(feats))
+        delta_feats = np.zeros_like(feats)
+        for k in range(1, self.delta_width + 1):
+            after = feats[np.minimum(frame_indices + k, ends - 1)]
+            before = feats[np.maximum(frame_indices - k, starts)]
+            delta_feats += k * (after - before)
+        denominator = 2 * sum(k**2 for k in range(1, self.delta_width + 1))
+        return delta_feats / denominator
+
+    def __call__(self, signals: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """ Computes the fbank features of each signal, returning an array of
+        shape (num_frames, 3 * (nfilt + 1)) for each. """
+
+        if not signals:
+            return []
+        frames = [self.frames(sig) for sig in signals]
+        lens = np.array([len(utter_frames) for utter_frames in frames])
+        offsets = np.zeros(len(lens) + 1, dtype=np.int64)
+        np.cumsum(lens, out=offsets[1:])
+        starts = np.repeat(offsets[:-1], lens)
+        ends = np.repeat(offsets[1:], lens)
+
+        feat = self.log_energies(np.concatenate(frames))
+        delta_feat = self.deltas(feat, starts, ends)
+        delta_delta_feat = self.deltas(delta_feat, starts, ends)
+        all_feats = np.concatenate([feat, delta_feat, delta_delta_feat], axis=1)
+        return [all_feats[offsets[i]:offsets[i+1]] for i in range(len(signals))]
+
+def _round_half_up(number: float) -> int:
+    return int(math.floor(number + 0.5))
@@ -1,10 +1,14 @@
 """ Performs feature extraction of WAV files for acoustic modelling."""
 
+from concurrent.futures import ProcessPoolExecutor
+import functools
 import logging
 import os
 from pathlib import Path
 import subprocess
-from typing import Union
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple, Union
 import wave
 
 import numpy as np
@@ -13,6 +17,10 @@ import scipy.io.wavfile as wav
 
 from .. import config
 from ..exceptions import PersephoneException
+from ..feat_cache import FeatCache, default_cache
+from . import pitch
+from .fbank_engine import FbankEngine
+from . import wav as wav_preprocess
 
 logger = logging.getLogger(__name__) #type: ignore
 
@@ -30,35 +38,40 @@ def extract_energy(rate, sig):
     energy_col_vec = energy_row_vec[:, np.newaxis]
     return energy_col_vec
 
+@functools.lru_cache(maxsize=None)
+def fbank_engine(rate: int) -> FbankEngine:
+    """ Returns a shared `FbankEngine` for signals of the given rate. """
+
+    return FbankEngine(rate)
+
+def fbank_from_signal(rate: int, sig: np.ndarray, flat: bool = True) -> np.ndarray:
+    """ Computes log Mel filterbank features, with energy, deltas and double
+    deltas, from audio samples. """
+
+    all_feats = fbank_engine(rate)([sig])[0]
+    if not flat:
+        # Separate the features from their deltas and double deltas, making
+        # time the first dimension for easy length normalization padding
+        # later.
+        all_feats = all_feats.reshape(len(all_feats), 3, -1).swapaxes(1, 2)
+    return all_feats
+
 def fbank(wav_path, flat=True):
     """ Currently grabs log Mel filterbank, deltas and double deltas."""
 
     (rate, sig) = wav.read(wav_path)
     if len(sig) == 0:
         logger.warning("Empty wav: {}".format(wav_path))
-    fbank_feat = python_speech_features.logfbank(sig, rate, nfilt=40)
-    energy = extract_energy(rate, sig)
-    feat = np.hstack([energy, fbank_feat])
-    delta_feat = python_speech_features.delta(feat, 2)
-    delta_delta_feat = python_speech_features.delta(delta_feat, 2)
-    all_feats = [feat, delta_feat, delta_delta_feat]
-    if not flat:
-        all_feats = np.array(all_feats)
-        # Make time the first dimension for easy length normalization padding
-        # later.
-        all_feats = np.swapaxes(all_feats, 0, 1)
-        all_feats = np.swapaxes(all_feats, 1, 2)
-    else:
-        all_feats = np.concatenate(all_feats, axis=1)
+    all_feats = fbank_from_signal(rate, sig, flat=flat)
 
     # Log Mel Filterbank, with delta, and double delta
     feat_fn = wav_path[:-3] + "fbank.npy"
     np.save(feat_fn, all_feats)
 
-def mfcc(wav_path):
-    """ Grabs MFCC features with energy and derivates. """
+def mfcc_from_signal(rate: int, sig: np.ndarray) -> np.ndarray:
+    """ Computes MFCC features with energy and derivatives from audio
+    samples. """
 
-    (rate, sig) = wav.read(wav_path)
     feat = python_speech_features.mfcc(sig, rate, appendEnergy=True)
     delta_feat = python_speech_features.delta(feat, 2)
     all_feats = [feat, delta_feat]
@@ -66,16 +79,74 @@ def mfcc(wav_path):
     # Make time the first dimension for easy length normalization padding later.
     all_feats = np.swapaxes(all_feats, 0, 1)
     all_feats = np.swapaxes(all_feats, 1, 2)
+    return all_feats
+
+def mfcc(wav_path):
+    """ Grabs MFCC features with energy and derivates. """
+
+    (rate, sig) = wav.read(wav_path)
+    all_feats = mfcc_from_signal(rate, sig)
 
     feat_fn = wav_path[:-3] + "mfcc13_d.npy"
     np.save(feat_fn, all_feats)
 
-def combine_fbank_and_pitch(feat_dir: str, prefix: str) -> None:
+#: The types of features that can be extracted.
+FEAT_TYPES = ("fbank", "fbank_and_pitch", "pitch", "mfcc13_d")
+
+def feats_from_signal(rate: int, sig: np.ndarray, feat_type: str) -> np.ndarray:
+    """ Computes features of one of the `FEAT_TYPES` from audio samples. """
+
+    if feat_type == "fbank":
+        return fbank_from_signal(rate, sig)
+    elif feat_type == "fbank_and_pitch":
+        return combine_fbank_and_pitch(fbank_from_signal(rate, sig),
+                                       pitch.pitch_from_signal(rate, sig))
+    elif feat_type == "pitch":
+        return pitch.pitch_from_signal(rate, sig)
+    elif feat_type == "mfcc13_d":
+        return mfcc_from_signal(rate, sig)
+    logger.warning("Feature type not found: %s", feat_type)
+    raise PersephoneException("Feature type not found: %s" % feat_type)
+
+def feats_from_signals(signals: Sequence[Tuple[int, np.ndarray]],
+                       feat_type: str) -> List[np.ndarray]:
+    """ Computes features for many (rate, samples) pairs. Filterbanks of
+    signals sharing a rate are computed together in one `FbankEngine` call.
+    """
 
-    fbank_fn = os.path.join(feat_dir, prefix + ".fbank.npy")
-    fbanks = np.load(fbank_fn)
-    pitch_fn = os.path.join(feat_dir, prefix + ".pitch.npy")
-    pitches = np.load(pitch_fn)
+    if feat_type not in ("fbank", "fbank_and_pitch"):
+        return [feats_from_signal(rate, sig, feat_type) for rate, sig in signals]
+    fbanks = [None] * len(signals) # type: List[Any]
+    for rate in set(rate for rate, _ in signals):
+        indices = [i for i, (sig_rate, _) in enumerate(signals) if sig_rate == rate]
+        for i, feats in zip(indices, fbank_engine(rate)(
+                [signals[i][1] for i in indices])):
+            fbanks[i] = feats
+    if feat_type == "fbank":
+        return fbanks
+    return [combine_fbank_and_pitch(fbank_feats, pitch.pitch_from_signal(rate, sig))
+            for fbank_feats, (rate, sig) in zip(fbanks, signals)]
+
+def extraction_params(feat_type: str) -> str:
+    """ Describes the parameters that features of the given type are
+    extracted with, so that cached features are only reused if they would
+    come out the same. """
+
+    params = [] # type: List[str]
+    if feat_type in ("fbank", "fbank_and_pitch"):
+        params.append(repr(fbank_engine(wav_preprocess.TARGET_RATE)))
+    if feat_type in ("pitch", "fbank_and_pitch"):
+        params.append("pitch(rate={}, min_f0={}, max_f0={}, voicing={},"
+                      " ballast={}, median={}, octave={})".format(
+                          pitch.PITCH_RATE, pitch.MIN_F0, pitch.MAX_F0,
+                          pitch.VOICING_THRESHOLD, pitch.NCCF_BALLAST,
+                          pitch.MEDIAN_WIDTH, pitch.OCTAVE_RATIO))
+    if feat_type == "mfcc13_d":
+        params.append("mfcc(numcep=13, append_energy=True, delta_width=2)")
+    return ";".join(params)
+
+def combine_fbank_and_pitch(fbanks: np.ndarray, pitches: np.ndarray) -> np.ndarray:
+    """ Appends the pitch features of each frame to its fbank features. """
 
     # Check that the fbanks are flat
     if len(fbanks.shape) == 3:
@@ -92,139 +163,449 @@ def combine_fbank_and_pitch(feat_dir: str, prefix: str) -> None:
 
     diff = len(fbanks) - len(pitches)
 
-    # When using python_speech_features fbank extraction and kaldi pitch
-    # extraction, there are slightly differing numbers of frames. Usually only
-    # by 1 or so. Just pad with zeros to match.
-    # TODO This could be a sign that it might just be best to use Kaldi for
-    # fbank feature extraction as well (I kind of want to see how using those
-    # features goes anyway). But I'm currently keeping it this way for
-    # experimental consistency.
+    # Pitch features are framed the same way as the fbanks, but pitch features
+    # computed elsewhere (eg. by Kaldi) can differ by a frame or so. Just pad
+    # with zeros to match.
     if diff > 2:
         logger.warning("Excessive difference in number of frames. %d", diff)
         raise PersephoneException("Excessive difference in number of frames. %d" % diff)
     elif diff > 0:
         pitches = np.concatenate((np.array([[0,0]]*(len(fbanks) - len(pitches))), pitches))
-    fbank_pitch_feats = np.concatenate((fbanks, pitches), axis=1)
-
-    out_fn = os.path.join(feat_dir, prefix + ".fbank_and_pitch.npy")
-    np.save(out_fn, fbank_pitch_feats)
+    return np.concatenate((fbanks, pitches), axis=1)
+
+ExtractionResult = NamedTuple("ExtractionResult",
+                               [("wav_path", str),
+                                ("seconds", float),
+                                ("error", Optional[str])])
+ExtractionResult.__doc__ = (
+    """ The outcome of extracting features from a single WAV file.
+
+    Attributes:
+        wav_path: The path to the WAV file that features were extracted from.
+        seconds: The wall time spent on the file.
+        error: A description of the failure, or `None` if extraction succeeded.
+    """)
+
+def extract_file(wav_path: str, feat_type: str) -> None:
+    """ Extracts features of the given type from a single (16kHz mono) WAV
+    file, writing them alongside it as `<prefix>.<feat_type>.npy`. """
+
+    if empty_wav(wav_path):
+        raise PersephoneException("Can't extract features for {} since it is an empty WAV file. Remove it from the corpus.".format(wav_path))
+    if feat_type == "fbank":
+        fbank(wav_path)
+    elif feat_type == "mfcc13_d":
+        mfcc(wav_path)
+    elif feat_type in FEAT_TYPES:
+        (rate, sig) = wav.read(wav_path)
+        feat_fn = wav_path[:-3] + "{}.npy".format(feat_type)
+        np.save(feat_fn, feats_from_signal(rate, sig, feat_type))
+    else:
+        logger.warning("Feature type not found: %s", feat_type)
+        raise PersephoneException("Feature type not found: %s" % feat_type)
+
+def _timed_extract_file(job: Tuple[str, str]) -> ExtractionResult:
+    """ Worker function for `from_dir()`. Failures are caught and reported in
+    the result rather than raised, so that one bad file doesn't take down the
+    rest of the pool. """
+
+    wav_path, feat_type = job
+    start = time.perf_counter()
+    try:
+        extract_file(wav_path, feat_type)
+    except Exception as e: # pylint: disable=broad-except
+        return ExtractionResult(wav_path, time.perf_counter() - start,
+                                "{}: {}".format(type(e).__name__, e))
+    return ExtractionResult(wav_path, time.perf_counter() - start, None)
+
+def unprocessed_wavs(dirpath: Path, feat_type: str) -> List[str]:
+    """ Returns the paths to WAV files in a directory that don't yet have a
+    corresponding `<prefix>.<feat_type>.npy` feature file, in sorted order."""
 
-# TODO I'm operating at the directory level for pitch feats, but at the file
-# level for other things. Change this? Currently wav normalization occurs
-# elsewhere too (in say, datasets.chatin.prepare_feats()). Kaldi expects
-# specific wav format, so that should be coupled together with pitch extraction
-# here.
-def from_dir(dirpath: Path, feat_type: str) -> None:
+    dirname = str(dirpath)
+    wav_paths = []
+    for fn in sorted(os.listdir(dirname)):
+        prefix, ext = os.path.splitext(fn)
+        if ext == ".wav":
+            if not os.path.exists(
+                    os.path.join(dirname, "%s.%s.npy" % (prefix, feat_type))):
+                wav_paths.append(os.path.join(dirname, fn))
+    return wav_paths
+
+def from_dir(dirpath: Path, feat_type: str, *,
+             num_workers: Optional[int] = None,
+             chunksize: int = 16,
+             feat_cache: Optional[FeatCache] = None) -> List[ExtractionResult]:
     """ Performs feature extraction from the WAV files in a directory.
 
+    Only WAV files that don't already have a corresponding feature file are
+    processed. Files are distributed in chunks over a pool of worker
+    processes. A failure on one file doesn't stop extraction for the others;
+    once every file has been attempted, a `PersephoneException` is raised
+    describing all the failures.
+
     Args:
         dirpath: A `Path` to the directory where the WAV files reside.
         feat_type: The type of features that are being used.
+        num_workers: The number of worker processes to use. If `None`, one
+            per CPU is used. If 1, extraction happens in this process.
+        chunksize: The number of files handed to a worker at a time.
+        feat_cache: The `FeatCache` to take features from and add newly
+            extracted features to. If `None`, the cache configured in
+            settings.ini is used, if there is one.
+
+    Returns:
+        An `ExtractionResult` for each WAV file that was processed.
     """
 
     logger.info("Extracting features from directory {}".format(dirpath))
 
-    dirname = str(dirpath)
-
-    def all_wavs_processed() -> bool:
-        """
-        True if all wavs in the directory have corresponding numpy feature
-        file; False otherwise.
-        """
-
-        for fn in os.listdir(dirname):
-            prefix, ext = os.path.splitext(fn)
-            if ext == ".wav":
-                if not os.path.exists(
-                        os.path.join(dirname, "%s.%s.npy" % (prefix, feat_type))):
-                    return False
-        return True
-
-    if all_wavs_processed():
+    wav_paths = unprocessed_wavs(dirpath, feat_type)
+    feat_paths = [Path("{}.{}.npy".format(os.path.splitext(wav_path)[0], feat_type))
+                  for wav_path in wav_paths]
+    misses, cache_keys = _fetch_from_cache(feat_cache, wav_paths, feat_paths,
+                                           feat_type)
+    wav_paths = [wav_paths[i] for i in misses]
+    if not wav_paths:
         # Then nothing needs to be done here
         logger.info("All WAV files already preprocessed")
+        return []
+    logger.info("%d WAV files require %s feature extraction",
+                len(wav_paths), feat_type)
+
+    # Then apply file-wise feature extraction
+    jobs = [(wav_path, feat_type) for wav_path in wav_paths]
+    try:
+        return _run_extraction_jobs(_timed_extract_files, jobs, feat_type,
+                                    num_workers=num_workers, chunksize=chunksize)
+    finally:
+        _store_in_cache(feat_cache, cache_keys, feat_paths)
+
+def _fetch_from_cache(feat_cache: Optional[FeatCache],
+                      audio_paths: Sequence[Union[str, Path]],
+                      feat_paths: Sequence[Path],
+                      feat_type: str) -> Tuple[List[int], Dict[int, str]]:
+    """ Copies any cached features of the audio files to their feature
+    paths. If feat_cache is `None`, the cache configured in settings.ini (if
+    any) is used.
+
+    Returns:
+        The indices of the files whose features weren't in the cache, and a
+        dictionary mapping each of those indices to the file's cache key.
+    """
+
+    if feat_cache is None:
+        feat_cache = default_cache()
+    if feat_cache is None:
+        return list(range(len(audio_paths))), {}
+    params = extraction_params(feat_type)
+    misses = [] # type: List[int]
+    cache_keys = {} # type: Dict[int, str]
+    for i, (audio_path, feat_path) in enumerate(zip(audio_paths, feat_paths)):
+        key = feat_cache.key(audio_path, feat_type, params)
+        if not feat_cache.fetch(key, feat_path):
+            misses.append(i)
+            cache_keys[i] = key
+    logger.info("Found %s features for %d of %d files in %r", feat_type,
+                len(audio_paths) - len(misses), len(audio_paths), feat_cache)
+    return misses, cache_keys
+
+def _store_in_cache(feat_cache: Optional[FeatCache],
+                    cache_keys: Dict[int, str],
+                    feat_paths: Sequence[Path]) -> None:
+    """ Adds newly extracted features to the cache, then trims it to size. """
+
+    if not cache_keys:
         return
-    # Otherwise, go on and process everything...
+    if feat_cache is None:
+        feat_cache = default_cache()
+    if feat_cache is None:
+        return
+    for i, key in cache_keys.items():
+        if feat_paths[i].is_file():
+            feat_cache.put(key, feat_paths[i])
+    feat_cache.evict()
+
+def _timed_extract_files(jobs: Sequence[Tuple[str, str]]) -> List[ExtractionResult]:
+    return [_timed_extract_file(job) for job in jobs]
+
+def _run_extraction_jobs(worker: Callable[[Sequence[Any]], List[ExtractionResult]],
+                         jobs: Sequence[Any], feat_type: str, *,
+                         num_workers: Optional[int],
+                         chunksize: int) -> List[ExtractionResult]:
+    """ Maps a worker over chunks of extraction jobs, in this process or over
+    a pool of worker processes, and raises a `PersephoneException` describing
+    any failures once every job has been attempted. """
+
+    chunksize = max(1, chunksize)
+    chunks = [jobs[i:i+chunksize] for i in range(0, len(jobs), chunksize)]
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(chunks))
+
+    start = time.perf_counter()
+    results = [] # type: List[ExtractionResult]
+    if num_workers <= 1:
+        result_iter = map(worker, chunks) # type: Iterable[List[ExtractionResult]]
+        for chunk_results in result_iter:
+            for result in chunk_results:
+                _log_extraction_result(result, feat_type)
+                results.append(result)
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            result_iter = executor.map(worker, chunks)
+            for chunk_results in result_iter:
+                for result in chunk_results:
+                    _log_extraction_result(result, feat_type)
+                    results.append(result)
+    logger.info("Extracted %s features for %d files in %0.2fs using %d workers",
+                feat_type, len(results), time.perf_counter() - start,
+                num_workers)
+
+    failures = [result for result in results if result.error is not None]
+    if failures:
+        raise PersephoneException(
+            "Feature extraction failed for {} of {} files:\n{}".format(
+                len(failures), len(results),
+                "\n".join("{}: {}".format(failure.wav_path, failure.error)
+                          for failure in failures)))
+    return results
+
+def extract_from_source(org_wav_fn: Path, feat_path: Path, feat_type: str,
+                        mono16k_wav_path: Optional[Path] = None) -> None:
+    """ Reads a source WAV once, normalizes it to 16kHz mono in memory and
+    saves its features to feat_path, without an intermediate WAV file.
+
+    Args:
+        org_wav_fn: A `Path` to the original wave file.
+        feat_path: The `Path` to save the features to.
+        feat_type: One of the `FEAT_TYPES`.
+        mono16k_wav_path: If given, the normalized audio is also written to
+            this `Path`.
+    """
 
-    # If pitch features are needed as part of this, extract them
-    if feat_type == "pitch" or feat_type == "fbank_and_pitch":
-        kaldi_pitch(dirname, dirname)
+    rate, samples = read_mono16k(org_wav_fn)
+    if len(samples) == 0:
+        raise PersephoneException("Can't extract features for {} since it is an empty WAV file. Remove it from the corpus.".format(org_wav_fn))
+    if mono16k_wav_path is not None:
+        wav.write(str(mono16k_wav_path), rate, samples)
+    np.save(str(feat_path), feats_from_signal(rate, samples, feat_type))
+
+def _timed_extract_from_sources(
+        jobs: Sequence[Tuple[Path, Path, str, Optional[Path]]]
+        ) -> List[ExtractionResult]:
+    """ Worker function for `extract_from_wavs()`. The features of a chunk of
+    files are computed together with `feats_from_signals()`. Like
+    `_timed_extract_file()`, failures are reported in the results. """
+
+    results = [None] * len(jobs) # type: List[Any]
+    loaded = [] # type: List[Tuple[int, int, np.ndarray, float]]
+    for i, (org_wav_fn, _, _, mono16k_wav_path) in enumerate(jobs):
+        start = time.perf_counter()
+        try:
+            rate, samples = read_mono16k(org_wav_fn)
+            if len(samples) == 0:
+                raise PersephoneException("Can't extract features for {} since it is an empty WAV file. Remove it from the corpus.".format(org_wav_fn))
+            if mono16k_wav_path is not None:
+                wav.write(str(mono16k_wav_path), rate, samples)
+        except Exception as e: # pylint: disable=broad-except
+            results[i] = ExtractionResult(str(org_wav_fn), time.perf_counter() - start,
+                                          "{}: {}".format(type(e).__name__, e))
+            continue
+        loaded.append((i, rate, samples, time.perf_counter() - start))
+
+    if loaded:
+        feat_type = jobs[0][2]
+        start = time.perf_counter()
+        try:
+            all_feats = feats_from_signals(
+                [(rate, samples) for _, rate, samples, _ in loaded], feat_type)
+        except Exception as e: # pylint: disable=broad-except
+            error = "{}: {}".format(type(e).__name__, e)
+            for i, _, _, seconds in loaded:
+                results[i] = ExtractionResult(str(jobs[i][0]), seconds, error)
+            return results
+        # Attribute the shared computation evenly across the files.
+        shared_seconds = (time.perf_counter() - start) / len(loaded)
+        for (i, _, _, seconds), feats in zip(loaded, all_feats):
+            org_wav_fn, feat_path = jobs[i][0], jobs[i][1]
+            start = time.perf_counter()
+            try:
+                np.save(str(feat_path), feats)
+            except Exception as e: # pylint: disable=broad-except
+                results[i] = ExtractionResult(
+                    str(org_wav_fn), seconds + shared_seconds,
+                    "{}: {}".format(type(e).__name__, e))
+                continue
+            results[i] = ExtractionResult(
+                str(org_wav_fn),
+                seconds + shared_seconds + time.perf_counter() - start, None)
+    return results
+
+def extract_from_wavs(wav_paths: Sequence[Path], feat_dir: Path,
+                      feat_type: str, *,
+                      keep_wavs: bool = False,
+                      num_workers: Optional[int] = None,
+                      chunksize: int = 16,
+                      feat_cache: Optional[FeatCache] = None
+                      ) -> List[ExtractionResult]:
+    """ Extracts features from source WAV files in a single pass, saving
+    `<prefix>.<feat_type>.npy` files to feat_dir, where each prefix is the
+    stem of a WAV file's name.
+
+    Each source WAV is read once and normalized to 16kHz mono in memory
+    before its features are computed, so the normalized audio needn't be
+    written and re-read. WAVs that already have a feature file in feat_dir
+    are skipped.
 
-    # Then apply file-wise feature extraction
-    for filename in os.listdir(dirname):
-        logger.info("Preparing %s features for %s", feat_type, filename)
-        path = os.path.join(dirname, filename)
-        if path.endswith(".wav"):
-            if empty_wav(path):
-                raise PersephoneException("Can't extract features for {} since it is an empty WAV file. Remove it from the corpus.".format(path))
-            if feat_type == "fbank":
-                fbank(path)
-            elif feat_type == "fbank_and_pitch":
-                fbank(path)
-                prefix = os.path.splitext(filename)[0]
-                combine_fbank_and_pitch(dirname, prefix)
-            elif feat_type == "pitch":
-                # Already extracted pitch at the start of this function.
-                pass
-            elif feat_type == "mfcc13_d":
-                mfcc(path)
-            else:
-                logger.warning("Feature type not found: %s", feat_type)
-                raise PersephoneException("Feature type not found: %s" % feat_type)
+    Args:
+        wav_paths: `Path`s to the source WAV files.
+        feat_dir: The directory to save the features in.
+        feat_type: The type of features to extract.
+        keep_wavs: If True, the normalized audio is also written to
+            `<feat_dir>/<prefix>.wav`.
+        num_workers: The number of worker processes to use. If `None`, one
+            per CPU is used. If 1, extraction happens in this process.
+        chunksize: The number of files handed to a worker at a time. Their
+            filterbanks are computed together, as one batch.
+        feat_cache: The `FeatCache` to take features from and add newly
+            extracted features to. If `None`, the cache configured in
+            settings.ini is used, if there is one.
+
+    Returns:
+        An `ExtractionResult` for each WAV file that was processed.
+    """
+
+    if feat_type not in FEAT_TYPES:
+        logger.warning("Feature type not found: %s", feat_type)
+        raise PersephoneException("Feature type not found: %s" % feat_type)
+    feat_dir = Path(feat_dir)
+    feat_dir.mkdir(parents=True, exist_ok=True)
+    pending = [Path(path) for path in wav_paths
+               if not (feat_dir / "{}.{}.npy".format(
+                   Path(path).stem, feat_type)).is_file()]
+    feat_paths = [feat_dir / "{}.{}.npy".format(path.stem, feat_type)
+                  for path in pending]
+    misses, cache_keys = _fetch_from_cache(feat_cache, pending, feat_paths,
+                                           feat_type)
+    if keep_wavs:
+        missed = set(misses)
+        convert_wavs([(path, feat_dir / "{}.wav".format(path.stem))
+                      for i, path in enumerate(pending) if i not in missed],
+                     num_workers=num_workers)
+    if not misses:
+        logger.info("All WAV files already preprocessed")
+        return []
+
+    logger.info("%d WAV files require %s feature extraction",
+                len(misses), feat_type)
+    jobs = [(pending[i], feat_paths[i], feat_type,
+             feat_dir / "{}.wav".format(pending[i].stem) if keep_wavs else None)
+            for i in misses]
+    try:
+        return _run_extraction_jobs(_timed_extract_from_sources, jobs, feat_type,
+                                    num_workers=num_workers, chunksize=chunksize)
+    finally:
+        _store_in_cache(feat_cache, cache_keys, feat_paths)
+
+def _log_extraction_result(result: ExtractionResult, feat_type: str) -> None:
+    if result.error is None:
+        logger.info("Prepared %s features for %s in %0.3fs",
+                    feat_type, result.wav_path, result.seconds)
+    else:
+        logger.error("Failed to prepare %s features for %s: %s",
+                     feat_type, result.wav_path, result.error)
+
+def read_mono16k(org_wav_fn: Path) -> Tuple[int, np.ndarray]:
+    """ Reads audio as 16bit mono 16000Hz samples, returning the sample rate
+    and the samples.
+
+    WAV files are downmixed and resampled in memory. Files that can't be
+    read natively (other containers, or unusual WAV encodings) are converted
+    by calling ffmpeg.
+    """
+
+    if not org_wav_fn.exists():
+        raise FileNotFoundError
+    if org_wav_fn.suffix.lower() == ".wav":
+        try:
+            rate, samples = wav.read(str(org_wav_fn))
+        except ValueError:
+            logger.info("Can't read %s natively; converting with ffmpeg", org_wav_fn)
+        else:
+            return (wav_preprocess.TARGET_RATE,
+                    wav_preprocess.to_mono_16k(rate, samples))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_wav_fn = Path(tmp_dir) / "mono16k.wav"
+        convert_wav_ffmpeg(org_wav_fn, tmp_wav_fn)
+        return wav.read(str(tmp_wav_fn))
 
 def convert_wav(org_wav_fn: Path, tgt_wav_fn: Path) -> None:
     """ Converts the wav into a 16bit mono 16000Hz wav.
 
+    WAV files are downmixed and resampled in-process. Files that can't be
+    read natively (other containers, or unusual WAV encodings) are converted
+    by calling ffmpeg.
+
         Args:
             org_wav_fn: A `Path` to the original wave file
             tgt_wav_fn: The `Path` to output the processed wave file
     """
     if not org_wav_fn.exists():
         raise FileNotFoundError
+    if org_wav_fn.suffix.lower() != ".wav":
+        convert_wav_ffmpeg(org_wav_fn, tgt_wav_fn)
+        return
+    rate, samples = read_mono16k(org_wav_fn)
+    wav.write(str(tgt_wav_fn), rate, samples)
+
+def convert_wav_ffmpeg(org_wav_fn: Path, tgt_wav_fn: Path) -> None:
+    """ Converts any media file ffmpeg can read into a 16bit mono 16000Hz
+    wav. """
+
     args = [config.FFMPEG_PATH,
             "-i", str(org_wav_fn), "-ac", "1", "-ar", "16000", str(tgt_wav_fn)]
     subprocess.run(args)
 
-def kaldi_pitch(wav_dir: str, feat_dir: str) -> None:
-    """ Extract Kaldi pitch features. Assumes 16k mono wav files."""
+def _convert_wav_job(job: Tuple[Path, Path]) -> None:
+    convert_wav(*job)
 
-    logger.debug("Make wav.scp and pitch.scp files")
-    # Make wav.scp and pitch.scp files
-    prefixes = []
-    for fn in os.listdir(wav_dir):
-        prefix, ext = os.path.splitext(fn)
-        if ext == ".wav":
-            prefixes.append(prefix)
-
-    wav_scp_path = os.path.join(feat_dir, "wavs.scp")
-    with open(wav_scp_path, "w") as wav_scp:
-        for prefix in prefixes:
-            logger.info("Writing wav file: %s", os.path.join(wav_dir, prefix + ".wav"))
-            print(prefix, os.path.join(wav_dir, prefix + ".wav"), file=wav_scp)
-
-    pitch_scp_path = os.path.join(feat_dir, "pitch_feats.scp")
-    with open(pitch_scp_path, "w") as pitch_scp:
-        for prefix in prefixes:
-            logger.info("Writing scp file: %s", os.path.join(feat_dir, prefix + ".pitch.txt"))
-            print(prefix, os.path.join(feat_dir, prefix + ".pitch.txt"), file=pitch_scp)
-
-    # Call Kaldi pitch feat extraction
-    args = [os.path.join(config.KALDI_ROOT, "src/featbin/compute-kaldi-pitch-feats"),
-            "scp:%s" % (wav_scp_path), "scp,t:%s" % pitch_scp_path]
-    logger.info("Extracting pitch features from wavs listed in {}".format(
-        wav_scp_path))
-    subprocess.run(args)
+def convert_wavs(wav_paths: Sequence[Tuple[Path, Path]], *,
+                 num_workers: Optional[int] = None,
+                 chunksize: int = 16) -> None:
+    """ Converts many wavs into 16bit mono 16000Hz wavs over a pool of worker
+    processes.
 
-    # Convert the Kaldi pitch *.txt files to numpy arrays.
-    for fn in os.listdir(feat_dir):
-        if fn.endswith(".pitch.txt"):
-            pitch_feats = []
-            with open(os.path.join(feat_dir, fn)) as f:
-                for line in f:
-                    sp = line.split()
-                    if len(sp) > 1:
-                        pitch_feats.append([float(sp[0]), float(sp[1])])
-            prefix, _ = os.path.splitext(fn)
-            out_fn = prefix + ".npy"
-            a = np.array(pitch_feats)
-            np.save(os.path.join(feat_dir, out_fn), a)
+    Args:
+        wav_paths: (original path, target path) pairs, as for `convert_wav()`.
+        num_workers: The number of worker processes to use. If `None`, one
+            per CPU is used. If 1, conversion happens in this process.
+        chunksize: The number of files handed to a worker at a time.
+    """
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(wav_paths))
+    start = time.perf_counter()
+    if num_workers <= 1:
+        for org_wav_fn, tgt_wav_fn in wav_paths:
+            convert_wav(org_wav_fn, tgt_wav_fn)
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            # Consume the results so that exceptions are raised here.
+            for _ in executor.map(_convert_wav_job, wav_paths,
+                                  chunksize=max(1, chunksize)):
+                pass
+    logger.info("Converted %d wavs in %0.2fs", len(wav_paths),
+                time.perf_counter() - start)
+
+def convert_dir(org_dir: Path, tgt_dir: Path, *, lazy: bool = True,
+                num_workers: Optional[int] = None) -> None:
+    """ Converts all the wavs in org_dir into 16bit mono 16000Hz wavs of the
+    same name in tgt_dir. If lazy, existing wavs in tgt_dir are left alone."""
+
+    tgt_dir.mkdir(parents=True, exist_ok=True)
+    wav_paths = [(org_path, tgt_dir / org_path.name)
+                 for org_path in sorted(org_dir.glob("*.wav"))
+                 if not (lazy and (tgt_dir / org_path.name).is_file())]
+    convert_wavs(wav_paths, num_workers=num_workers)
@@ -3,7 +3,9 @@ Offers functions for tokenizing utterances into phonemes, characters or
 other symbols.
 """
 
-from typing import Callable, Iterable, NamedTuple, Set, Dict
+from functools import lru_cache
+import re
+from typing import Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Set
 
 from ..utterance import Utterance
 
@@ -65,6 +67,59 @@ def segment_into_chars(utterance: str) -> str:
         utterance = utterance.replace(char, "")
     return " ".join(utterance)
 
+class TokenSegmenter:
+    """ Segments utterances into the longest tokens of an inventory.
+
+    The inventory is compiled once into a regular expression that alternates
+    between the tokens, longest first. At each position of an utterance the
+    longest token that matches is taken; characters that don't begin any
+    token are skipped. This gives the same segmentation as trying every
+    token length from longest to shortest, but in a single pass through the
+    utterance.
+
+    Note: Your orthography may open the door to ambiguities in the
+    segmentation. Hopefully not, but another alternative it to simply segment
+    on characters with segment_into_chars()
+    """
+
+    def __init__(self, token_inventory: Iterable[str]) -> None:
+        self.tokens = frozenset(tok for tok in token_inventory if tok)
+        if not self.tokens:
+            raise ValueError("The token inventory is empty.")
+        # Sorting by length (then the token itself, for determinism) makes
+        # the alternation prefer the longest match.
+        ordered_tokens = sorted(self.tokens, key=lambda tok: (-len(tok), tok))
+        self.pattern = re.compile("|".join(re.escape(tok) for tok in ordered_tokens))
+
+    def __call__(self, utterance: str) -> str:
+        """ Returns the utterance segmented into space delimited tokens. """
+
+        if not isinstance(utterance, str):
+            raise TypeError("Input type must be a string. Got {}.".format(type(utterance)))
+        return " ".join(self.pattern.findall(utterance))
+
+    def segment_all(self, utterances: Iterable[str]) -> List[str]:
+        """ Segments each of a batch of utterances. """
+
+        return [self(utterance) for utterance in utterances]
+
+    def segment_utterance(self, utterance: Utterance) -> Utterance:
+        """ Returns a copy of the `Utterance` with its text segmented. """
+
+        return utterance._replace(text=self(utterance.text))
+
+    def label_segmenter(self) -> LabelSegmenter:
+        """ A `LabelSegmenter` that segments utterances into these tokens. """
+
+        return LabelSegmenter(self.segment_utterance, set(self.tokens))
+
+    def __repr__(self) -> str:
+        return "{}(num_tokens={})".format(self.__class__.__name__, len(self.tokens))
+
+@lru_cache(maxsize=16)
+def _cached_segmenter(token_inventory: FrozenSet[str]) -> TokenSegmenter:
+    return TokenSegmenter(token_inventory)
+
 def segment_into_tokens(utterance: str, token_inventory: Iterable[str]):
     """
     Segments an utterance (a string) into tokens based on an inventory of
@@ -74,39 +129,15 @@ def segment_into_tokens(utterance: str, token_inventory: Iterable[str]):
     character length) that is found in the token_inventory, and treat that as a
     token before segmenting the rest of the string.
 
-    Note: Your orthography may open the door to ambiguities in the
-    segmentation. Hopefully not, but another alternative it to simply segment
-    on characters with segment_into_chars()
+    The segmenter compiled from the inventory is cached between calls, but
+    when segmenting many utterances it's simpler to make a `TokenSegmenter`
+    once and use its `segment_all()`.
     """
 
     if not isinstance(utterance, str):
         raise TypeError("Input type must be a string. Got {}.".format(type(utterance)))
 
-    # Token inventory needs to be hashable for speed
-    token_inventory = set(token_inventory)
-    # Get the size of the longest token in the inventory
-    max_len = len(sorted(list(token_inventory), key=lambda x: len(x))[-1])
-
-    def segment_token(utterance):
-        if utterance == "":
-            return "", ""
-
-        for i in range(max_len, 0, -1):
-            if utterance[:i] in token_inventory:
-                return utterance[:i], utterance[i:]
-        # If the next character is preventing segmentation, move on.
-        # TODO This needs to be logged with a warning on the first occurrence.
-        return "", utterance[1:]
-
-    tokens = []
-    head, tail = segment_token(utterance)
-    tokens.append(head)
-    while tail != "":
-        head, tail = segment_token(tail)
-        tokens.append(head)
-    tokens = [tok for tok in tokens if tok != ""]
-
-    return " ".join(tokens)
+    return _cached_segmenter(frozenset(token_inventory))(utterance)
 
 def make_indices_to_labels(labels: Set[str]) -> Dict[int, str]:
     """ Creates a mapping from indices to labels. """
@@ -1,44 +1,173 @@
-""" Some functions to interface with the Pangloss """
-import logging
+""" Some functions to interface with the Pangloss
+
+Pangloss XML files are read with `iter_sents()`, which streams through the
+file with `ElementTree.iterparse`, yielding each sentence (or word, in
+wordlists) as soon as its element is closed and then discarding the element,
+so that large files are read in constant memory. `load_sents()` can be
+given a `SentsCache`, owned by the caller, which keeps the records of the
+most recently read files so that preparing the labels and the audio of a
+corpus reads each file only once.
+"""
 
+from collections import OrderedDict
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 from xml.etree import ElementTree
 
+from ..exceptions import PersephoneException
+
 logger = logging.getLogger(__name__) #type: ignore
 
-def get_sents_times_and_translations(xml_fn):
+PanglossSent = NamedTuple("PanglossSent", [("transcription", Optional[str]),
+                                           ("start_time", float),
+                                           ("end_time", float),
+                                           ("translations", List[str])])
+PanglossSent.__doc__ = (
+    """ An immutable record of a sentence (or wordlist entry) of a Pangloss
+    XML file.
+
+    Attributes:
+        transcription: The text of the phonological FORM of the sentence.
+        start_time: The start of the sentence in the audio, in seconds.
+        end_time: The end of the sentence in the audio, in seconds.
+        translations: The text of each of the sentence's TRANSL elements.
+    """)
+
+class SentsCache:
+    """ The sentence records of the most recently read Pangloss XML files,
+    keyed by path and stamped with the modification time and size of each
+    file when it was read, so that a file is read again if it changes. """
+
+    def __init__(self, max_files: int = 64) -> None:
+        """
+        Args:
+            max_files: The number of files whose records are kept. Once
+                exceeded, the least recently used file is forgotten.
+        """
+
+        self.max_files = max_files
+        self._entries = OrderedDict() # type: OrderedDict[str, Tuple[Tuple[int, int], str, List[PanglossSent]]]
+
+    def get(self, path: str, stamp: Tuple[int, int]
+            ) -> Optional[Tuple[str, List[PanglossSent]]]:
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != stamp:
+            return None
+        self._entries.move_to_end(path)
+        return entry[1], entry[2]
+
+    def put(self, path: str, stamp: Tuple[int, int], rec_type: str,
+            sents: List[PanglossSent]) -> None:
+        self._entries[path] = (stamp, rec_type, sents)
+        self._entries.move_to_end(path)
+        while len(self._entries) > self.max_files:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return "{}(max_files={}, num_files={})".format(
+            self.__class__.__name__, self.max_files, len(self._entries))
+
+def _check_root_tag(tag: str) -> None:
+    if not ("WORDLIST" in tag or tag == "TEXT"):
+        logger.critical('the root tag, %s, does not contain "WORDLIST", and is not "TEXT"', tag)
+        raise PersephoneException(
+            'The root tag, {}, does not contain "WORDLIST", and is not "TEXT"'.format(tag))
+
+def _sent_from_element(elem: ElementTree.Element) -> Optional[PanglossSent]:
+    """ Returns the record of an S or W element, or `None` if it isn't
+    aligned with the audio. """
+
+    audio_info = elem.find("AUDIO")
+    if audio_info is None:
+        return None
+    forms = elem.findall("FORM")
+    transcription = forms[0].text if forms else None
+    if len(forms) > 1:
+        # Assuming there is kindOf="phono" available.
+        for form in forms:
+            if form.attrib.get("kindOf") == "phono":
+                transcription = form.text
+    return PanglossSent(transcription,
+                        float(audio_info.attrib["start"]),
+                        float(audio_info.attrib["end"]),
+                        [trans.text for trans in elem.findall("TRANSL")])
+
+def get_root_tag(xml_fn: Union[str, Path]) -> str:
+    """ Returns the tag of the root element of a Pangloss XML file, which
+    gives its recording type ("TEXT" or "WORDLIST"), without reading the rest
+    of the file. """
+
+    for _, elem in ElementTree.iterparse(str(xml_fn), events=("start",)):
+        return elem.tag
+    raise PersephoneException("{} has no root element".format(xml_fn))
+
+def iter_sents(xml_fn: Union[str, Path]) -> Iterator[PanglossSent]:
+    """ Yields the sentences of a Pangloss XML file that are aligned with the
+    audio, reading the file incrementally.
+
+    Only S and W elements that are children of the root are sentences; words
+    within a sentence are part of it.
+    """
+
+    depth = 0
+    root = None # type: Optional[ElementTree.Element]
+    for event, elem in ElementTree.iterparse(str(xml_fn), events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+                _check_root_tag(root.tag)
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            if elem.tag == "S" or elem.tag == "W":
+                sent = _sent_from_element(elem)
+                if sent is not None:
+                    yield sent
+            # Discard the sentence once it has been read.
+            root.clear()
+
+def load_sents(xml_fn: Union[str, Path],
+               cache: Optional[SentsCache] = None
+               ) -> Tuple[str, List[PanglossSent]]:
+    """ Returns the root tag and sentences of a Pangloss XML file.
+
+    Args:
+        xml_fn: The path to the file.
+        cache: If given, the records are taken from the cache when the file
+            hasn't changed since it was last read, and added to it otherwise.
+    """
+
+    if cache is None:
+        return get_root_tag(xml_fn), list(iter_sents(xml_fn))
+    path = os.path.abspath(str(xml_fn))
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = cache.get(path, stamp)
+    if cached is not None:
+        return cached
+    rec_type = get_root_tag(path)
+    sents = list(iter_sents(path))
+    cache.put(path, stamp, rec_type, sents)
+    return rec_type, sents
+
+def get_sents_times_and_translations(xml_fn, cache: Optional[SentsCache] = None):
     """ Given an XML filename, loads the transcriptions, their start/end times,
     and translations. """
 
-    tree = ElementTree.parse(xml_fn)
-    root = tree.getroot()
-    if "WORDLIST" in root.tag or root.tag == "TEXT":
-        transcriptions = []
-        times = []
-        translations = []
-        for child in root:
-            # If it's a sentence or a word (this will be dictated by root_tag)
-            if child.tag == "S" or child.tag == "W":
-                forms = child.findall("FORM")
-                if len(forms) > 1:
-                    # Assuming there is kindOf="phono" available.
-                    for form in forms:
-                        if form.attrib["kindOf"] == "phono":
-                            transcription = form.text
-                else:
-                    transcription = child.find("FORM").text
-                audio_info = child.find("AUDIO")
-                if audio_info is not None:
-                    start_time = float(audio_info.attrib["start"])
-                    end_time = float(audio_info.attrib["end"])
-                    time = (start_time, end_time)
-                    translation = [trans.text for trans in child.findall("TRANSL")]
-                    transcriptions.append(transcription)
-                    times.append(time)
-                    translations.append(translation)
-
-        return root.tag, transcriptions, times, translations
-    logger.critical('the root tag, %s, does not contain "WORDLIST", and is not "TEXT"', root.tag)
-    assert False, root.tag
+    rec_type, sents = load_sents(xml_fn, cache)
+    transcriptions = [sent.transcription for sent in sents]
+    times = [(sent.start_time, sent.end_time) for sent in sents]
+    translations = [sent.translations for sent in sents]
+    return rec_type, transcriptions, times, translations
 
 def remove_content_in_brackets(sentence, brackets="[]"):
     out_sentence = ''
@@ -0,0 +1,151 @@
+""" Extracts pitch features from audio samples.
+
+For each frame this gives two columns, in the same order as Kaldi's
+`compute-kaldi-pitch-feats`: the normalized cross-correlation function
+(NCCF) at the chosen lag, which serves as a measure of voicing, and the pitch
+in Hz. Frames are 25ms long with a 10ms shift, and are counted the same way
+as by python_speech_features, so pitch features line up with fbank features
+frame for frame.
+
+All frames of an utterance are processed at once: the cross-correlations are
+computed with a single FFT over a matrix of frames, and the energies of the
+lagged windows from a cumulative sum of squares.
+"""
+
+from fractions import Fraction
+import math
+
+import numpy as np
+import scipy.signal
+
+#: The sample rate audio is downsampled to before pitch tracking.
+PITCH_RATE = 4000
+FRAME_LENGTH_SECS = 0.025
+FRAME_SHIFT_SECS = 0.01
+MIN_F0 = 50.0
+MAX_F0 = 400.0
+#: Frames whose NCCF is below this are treated as unvoiced, and their pitch is
+#: interpolated from the surrounding voiced frames.
+VOICING_THRESHOLD = 0.3
+#: Scales the term added to the NCCF denominator, relative to the mean frame
+#: energy, so that quiet frames don't give spuriously high correlations.
+NCCF_BALLAST = 0.01
+MEDIAN_WIDTH = 5
+#: A periodic signal correlates well at every multiple of its period, so the
+#: shortest lag at a peak within this fraction of the best NCCF is chosen, to
+#: avoid halving the pitch.
+OCTAVE_RATIO = 0.9
+
+def num_frames(num_samples: int, frame_len: int, frame_step: int) -> int:
+    """ The number of frames python_speech_features gives for a signal. """
+
+    if num_samples <= frame_len:
+        return 1
+    return 1 + int(math.ceil((num_samples - frame_len) / frame_step))
+
+def frame_signal(sig: np.ndarray, frame_len: int, frame_step: int,
+                 n_frames: int) -> np.ndarray:
+    """ Returns an (n_frames, frame_len) array of overlapping frames of the
+    signal, zero padding its end as required. """
+
+    padded_len = (n_frames - 1) * frame_step + frame_len
+    padded = np.zeros(max(padded_len, len(sig)), dtype=np.float64)
+    padded[:len(sig)] = sig
+    stride = padded.strides[0]
+    return np.lib.stride_tricks.as_strided(
+        padded, shape=(n_frames, frame_len),
+        strides=(frame_step * stride, stride), writeable=False)
+
+def nccf(frames: np.ndarray, window: int, min_lag: int,
+         max_lag: int) -> np.ndarray:
+    """ Computes the normalized cross-correlation of the first `window`
+    samples of each frame with the window starting `lag` samples later, for
+    lags from min_lag to max_lag inclusive.
+
+    Args:
+        frames: An array of shape (num_frames, window + max_lag).
+
+    Returns:
+        An array of shape (num_frames, max_lag - min_lag + 1).
+    """
+
+    n_fft = 1 << (frames.shape[1] - 1).bit_length()
+    spectrum = np.fft.rfft(frames, n=n_fft, axis=1)
+    head_spectrum = np.fft.rfft(frames[:, :window], n=n_fft, axis=1)
+    corr = np.fft.irfft(np.conj(head_spectrum) * spectrum, n=n_fft, axis=1)
+    corr = corr[:, min_lag:max_lag+1]
+
+    cum_energy = np.zeros((frames.shape[0], frames.shape[1] + 1))
+    np.cumsum(frames ** 2, axis=1, out=cum_energy[:, 1:])
+    head_energy = cum_energy[:, window]
+    lags = np.arange(min_lag, max_lag + 1)
+    lag_energy = cum_energy[:, lags + window] - cum_energy[:, lags]
+
+    ballast = (NCCF_BALLAST * np.mean(head_energy)) ** 2
+    return corr / np.sqrt(head_energy[:, np.newaxis] * lag_energy + ballast + 1e-20)
+
+def _median_filter(values: np.ndarray, width: int) -> np.ndarray:
+    """ A running median that repeats the edge values rather than padding
+    with zeros. """
+
+    half = width // 2
+    padded = np.pad(values, half, mode="edge")
+    stride = padded.strides[0]
+    windows = np.lib.stride_tricks.as_strided(
+        padded, shape=(len(values), width), strides=(stride, stride),
+        writeable=False)
+    return np.median(windows, axis=1)
+
+def pitch_from_signal(rate: int, sig: np.ndarray) -> np.ndarray:
+    """ Computes (NCCF, pitch) features of each frame of a mono signal.
+
+    Args:
+        rate: The sample rate of the signal.
+        sig: The samples of the signal.
+
+    Returns:
+        An array of shape (num_frames, 2).
+    """
+
+    n_frames = num_frames(len(sig), int(round(FRAME_LENGTH_SECS * rate)),
+                          int(round(FRAME_SHIFT_SECS * rate)))
+    sig = np.asarray(sig, dtype=np.float64)
+    if rate != PITCH_RATE:
+        ratio = Fraction(PITCH_RATE, rate)
+        sig = scipy.signal.resample_poly(sig, ratio.numerator, ratio.denominator)
+
+    window = int(round(FRAME_LENGTH_SECS * PITCH_RATE))
+    step = int(round(FRAME_SHIFT_SECS * PITCH_RATE))
+    min_lag = int(math.floor(PITCH_RATE / MAX_F0))
+    max_lag = int(math.ceil(PITCH_RATE / MIN_F0))
+    frames = frame_signal(sig, window + max_lag, step, n_frames)
+    correlations = nccf(frames, window, min_lag, max_lag)
+
+    frame_indices = np.arange(n_frames)
+    max_corr = np.max(correlations, axis=1)
+    padded = np.pad(correlations, ((0, 0), (1, 1)), mode="constant",
+                    constant_values=-np.inf)
+    peaks = ((correlations >= padded[:, :-2]) & (correlations >= padded[:, 2:])
+             & (correlations >= OCTAVE_RATIO * max_corr[:, np.newaxis]))
+    # The global maximum is always a peak, so each frame has a candidate.
+    best = np.argmax(peaks, axis=1)
+    voicing = correlations[frame_indices, best]
+
+    # Refine the best lag by fitting a parabola through its neighbours.
+    inner = (best > 0) & (best < correlations.shape[1] - 1)
+    prev_corr = correlations[frame_indices, np.maximum(best - 1, 0)]
+    next_corr = correlations[frame_indices,
+                             np.minimum(best + 1, correlations.shape[1] - 1)]
+    curvature = prev_corr - 2 * voicing + next_corr
+    offset = np.zeros(n_frames)
+    fit = inner & (curvature < 0)
+    offset[fit] = 0.5 * (prev_corr[fit] - next_corr[fit]) / curvature[fit]
+    pitch = PITCH_RATE / (min_lag + best + offset)
+
+    voiced = voicing >= VOICING_THRESHOLD
+    if voiced.any() and not voiced.all():
+        pitch[~voiced] = np.interp(frame_indices[~voiced],
+                                   frame_indices[voiced], pitch[voiced])
+    pitch = _median_filter(pitch, MEDIAN_WIDTH)
+
+    return np.stack([voicing, pitch], axis=1)
@@ -1,11 +1,16 @@
 """ Provide functions for preprocessing the WAV files. """
 
+from collections import OrderedDict
+from fractions import Fraction
 import logging
 from pathlib import Path
 import subprocess
-from typing import List
+from typing import Dict, List, Tuple
 
+import numpy as np
 from pydub import AudioSegment # type: ignore
+import scipy.io.wavfile
+import scipy.signal
 
 from .. import config
 from ..utterance import Utterance
@@ -87,11 +92,120 @@ def trim_wav_sox(in_path: Path, out_path: Path,
                 in_path, start_time_secs, end_time_secs, out_path)
     subprocess.run(args, check=True)
 
+TARGET_RATE = 16000
+
+def read_audio(path: Path, mmap: bool = False) -> Tuple[int, np.ndarray]:
+    """ Reads a media file into a sample rate and a (samples, channels) array.
+
+    WAV files are read directly. Other formats, and WAV encodings that scipy
+    can't read, are decoded through pydub/ffmpeg.
+
+    Args:
+        path: The path to the media file.
+        mmap: If True, the samples of a WAV file are memory mapped rather
+            than read into memory, where its encoding allows.
+    """
+
+    if path.suffix.lower() == ".wav":
+        try:
+            try:
+                rate, samples = scipy.io.wavfile.read(str(path), mmap=mmap)
+            except ValueError:
+                if not mmap:
+                    raise
+                # Some encodings, such as 24 bit PCM, can't be memory mapped.
+                rate, samples = scipy.io.wavfile.read(str(path))
+            if samples.ndim == 1:
+                samples = samples[:, np.newaxis]
+            return rate, samples
+        except ValueError:
+            logger.info("scipy can't read %s; falling back to pydub/ffmpeg", path)
+    audio = AudioSegment.from_file(str(path), path.suffix[1:])
+    samples = np.array(audio.get_array_of_samples())
+    return audio.frame_rate, samples.reshape(-1, audio.channels)
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    """ Converts samples of any of the dtypes found in WAV files to 16 bit. """
+
+    if samples.dtype == np.int16:
+        return samples
+    if samples.dtype == np.uint8:
+        return ((samples.astype(np.int16) - 128) << 8).astype(np.int16)
+    if samples.dtype == np.int32:
+        return (samples >> 16).astype(np.int16)
+    if np.issubdtype(samples.dtype, np.floating):
+        return np.clip(np.round(samples * 32767), -32768, 32767).astype(np.int16)
+    raise ValueError("Unsupported sample dtype {}".format(samples.dtype))
+
+def _to_mono(samples: np.ndarray) -> np.ndarray:
+    """ Downmixes (samples, channels) audio to float32 mono at the scale of
+    16 bit samples. """
+
+    samples = to_int16(samples)
+    if samples.ndim == 2:
+        if samples.shape[1] > 1:
+            return samples.mean(axis=1, dtype=np.float32)
+        samples = samples[:, 0]
+    return samples.astype(np.float32)
+
+def to_mono_16k(rate: int, samples: np.ndarray) -> np.ndarray:
+    """ Downmixes (samples, channels) audio to mono and resamples it to 16kHz
+    with a polyphase filter, returning 16 bit samples. """
+
+    mono = _to_mono(samples)
+    if rate != TARGET_RATE:
+        ratio = Fraction(TARGET_RATE, rate)
+        mono = scipy.signal.resample_poly(mono, ratio.numerator, ratio.denominator)
+    return np.clip(np.round(mono), -32768, 32767).astype(np.int16)
+
+def segment_mono_16k(rate: int, samples: np.ndarray, start: int,
+                     end: int) -> np.ndarray:
+    """ Returns `to_mono_16k(rate, samples)[start:end]`, converting only the
+    part of the source audio that the segment covers, so that the whole
+    recording needn't be held in memory at 16kHz.
+
+    The source is cut at a boundary of the resampler's phase, with a margin
+    on either side wider than its filter, so the segment matches the one cut
+    from the whole converted recording up to rounding.
+
+    Args:
+        rate: The sample rate of the source.
+        samples: The (samples, channels) source audio, which may be memory
+            mapped.
+        start: The first 16kHz sample of the segment.
+        end: The 16kHz sample after the last one of the segment.
+    """
+
+    if rate == TARGET_RATE:
+        return to_mono_16k(rate, samples[start:end])
+    ratio = Fraction(TARGET_RATE, rate)
+    up, down = ratio.numerator, ratio.denominator
+    # resample_poly's filter reaches 10 * max(up, down) upsampled samples
+    # either side of each output sample.
+    margin = max(TARGET_RATE // 10, -(-20 * max(up, down) // down))
+    # Every up output samples correspond to exactly down source samples.
+    first_block = max(0, start - margin) // up
+    last_block = -(-(end + margin) // up)
+    src_start = first_block * down
+    src_end = min(len(samples), last_block * down)
+    converted = to_mono_16k(rate, samples[src_start:src_end])
+    offset = first_block * up
+    return converted[max(start - offset, 0):max(end - offset, 0)]
+
+def ms_to_sample(millisecs: int, rate: int = TARGET_RATE) -> int:
+    return int(round(millisecs * rate / 1000))
+
 def extract_wavs(utterances: List[Utterance], tgt_dir: Path,
                  lazy: bool) -> None:
     """ Extracts WAVs from the media files associated with a list of Utterance
     objects and stores it in a target directory.
 
+    Each source media file is opened only once. WAV sources are memory
+    mapped and only the span each utterance covers is converted to 16kHz
+    mono, so memory use is bounded by the longest utterance rather than the
+    length of the recording. The output WAVs are therefore already 16kHz
+    mono.
+
     Args:
         utterances: A list of Utterance objects, which include information
             about the source media file, and the offset of the utterance in the
@@ -101,6 +215,8 @@ def extract_wavs(utterances: List[Utterance], tgt_dir: Path,
             the same name
     """
     tgt_dir.mkdir(parents=True, exist_ok=True)
+
+    media_utters = OrderedDict() # type: Dict[Path, List[Utterance]]
     for utter in utterances:
         wav_fn = "{}.{}".format(utter.prefix, "wav")
         out_wav_path = tgt_dir / wav_fn
@@ -108,7 +224,18 @@ def extract_wavs(utterances: List[Utterance], tgt_dir: Path,
             logger.info("File {} already exists and lazy == {}; not " \
                          "writing.".format(out_wav_path, lazy))
             continue
-        logger.info("File {} does not exist and lazy == {}; creating " \
-                     "it.".format(out_wav_path, lazy))
-        trim_wav_ms(utter.org_media_path, out_wav_path,
-                    utter.start_time, utter.end_time)
+        media_utters.setdefault(utter.org_media_path, []).append(utter)
+
+    for media_path, utters in media_utters.items():
+        logger.info("Decoding %s to extract %d utterances", media_path, len(utters))
+        rate, samples = read_audio(Path(media_path), mmap=True)
+        for utter in utters:
+            out_wav_path = tgt_dir / "{}.{}".format(utter.prefix, "wav")
+            logger.info("File {} does not exist and lazy == {}; creating " \
+                         "it.".format(out_wav_path, lazy))
+            segment = segment_mono_16k(rate, samples,
+                                       ms_to_sample(utter.start_time),
+                                       ms_to_sample(utter.end_time))
+            scipy.io.wavfile.write(str(out_wav_path), TARGET_RATE, segment)
+        # Release the memory map of the source.
+        del samples
@@ -1,19 +1,91 @@
 """ An acoustic model with a LSTM/CTC architecture. """
 
 import os
-from typing import Union, Dict, Any
+from typing import Any, Dict, List, Optional, Tuple, Union
 from pathlib import Path
 
 import numpy as np
 import tensorflow as tf
 
 from . import model
-
-def lstm_cell(hidden_size):
+from .exceptions import PersephoneException
+from .session_config import SessionConfig
+
+#: Decoders that can be used to measure the LER during training. "greedy"
+#: takes the most probable label at each frame, "beam" is a beam search of
+#: width valid_beam_width and "full" is the same beam search used by
+#: `eval()` and `transcribe()`.
+VALID_DECODERS = ("greedy", "beam", "full")
+
+#: Implementations of the LSTM layers. "standard" is `tf.contrib.rnn.LSTMCell`,
+#: which unrolls into several small ops per timestep. "block" is
+#: `LSTMBlockCell`, which computes a timestep in a single op, and "fused" is
+#: `LSTMBlockFusedCell`, which computes the whole sequence in a single op. All
+#: three are peephole LSTMs with the same gate layout and variable names, so a
+#: checkpoint saved with one can be restored with either of the others.
+CELL_TYPES = ("standard", "block", "fused")
+
+def lstm_cell(hidden_size, cell_type: str = "standard"):
     """ Wrapper function to create an LSTM cell. """
 
-    return tf.contrib.rnn.LSTMCell(
-        hidden_size, use_peepholes=True, state_is_tuple=True)
+    if cell_type == "standard":
+        return tf.contrib.rnn.LSTMCell(
+            hidden_size, use_peepholes=True, state_is_tuple=True)
+    if cell_type == "block":
+        return tf.contrib.rnn.LSTMBlockCell(
+            hidden_size, use_peephole=True, name="lstm_cell")
+    if cell_type == "fused":
+        # Named like the other cells, rather than "lstm_fused_cell", so that
+        # the variables are interchangeable.
+        return tf.contrib.rnn.LSTMBlockFusedCell(
+            hidden_size, use_peephole=True, name="lstm_cell")
+    raise PersephoneException("Unknown LSTM cell type {!r}; expected one of"
+                              " {}".format(cell_type, CELL_TYPES))
+
+def canonical_variable_name(name: str) -> str:
+    """ Returns the name a variable of an LSTM layer has in graphs built by
+    `Model`, given its name in a checkpoint. Fused cells built with their
+    default name keep their variables under "lstm_fused_cell", and older
+    versions of Tensorflow named the LSTM kernel and bias "weights" and
+    "biases". Other names are returned as is. """
+
+    parts = name.split("/")
+    for i, part in enumerate(parts):
+        if part == "lstm_fused_cell":
+            parts[i] = "lstm_cell"
+        if i > 0 and parts[i-1] == "lstm_cell":
+            parts[i] = {"weights": "kernel", "biases": "bias"}.get(part, part)
+    return "/".join(parts)
+
+def convert_checkpoint(src_path_prefix: Union[str, Path],
+                       tgt_path_prefix: Union[str, Path]) -> Dict[str, str]:
+    """ Copies a checkpoint, renaming the variables of its LSTM layers with
+    `canonical_variable_name()` so that it can be restored into a `Model` of
+    any of the `CELL_TYPES`. Optimizer slots are renamed along with their
+    variables. No metagraph is written, so the converted checkpoint is
+    restored with `train()` or `eval()` of a freshly built `Model` rather than
+    with `model.decode()`.
+
+    Returns:
+        A dictionary mapping the names of the variables that were renamed to
+        their new names.
+    """
+
+    reader = tf.train.NewCheckpointReader(str(src_path_prefix))
+    names = sorted(reader.get_variable_to_shape_map())
+    new_names = {name: canonical_variable_name(name) for name in names}
+    if len(set(new_names.values())) != len(names):
+        raise PersephoneException("The variables of {} can't be renamed"
+                                  " without a clash.".format(src_path_prefix))
+    with tf.Graph().as_default(): #type: ignore
+        var_list = {new_names[name]: tf.Variable(reader.get_tensor(name))
+                    for name in names}
+        saver = tf.train.Saver(var_list)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            saver.save(sess, str(tgt_path_prefix), write_meta_graph=False)
+    return {name: new_name for name, new_name in new_names.items()
+            if name != new_name}
 
 class Model(model.Model):
     """ An acoustic model with a LSTM/CTC architecture. """
@@ -60,8 +132,50 @@ class Model(model.Model):
 
     def __init__(self, exp_dir: Union[str, Path], corpus_reader, num_layers: int = 3,
                  hidden_size: int=250, beam_width: int = 100,
-                 decoding_merge_repeated: bool = True) -> None:
-        super().__init__(exp_dir, corpus_reader)
+                 decoding_merge_repeated: bool = True,
+                 valid_decoder: str = "full",
+                 valid_beam_width: int = 10,
+                 num_towers: int = 1,
+                 cell_type: str = "standard",
+                 session_config: Union[None, SessionConfig, tf.ConfigProto] = None
+                 ) -> None:
+        """
+        Args:
+            beam_width: The beam width used to decode in `eval()`,
+                `transcribe()` and `decode()`.
+            valid_decoder: The decoder used for the training and validation
+                LERs reported each epoch, which select the best checkpoint.
+                One of `VALID_DECODERS`. By default this is the full beam
+                search decoder used by `eval()`. Beam search over the whole
+                validation set every epoch is slow, so "greedy" (or "beam"
+                with a narrow valid_beam_width) can be chosen to speed up
+                training, at the cost of selecting checkpoints by a
+                different LER.
+            valid_beam_width: The beam width if valid_decoder is "beam".
+            num_towers: The number of replicas of the network that each
+                training batch is split between. The replicas share their
+                variables and their gradients are combined synchronously, so
+                training follows the same gradients as with one tower, but
+                the towers' ops can run concurrently across CPU cores.
+                Batches should hold at least num_towers utterances.
+            cell_type: The implementation of the LSTM layers, one of
+                `CELL_TYPES`. The fused cell is usually the fastest on CPU,
+                and checkpoints are interchangeable between the three.
+            session_config: The `SessionConfig` of the sessions the model
+                is trained, evaluated and decoded in. Towers are of most use
+                with enough inter-op threads to run them concurrently.
+        """
+        super().__init__(exp_dir, corpus_reader, session_config=session_config)
+
+        if valid_decoder not in VALID_DECODERS:
+            raise PersephoneException("Unknown validation decoder {!r}; expected"
+                                      " one of {}".format(valid_decoder, VALID_DECODERS))
+        if cell_type not in CELL_TYPES:
+            raise PersephoneException("Unknown LSTM cell type {!r}; expected"
+                                      " one of {}".format(cell_type, CELL_TYPES))
+        if num_towers < 1:
+            raise PersephoneException("num_towers must be at least 1, got"
+                                      " {}".format(num_towers))
 
         if isinstance(exp_dir, Path):
             exp_dir = str(exp_dir)
@@ -78,6 +192,11 @@ class Model(model.Model):
         self.num_layers = num_layers
         self.hidden_size = hidden_size
         self.beam_width = beam_width
+        self.valid_decoder = valid_decoder
+        self.valid_beam_width = valid_beam_width
+        self.decoding_merge_repeated = decoding_merge_repeated
+        self.num_towers = num_towers
+        self.cell_type = cell_type
         self.vocab_size = vocab_size
 
         # Initialize placeholders for feeding data to model.
@@ -87,26 +206,8 @@ class Model(model.Model):
         self.batch_x_lens = tf.placeholder(tf.int32, [None], name="batch_x_lens")
         self.batch_y = tf.sparse_placeholder(tf.int32)
 
-        batch_size = tf.shape(self.batch_x)[0]
-
-        layer_input = self.batch_x
-
-        for i in range(num_layers):
-
-            with tf.variable_scope("layer_%d" % i): #type: ignore
-
-                cell_fw = lstm_cell(self.hidden_size)
-                cell_bw = lstm_cell(self.hidden_size)
-
-                (self.out_fw, self.out_bw), _ = tf.nn.bidirectional_dynamic_rnn(
-                        cell_fw, cell_bw, layer_input, self.batch_x_lens, dtype=tf.float32,
-                        time_major=False)
-
-                # Self outputs now becomes [batch_num, time, hidden_size*2]
-                self.outputs_concat = tf.concat((self.out_fw, self.out_bw), 2) #type: ignore
-
-                # For feeding into the next layer
-                layer_input = self.outputs_concat
+        self.out_fw, self.out_bw, self.outputs_concat = self.bilstm(
+                self.batch_x, self.batch_x_lens)
 
         self.outputs = tf.reshape(self.outputs_concat, [-1, self.hidden_size*2]) # pylint: disable=no-member
 
@@ -115,10 +216,7 @@ class Model(model.Model):
         W = tf.Variable(tf.truncated_normal([hidden_size*2, vocab_size],
                 stddev=np.sqrt(2.0 / (2*hidden_size)))) #type: ignore
         b = tf.Variable(tf.zeros([vocab_size])) #type: ignore
-        self.logits = tf.matmul(self.outputs, W) + b #type: ignore
-        self.logits = tf.reshape(self.logits, [batch_size, -1, vocab_size]) # pylint: disable=no-member
-        # igormq made it time major, because of an optimization in ctc_loss.
-        self.logits = tf.transpose(self.logits, (1, 0, 2), name="logits") #type: ignore
+        self.logits = self.project(self.outputs_concat, W, b, name="logits")
 
         # For lattice construction
         self.log_softmax = tf.nn.log_softmax(self.logits)
@@ -135,9 +233,183 @@ class Model(model.Model):
         self.loss = tf.nn.ctc_loss(self.batch_y, self.logits, self.batch_x_lens,
                 preprocess_collapse_repeated=False, ctc_merge_repeated=True)
         self.cost = tf.reduce_mean(self.loss)
-        self.optimizer = tf.train.AdamOptimizer().minimize(self.cost) #type: ignore
+        if num_towers == 1:
+            self.optimizer = tf.train.AdamOptimizer().minimize(self.cost) #type: ignore
+        else:
+            self.optimizer, self.train_ler = self.build_towers(W, b)
 
         self.ler = tf.reduce_mean(tf.edit_distance(
                 tf.cast(self.decoded[0], tf.int32), self.batch_y)) #type: ignore
+        # Unnormalized, so that they can be accumulated over sub-batches.
+        self.edit_distances = tf.edit_distance(
+                tf.cast(self.decoded[0], tf.int32), self.batch_y,
+                normalize=False, name="edit_distances") #type: ignore
+
+        # The cheaper decoding used to monitor training.
+        if valid_decoder != "full":
+            valid_decoded = self.monitor_decode(self.logits, self.batch_x_lens)
+            self.valid_dense_decoded = tf.sparse_tensor_to_dense(
+                    valid_decoded[0], name="valid_dense_decoded")
+            self.valid_ler = tf.reduce_mean(tf.edit_distance(
+                    tf.cast(valid_decoded[0], tf.int32), self.batch_y)) #type: ignore
+            self.valid_edit_distances = tf.edit_distance(
+                    tf.cast(valid_decoded[0], tf.int32), self.batch_y,
+                    normalize=False) #type: ignore
 
         self.write_desc()
+
+    def bilstm(self, batch_x: tf.Tensor, batch_x_lens: tf.Tensor
+               ) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
+        """ Builds the stacked bidirectional LSTM layers over a batch. The
+        layers' variables are shared between calls.
+
+        Returns:
+            The forward and backward outputs of the top layer, and their
+            concatenation, of shape [batch_num, time, hidden_size*2].
+        """
+
+        if self.cell_type == "fused":
+            return self.fused_bilstm(batch_x, batch_x_lens)
+
+        layer_input = batch_x
+
+        for i in range(self.num_layers):
+
+            with tf.variable_scope("layer_%d" % i, reuse=tf.AUTO_REUSE): #type: ignore
+
+                cell_fw = lstm_cell(self.hidden_size, self.cell_type)
+                cell_bw = lstm_cell(self.hidden_size, self.cell_type)
+
+                (out_fw, out_bw), _ = tf.nn.bidirectional_dynamic_rnn(
+                        cell_fw, cell_bw, layer_input, batch_x_lens, dtype=tf.float32,
+                        time_major=False)
+
+                # Outputs now become [batch_num, time, hidden_size*2]
+                outputs_concat = tf.concat((out_fw, out_bw), 2) #type: ignore
+
+                # For feeding into the next layer
+                layer_input = outputs_concat
+
+        return out_fw, out_bw, outputs_concat
+
+    def fused_bilstm(self, batch_x: tf.Tensor, batch_x_lens: tf.Tensor
+                     ) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor]:
+        """ As with `bilstm()`, but with fused LSTM cells. These run time
+        major, so the batch is transposed once on the way in and once on the
+        way out rather than at every layer. The variable scopes match those
+        of `tf.nn.bidirectional_dynamic_rnn`. """
+
+        layer_input = tf.transpose(batch_x, [1, 0, 2])
+
+        for i in range(self.num_layers):
+
+            with tf.variable_scope("layer_%d" % i, reuse=tf.AUTO_REUSE): #type: ignore
+                with tf.variable_scope("bidirectional_rnn"):
+
+                    with tf.variable_scope("fw"):
+                        out_fw, _ = lstm_cell(self.hidden_size, "fused")(
+                                layer_input, sequence_length=batch_x_lens,
+                                dtype=tf.float32)
+
+                    with tf.variable_scope("bw"):
+                        reversed_input = tf.reverse_sequence(
+                                layer_input, batch_x_lens, seq_axis=0, batch_axis=1)
+                        out_bw, _ = lstm_cell(self.hidden_size, "fused")(
+                                reversed_input, sequence_length=batch_x_lens,
+                                dtype=tf.float32)
+                        out_bw = tf.reverse_sequence(
+                                out_bw, batch_x_lens, seq_axis=0, batch_axis=1)
+
+                layer_input = tf.concat((out_fw, out_bw), 2) #type: ignore
+
+        out_fw = tf.transpose(out_fw, [1, 0, 2])
+        out_bw = tf.transpose(out_bw, [1, 0, 2])
+        outputs_concat = tf.transpose(layer_input, [1, 0, 2])
+        return out_fw, out_bw, outputs_concat
+
+    def project(self, outputs_concat: tf.Tensor, W: tf.Variable, b: tf.Variable,
+                name: Optional[str] = None) -> tf.Tensor:
+        """ Projects the LSTM outputs onto the vocabulary, giving time major
+        logits. """
+
+        batch_size = tf.shape(outputs_concat)[0]
+        outputs = tf.reshape(outputs_concat, [-1, self.hidden_size*2])
+        logits = tf.matmul(outputs, W) + b #type: ignore
+        logits = tf.reshape(logits, [batch_size, -1, self.vocab_size])
+        # igormq made it time major, because of an optimization in ctc_loss.
+        return tf.transpose(logits, (1, 0, 2), name=name) #type: ignore
+
+    def monitor_decode(self, logits: tf.Tensor, batch_x_lens: tf.Tensor) -> List[tf.SparseTensor]:
+        """ Decodes logits with the decoder used to monitor training. """
+
+        if self.valid_decoder == "greedy":
+            decoded, _ = tf.nn.ctc_greedy_decoder(
+                    logits, batch_x_lens, merge_repeated=self.decoding_merge_repeated)
+        else:
+            beam_width = (self.valid_beam_width if self.valid_decoder == "beam"
+                          else self.beam_width)
+            decoded, _ = tf.nn.ctc_beam_search_decoder(
+                    logits, batch_x_lens, beam_width=beam_width,
+                    merge_repeated=self.decoding_merge_repeated)
+        return decoded
+
+    def build_towers(self, W: tf.Variable, b: tf.Variable) -> Tuple[tf.Operation, tf.Tensor]:
+        """ Builds the data parallel training graph. Each of num_towers
+        replicas of the network, sharing the model's variables, takes a
+        contiguous shard of the batch. Each tower's loss is summed and scaled
+        by the number of utterances in the whole batch, so the sum of the
+        towers' gradients is the gradient of the mean loss over the batch,
+        and it is applied in a single synchronous update.
+
+        A batch with fewer than num_towers utterances, such as the last
+        batch of an epoch, leaves some shards empty. Those towers are
+        skipped, contributing no loss and no edit distances.
+
+        Returns:
+            The training op, and the label error rate of the batch under the
+            monitoring decoder, computed from the towers' outputs so the
+            batch isn't run through the network a second time.
+        """
+
+        batch_size = tf.shape(self.batch_x)[0]
+        optimizer = tf.train.AdamOptimizer()
+        tower_grads = []
+        tower_distances = []
+        for tower in range(self.num_towers):
+            with tf.name_scope("tower_%d" % tower):
+                start = (tower * batch_size) // self.num_towers
+                end = ((tower + 1) * batch_size) // self.num_towers
+
+                def run_tower(start=start, end=end):
+                    shard_x = self.batch_x[start:end]
+                    shard_x_lens = self.batch_x_lens[start:end]
+                    shard_y = tf.sparse_slice(
+                            self.batch_y, tf.cast(tf.stack([start, 0]), tf.int64),
+                            tf.stack([tf.cast(end - start, tf.int64),
+                                      self.batch_y.dense_shape[1]]))
+
+                    _, _, outputs_concat = self.bilstm(shard_x, shard_x_lens)
+                    logits = self.project(outputs_concat, W, b)
+                    loss = tf.nn.ctc_loss(shard_y, logits, shard_x_lens,
+                            preprocess_collapse_repeated=False, ctc_merge_repeated=True)
+                    tower_cost = tf.reduce_sum(loss) / tf.cast(batch_size, tf.float32)
+
+                    decoded = self.monitor_decode(logits, shard_x_lens)
+                    distances = tf.edit_distance(
+                            tf.cast(decoded[0], tf.int32), shard_y)
+                    return tower_cost, distances
+
+                def skip_tower():
+                    return tf.constant(0.0), tf.zeros([0])
+
+                tower_cost, distances = tf.cond(end > start, run_tower, skip_tower)
+                tower_grads.append(optimizer.compute_gradients(tower_cost))
+                tower_distances.append(distances)
+
+        grads_and_vars = []
+        for var_grads in zip(*tower_grads):
+            grads = [grad for grad, _ in var_grads if grad is not None]
+            grads_and_vars.append((tf.add_n(grads) if grads else None, var_grads[0][1]))
+        train_op = optimizer.apply_gradients(grads_and_vars)
+        train_ler = tf.reduce_mean(tf.concat(tower_distances, 0))
+        return train_op, train_ler
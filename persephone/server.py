@@ -0,0 +1,268 @@
+""" A local HTTP server that transcribes speech with a trained model.
+
+Run against a saved model with, for example::
+
+    python -m persephone.server --model exp/0/model/model_best.ckpt \\
+        --corpus-dir data/my_corpus --port 8000
+
+Endpoints:
+    POST /transcribe: With a `Content-Type` of `audio/wav` (or
+        `application/octet-stream`), the body is a WAV file to transcribe.
+        With a `Content-Type` of `application/json`, the body is an object
+        of the form `{"paths": ["/path/to/a.wav", ...]}` naming WAV files
+        on the server's filesystem. Responds with
+        `{"transcripts": [["l", "a", "b", ...], ...], "latency": seconds}`.
+        Paths that don't exist give a 404, and audio that can't be decoded
+        gives a 415, each with a JSON body of the form `{"error": message}`.
+    GET /metrics: Responds with request counts, latency and throughput.
+
+Requests that arrive close together are decoded as a single batch by the
+underlying `Transcriber`.
+"""
+
+import argparse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import socketserver
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import scipy.io.wavfile
+
+logger = logging.getLogger(__name__) # type: ignore
+
+class RequestError(Exception):
+    """ A problem with a request that the client should be told about, with
+    the HTTP status to respond with. """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+class ServerMetrics:
+    """ Thread-safe counters of the requests served. """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.num_requests = 0
+        self.num_utterances = 0
+        self.num_errors = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record(self, num_utterances: int, latency: float) -> None:
+        with self._lock:
+            self.num_requests += 1
+            self.num_utterances += num_utterances
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self.num_errors += 1
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            uptime = time.monotonic() - self.start_time
+            return {
+                "uptime": uptime,
+                "requests": self.num_requests,
+                "utterances": self.num_utterances,
+                "errors": self.num_errors,
+                "mean_latency": (self.total_latency / self.num_requests
+                                 if self.num_requests else 0.0),
+                "max_latency": self.max_latency,
+                "utterances_per_second": (self.num_utterances / uptime
+                                          if uptime > 0 else 0.0),
+            }
+
+class TranscriptionHandler(BaseHTTPRequestHandler):
+    """ Handles requests to a `TranscriptionServer`. """
+
+    def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+        data = json.dumps(body).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None: # pylint: disable=redefined-builtin
+        logger.info("%s %s", self.client_address, format % args)
+
+    def do_GET(self) -> None: # pylint: disable=invalid-name
+        if self.path == "/metrics":
+            self._send_json(200, self.server.metrics.summary()) # type: ignore
+        else:
+            self._send_json(404, {"error": "Unknown path {}".format(self.path)})
+
+    def do_POST(self) -> None: # pylint: disable=invalid-name
+        if self.path != "/transcribe":
+            self._send_json(404, {"error": "Unknown path {}".format(self.path)})
+            return
+        start = time.perf_counter()
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        try:
+            if content_type == "application/json":
+                paths = json.loads(body.decode("utf8"))["paths"]
+                transcripts = self.server.transcribe_paths(paths) # type: ignore
+            elif content_type in ("audio/wav", "audio/x-wav",
+                                  "application/octet-stream"):
+                transcripts = self.server.transcribe_wav_bytes(body) # type: ignore
+            else:
+                self._send_json(415, {"error": "Unsupported content type {}".format(
+                    content_type)})
+                return
+        except RequestError as e:
+            self.server.metrics.record_error() # type: ignore
+            self._send_json(e.status, {"error": str(e)})
+            return
+        except FileNotFoundError as e:
+            self.server.metrics.record_error() # type: ignore
+            self._send_json(404, {"error": "File not found: {}".format(e)})
+            return
+        except subprocess.CalledProcessError:
+            # ffmpeg couldn't decode the audio either.
+            self.server.metrics.record_error() # type: ignore
+            self._send_json(415, {"error": "Couldn't decode the audio."})
+            return
+        except (KeyError, ValueError, TypeError) as e:
+            self.server.metrics.record_error() # type: ignore
+            self._send_json(400, {"error": "Bad request: {}".format(e)})
+            return
+        except Exception as e: # pylint: disable=broad-except
+            logger.exception("Transcription failed")
+            self.server.metrics.record_error() # type: ignore
+            self._send_json(500, {"error": str(e)})
+            return
+        latency = time.perf_counter() - start
+        self.server.metrics.record(len(transcripts), latency) # type: ignore
+        self._send_json(200, {"transcripts": transcripts, "latency": latency})
+
+class _TranscriptionServerMixin:
+    """ Shared behaviour of the TCP and Unix socket servers. """
+
+    daemon_threads = True
+
+    def init_transcription(self, transcriber) -> None:
+        self.transcriber = transcriber
+        self.metrics = ServerMetrics()
+
+    def transcribe_paths(self, paths: Sequence[str]) -> List[List[str]]:
+        if isinstance(paths, str):
+            raise RequestError(400, "\"paths\" must be a list of paths.")
+        missing = [path for path in paths if not os.path.isfile(path)]
+        if missing:
+            raise RequestError(404, "No such files: {}".format(", ".join(missing)))
+        return self.transcriber.transcribe([Path(path) for path in paths])
+
+    def transcribe_wav_bytes(self, wav_bytes: bytes) -> List[List[str]]:
+        try:
+            scipy.io.wavfile.read(io.BytesIO(wav_bytes), mmap=False)
+        except (ValueError, EOFError, OSError) as e:
+            raise RequestError(415, "The body isn't a readable WAV file: {}".format(e))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            wav_path = Path(tmp_dir) / "upload.wav"
+            wav_path.write_bytes(wav_bytes)
+            return self.transcriber.transcribe([wav_path])
+
+class TranscriptionServer(_TranscriptionServerMixin, socketserver.ThreadingMixIn,
+                          HTTPServer):
+    """ Serves transcription requests over TCP, one thread per request. """
+
+    def __init__(self, transcriber, host: str = "127.0.0.1", port: int = 0) -> None:
+        """
+        Args:
+            transcriber: An object with a thread-safe `transcribe()` method
+                taking a list of WAV paths, such as a `Transcriber`.
+            host: The address to listen on. Defaults to loopback only.
+            port: The port to listen on. If 0, a free port is chosen; see
+                `server_address`.
+        """
+        self.init_transcription(transcriber)
+        super().__init__((host, port), TranscriptionHandler)
+
+class UnixTranscriptionServer(_TranscriptionServerMixin, socketserver.ThreadingMixIn,
+                              socketserver.UnixStreamServer):
+    """ Serves transcription requests over a Unix domain socket. """
+
+    def __init__(self, transcriber, socket_path: str) -> None:
+        self.init_transcription(transcriber)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, TranscriptionHandler)
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects client_address to be a (host, port)
+        # pair, whereas Unix sockets give an empty string.
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Serve transcriptions from a trained Persephone model.")
+    parser.add_argument("--model", required=True,
+                        help="Path prefix of the checkpoint, eg."
+                             " exp/0/model/model_best.ckpt")
+    parser.add_argument("--corpus-dir",
+                        help="Directory of the pickled Corpus the model was"
+                             " trained on, used for its labels and feature type.")
+    parser.add_argument("--labels", nargs="+",
+                        help="The label set of the model, if --corpus-dir"
+                             " isn't given.")
+    parser.add_argument("--feat-type", default="fbank")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket",
+                        help="Listen on this Unix socket path instead of TCP.")
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait", type=float, default=0.01,
+                        help="Seconds to wait for requests to batch together.")
+    args = parser.parse_args(argv)
+
+    # Importing here keeps tensorflow out of the server's import path.
+    from .transcriber import Transcriber
+
+    if args.corpus_dir:
+        from .corpus import Corpus
+        corpus = Corpus.from_pickle(Path(args.corpus_dir))
+        label_set = corpus.labels
+        feat_type = corpus.feat_type
+        cmvn_stats = corpus.cmvn_stats
+    elif args.labels:
+        label_set = set(args.labels)
+        feat_type = args.feat_type
+        cmvn_stats = None
+    else:
+        parser.error("One of --corpus-dir or --labels is required.")
+
+    transcriber = Transcriber(args.model, label_set, feature_type=feat_type,
+                              max_batch_size=args.max_batch_size,
+                              max_wait=args.max_wait,
+                              cmvn_stats=cmvn_stats)
+    if args.unix_socket:
+        server = UnixTranscriptionServer(transcriber, args.unix_socket) # type: Any
+        print("Serving on unix socket {}".format(args.unix_socket), flush=True)
+    else:
+        server = TranscriptionServer(transcriber, args.host, args.port)
+        print("Serving on http://{}:{}".format(*server.server_address), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        transcriber.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+""" Configuration of the TensorFlow sessions that models are trained and
+decoded in.
+
+On CPU the main levers for throughput are the sizes of TensorFlow's thread
+pools: `intra_op_threads` parallelizes the work within an op (such as a large
+matmul), while `inter_op_threads` runs independent ops (such as the
+forward and backward LSTMs, or data parallel towers) concurrently. When
+several trainings share a host, capping both stops them contending for
+cores. A value of 0 lets TensorFlow choose, which typically means one thread
+per core for each pool.
+"""
+
+from typing import Optional, Union
+
+import tensorflow as tf
+
+from .exceptions import PersephoneException
+
+#: Graph optimization levels of `tf.OptimizerOptions`. "L1" performs common
+#: subexpression elimination and constant folding; "L0" performs neither.
+OPT_LEVELS = ("L0", "L1")
+
+class SessionConfig:
+    """ Options for creating `tf.Session`s, converted to a `tf.ConfigProto`
+    by `to_proto()`. The defaults give the configuration that was used for
+    all sessions previously. """
+
+    def __init__(self, *,
+                 intra_op_threads: int = 0,
+                 inter_op_threads: int = 0,
+                 allow_growth: bool = True,
+                 xla_jit: bool = False,
+                 opt_level: str = "L1",
+                 constant_folding: Optional[bool] = None,
+                 common_subexpression_elimination: Optional[bool] = None,
+                 log_device_placement: bool = False) -> None:
+        """
+        Args:
+            intra_op_threads: The number of threads used within an op. If
+                0, TensorFlow chooses.
+            inter_op_threads: The number of ops that may run concurrently. If
+                0, TensorFlow chooses.
+            allow_growth: If True, GPU memory is allocated as needed rather
+                than all at once.
+            xla_jit: If True, the graph is compiled with XLA where possible.
+            opt_level: One of `OPT_LEVELS`.
+            constant_folding: Overrides whether constant folding is done at
+                opt_level.
+            common_subexpression_elimination: Overrides whether common
+                subexpressions are eliminated at opt_level.
+            log_device_placement: If True, the device of each op is logged.
+        """
+
+        if intra_op_threads < 0 or inter_op_threads < 0:
+            raise PersephoneException("Thread counts can't be negative, got"
+                                      " intra_op_threads={}, inter_op_threads={}".format(
+                                          intra_op_threads, inter_op_threads))
+        if opt_level not in OPT_LEVELS:
+            raise PersephoneException("Unknown opt_level {!r}; expected one of"
+                                      " {}".format(opt_level, OPT_LEVELS))
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.allow_growth = allow_growth
+        self.xla_jit = xla_jit
+        self.opt_level = opt_level
+        self.constant_folding = constant_folding
+        self.common_subexpression_elimination = common_subexpression_elimination
+        self.log_device_placement = log_device_placement
+
+    def to_proto(self) -> tf.ConfigProto:
+        """ Returns the `tf.ConfigProto` with these options. """
+
+        config = tf.ConfigProto(
+            intra_op_parallelism_threads=self.intra_op_threads,
+            inter_op_parallelism_threads=self.inter_op_threads,
+            log_device_placement=self.log_device_placement)
+        config.gpu_options.allow_growth = self.allow_growth #pylint: disable=no-member
+        optimizer_options = config.graph_options.optimizer_options #pylint: disable=no-member
+        optimizer_options.opt_level = getattr(tf.OptimizerOptions, self.opt_level)
+        if self.constant_folding is not None:
+            optimizer_options.do_constant_folding = self.constant_folding
+        if self.common_subexpression_elimination is not None:
+            optimizer_options.do_common_subexpression_elimination = (
+                self.common_subexpression_elimination)
+        if self.xla_jit:
+            optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+        return config
+
+    def __repr__(self) -> str:
+        return ("{}(intra_op_threads={}, inter_op_threads={}, allow_growth={},"
+                " xla_jit={}, opt_level={!r}, constant_folding={},"
+                " common_subexpression_elimination={},"
+                " log_device_placement={})".format(
+                    self.__class__.__name__, self.intra_op_threads,
+                    self.inter_op_threads, self.allow_growth, self.xla_jit,
+                    self.opt_level, self.constant_folding,
+                    self.common_subexpression_elimination,
+                    self.log_device_placement))
+
+def config_proto(session_config: Union[None, SessionConfig, tf.ConfigProto]
+                 ) -> tf.ConfigProto:
+    """ Returns a `tf.ConfigProto` for a `SessionConfig`, passing through
+    a `tf.ConfigProto`. If session_config is `None`, the default
+    `SessionConfig` is used. """
+
+    if session_config is None:
+        return SessionConfig().to_proto()
+    if isinstance(session_config, SessionConfig):
+        return session_config.to_proto()
+    return session_config
@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+def _write_feats(feat_dir, feats):
+    for prefix, utter_feats in feats.items():
+        np.save(str(feat_dir / "{}.fbank.npy".format(prefix)), utter_feats)
+
+def test_compute_and_normalize(tmp_path):
+    """Test that statistics computed in one pass normalize batches to zero
+    mean and unit variance, globally and per speaker"""
+    from persephone import cmvn, utils
+    rng = np.random.RandomState(0)
+    feats = {"a": rng.normal(5, 2, (30, 4)),
+             "b": rng.normal(5, 2, (20, 4)),
+             "c": rng.normal(-3, 0.5, (25, 4))}
+    _write_feats(tmp_path, feats)
+    speakers = {"a": "spk1", "b": "spk1", "c": "spk2"}
+
+    stats = cmvn.compute(tmp_path, "fbank", ["a", "b", "c"], {"a", "b"},
+                         speakers=speakers)
+    train_frames = np.concatenate([feats["a"], feats["b"]])
+    np.testing.assert_allclose(stats.mean(), train_frames.mean(axis=0))
+    np.testing.assert_allclose(stats.var(), train_frames.var(axis=0))
+    np.testing.assert_allclose(stats.mean("spk2"), feats["c"].mean(axis=0))
+
+    paths = [tmp_path / "{}.fbank.npy".format(prefix) for prefix in ["a", "c"]]
+    batch, lens = utils.load_batch_x(paths, cmvn_stats=stats)
+    np.testing.assert_allclose(
+        batch[1, :25], (feats["c"] - stats.mean()) / np.sqrt(stats.var()), rtol=1e-5)
+    # Padding stays zero.
+    assert np.all(batch[1, 25:] == 0)
+
+    stats.per_speaker = True
+    batch, lens = utils.load_batch_x(paths, cmvn_stats=stats)
+    np.testing.assert_allclose(batch[1, :25].mean(axis=0), 0, atol=1e-5)
+    np.testing.assert_allclose(batch[1, :25].std(axis=0), 1, rtol=1e-4)
+    assert np.all(batch[1, 25:] == 0)
+
+def test_load_or_compute(tmp_path):
+    """Test that saved statistics are reused until the features or the
+    training split change"""
+    from persephone import cmvn
+    feats = {"a": np.arange(12.0).reshape(6, 2), "b": np.ones((3, 2))}
+    _write_feats(tmp_path, feats)
+    speakers = {"a": "spk1"}
+    stats = cmvn.load_or_compute(tmp_path, tmp_path, "fbank", ["a", "b"],
+                                 ["a", "b"], speakers=speakers,
+                                 per_speaker=True)
+    loaded = cmvn.load_or_compute(tmp_path, tmp_path, "fbank", ["b", "a"],
+                                  ["a", "b"], speakers=speakers,
+                                  per_speaker=True)
+    assert loaded.speakers == {"a": "spk1"}
+    assert loaded.per_speaker
+    for key in [None, "spk1"]:
+        np.testing.assert_array_equal(loaded.mean(key), stats.mean(key))
+        np.testing.assert_array_equal(loaded.var(key), stats.var(key))
+    assert loaded.train_prefixes == ["a", "b"]
+
+    # Re-splitting the same utterances changes the global statistics.
+    resplit = cmvn.load_or_compute(tmp_path, tmp_path, "fbank", ["a", "b"],
+                                   ["b"], speakers=speakers, per_speaker=True)
+    assert resplit.train_prefixes == ["b"]
+    np.testing.assert_array_equal(resplit.mean(), np.ones(2))
+    np.testing.assert_array_equal(resplit.mean("spk1"), stats.mean("spk1"))
+
+    with pytest.raises(ValueError):
+        cmvn.compute(tmp_path, "fbank", ["a", "b"], set())
+
+def test_corpus_cmvn(tmpdir, create_note_sequence, make_wav):
+    """Test that a corpus normalizes batches with per-speaker statistics"""
+    from pathlib import Path
+    from persephone import cmvn
+    from persephone.corpus import Corpus
+    from persephone.corpus_reader import CorpusReader
+    from persephone.exceptions import PersephoneException
+
+    wav_dir = tmpdir.mkdir("wav")
+    label_dir = tmpdir.mkdir("label")
+    for prefix, notes in [("train1", ["B", "C"]), ("train2", ["A", "B", "C"]),
+                          ("valid", ["C"]), ("test", ["A", "B"])]:
+        make_wav(create_note_sequence(notes=notes), str(wav_dir.join(prefix + ".wav")))
+        label_dir.join(prefix + ".phonemes").write(" ".join(notes))
+        tmpdir.join("{}_prefixes.txt".format(prefix.rstrip("12"))).write(
+            "train1\ntrain2" if prefix.startswith("train") else prefix)
+    tmpdir.join("speakers.txt").write("train1 mark\ntrain2 rose\ntest mark\n")
+
+    corpus = Corpus("fbank", "phonemes", Path(str(tmpdir)), cmvn_mode="speaker")
+    assert corpus.cmvn_stats.per_speaker
+    assert cmvn.stats_path(corpus.tgt_dir, "fbank").is_file()
+
+    reader = CorpusReader(corpus, batch_size=2)
+    batch_x, batch_x_lens, _ = reader.load_batch(
+        sorted(reader.train_fns, key=lambda fns: fns[0]))
+    train2_feats = np.load(str(corpus.feat_dir / "train2.fbank.npy"))
+    # rose has only the one utterance, so it is normalized exactly.
+    np.testing.assert_allclose(batch_x[1, :len(train2_feats)].mean(axis=0),
+                               0, atol=1e-4)
+
+    with pytest.raises(PersephoneException):
+        Corpus("fbank", "phonemes", Path(str(tmpdir)), cmvn_mode="bogus")
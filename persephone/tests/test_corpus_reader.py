@@ -11,4 +11,45 @@ def test_corpus_reader(create_test_corpus):
         num_train=2,
         batch_size=1
     )
-    assert corpus_r
\ No newline at end of file
+    assert corpus_r
+
+def test_corpus_reader_ragged_batches(create_test_corpus):
+    """Test that the number of training utterances needn't be divisible by
+    the batch size, and that frame-budgeted batches cover all utterances"""
+    from persephone.corpus_reader import CorpusReader
+    corpus = create_test_corpus()
+    corpus_r = CorpusReader(corpus, batch_size=3)
+    assert corpus_r.num_train == 2
+    assert len(list(corpus_r.train_batch_gen())) == 1
+
+    corpus_r = CorpusReader(corpus, max_batch_frames=1)
+    batches = list(corpus_r.train_batch_gen())
+    assert len(batches) == 2
+    assert sum(len(batch_x_lens) for _, batch_x_lens, _ in batches) == 2
+
+def test_corpus_reader_eval_batches(create_test_corpus):
+    """Test that the test set is evaluated in length-sorted sub-batches that
+    cover every utterance and match the single test batch"""
+    import numpy as np
+    from persephone.corpus_reader import CorpusReader
+    corpus = create_test_corpus()
+    test1_frames, test2_frames = [
+        num_frames for _, num_frames in corpus.manifest.prefix_lens(corpus.test_prefixes)]
+
+    corpus_r = CorpusReader(corpus, batch_size=1)
+    index_batches = corpus_r.eval_index_batches(corpus.test_prefixes)
+    assert sorted(i for batch in index_batches for i in batch) == [0, 1]
+    assert len(index_batches) == 2
+    # Shorter utterances come first.
+    first_len = [test1_frames, test2_frames][index_batches[0][0]]
+    assert first_len == min(test1_frames, test2_frames)
+
+    corpus_r = CorpusReader(corpus, eval_max_frames=10**6)
+    [(indices, (batch_x, batch_x_lens, _))] = list(corpus_r.test_batch_gen())
+    full_x, full_x_lens, _ = corpus_r.test_batch()
+    np.testing.assert_array_equal(batch_x, full_x[indices])
+    np.testing.assert_array_equal(batch_x_lens, np.asarray(full_x_lens)[indices])
+
+    corpus_r = CorpusReader(corpus, eval_max_frames=1)
+    assert len(list(corpus_r.test_batch_gen())) == 2
+    assert [indices for indices, _ in corpus_r.valid_batch_gen()] == [[0]]
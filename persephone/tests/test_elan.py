@@ -0,0 +1,72 @@
+"""Tests for parsing ELAN files in parallel and through the parse cache"""
+
+def _write_eaf(eaf_path, annotations):
+    """ Writes an ELAN file with an "xv@Mark" tier and a media file
+    alongside it. """
+    import pympi.Elan
+    eaf_path.parent.mkdir(parents=True, exist_ok=True)
+    media_path = eaf_path.with_suffix(".wav")
+    media_path.write_bytes(b"")
+    eaf = pympi.Elan.Eaf()
+    eaf.add_linked_file(str(media_path), relpath=media_path.name,
+                        mimetype="audio/x-wav")
+    eaf.add_tier("xv@Mark", part="Mark")
+    eaf.add_tier("rf@Mark", part="Mark")
+    for start, end, text in annotations:
+        eaf.add_annotation("xv@Mark", start, end, text)
+        eaf.add_annotation("rf@Mark", start, end, "ref " + text)
+    pympi.Elan.to_eaf(str(eaf_path), eaf)
+
+def test_utterances_from_dir_parallel(tmp_path):
+    """Test that parsing across worker processes gives the same utterances
+    as parsing serially"""
+    from persephone.preprocess import elan
+    for i in range(5):
+        _write_eaf(tmp_path / "org" / "sub{}".format(i % 2) / "f{}.eaf".format(i),
+                   [(100 * j, 100 * j + 50, "a b {}".format(j)) for j in range(i + 1)])
+
+    serial = elan.utterances_from_dir(tmp_path / "org", ("xv",), num_workers=1)
+    parallel = elan.utterances_from_dir(tmp_path / "org", ("xv",),
+                                        num_workers=2, chunksize=1)
+    assert len(serial) == 15
+    assert parallel == serial
+    assert all(utter.speaker == "Mark" for utter in serial)
+    assert {utter.text for utter in serial if utter.prefix == "f1.xv@Mark.1"} == {"a b 1"}
+
+def test_utterances_from_dir_cache(tmp_path, monkeypatch):
+    """Test that unchanged files are read from the parse cache and changed
+    files are parsed again"""
+    import os
+    from persephone.preprocess import elan
+    org_dir = tmp_path / "org"
+    cache_path = tmp_path / "tgt" / "elan_cache.json"
+    _write_eaf(org_dir / "a.eaf", [(0, 50, "a")])
+    _write_eaf(org_dir / "b.eaf", [(0, 50, "b"), (60, 90, "c")])
+
+    first = elan.utterances_from_dir(org_dir, ("xv",), cache_path=cache_path,
+                                     num_workers=1)
+    assert cache_path.is_file()
+
+    parsed = []
+    utterances_from_eaf = elan.utterances_from_eaf
+    def counting_utterances_from_eaf(eaf_path, tier_prefixes):
+        parsed.append(eaf_path.name)
+        return utterances_from_eaf(eaf_path, tier_prefixes)
+    monkeypatch.setattr(elan, "utterances_from_eaf", counting_utterances_from_eaf)
+    assert elan.utterances_from_dir(org_dir, ("xv",), cache_path=cache_path,
+                                    num_workers=1) == first
+    assert parsed == []
+
+    # Different tier prefixes aren't served from the cache.
+    both = elan.utterances_from_dir(org_dir, ("xv", "rf"),
+                                    cache_path=cache_path, num_workers=1)
+    assert len(both) == 6
+    assert sorted(parsed) == ["a.eaf", "b.eaf"]
+
+    _write_eaf(org_dir / "a.eaf", [(0, 50, "z"), (60, 90, "y")])
+    os.utime(str(org_dir / "a.eaf"), (1, 1))
+    del parsed[:]
+    utterances = elan.utterances_from_dir(org_dir, ("xv",),
+                                          cache_path=cache_path, num_workers=1)
+    assert parsed == ["a.eaf"]
+    assert sorted(utter.text for utter in utterances) == ["b", "c", "y", "z"]
@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+
+def test_put_fetch_and_evict(tmp_path):
+    """Test that entries are keyed on content and evicted least recently used
+    first"""
+    from persephone.feat_cache import FeatCache
+    cache = FeatCache(tmp_path / "cache", max_bytes=10**9)
+    audio_a = tmp_path / "a.wav"
+    audio_a.write_bytes(b"a" * 100)
+    copy_of_a = tmp_path / "copy_of_a.wav"
+    copy_of_a.write_bytes(b"a" * 100)
+    audio_b = tmp_path / "b.wav"
+    audio_b.write_bytes(b"b" * 100)
+
+    assert cache.key(audio_a, "fbank") == cache.key(copy_of_a, "fbank")
+    assert cache.key(audio_a, "fbank") != cache.key(audio_b, "fbank")
+    assert cache.key(audio_a, "fbank") != cache.key(audio_a, "mfcc13_d")
+    assert cache.key(audio_a, "fbank", "nfilt=40") != cache.key(audio_a, "fbank", "nfilt=26")
+
+    feat_path = tmp_path / "feats.npy"
+    keys = []
+    for i, audio_path in enumerate([audio_a, audio_b]):
+        np.save(str(feat_path), np.full((1000, 3), i, dtype=np.float64))
+        key = cache.key(audio_path, "fbank")
+        assert not cache.fetch(key, tmp_path / "missing.npy")
+        cache.put(key, feat_path)
+        keys.append(key)
+        # Make the entries' last use distinguishable.
+        os.utime(str(cache.entry_path(key)), (i, i))
+
+    out_path = tmp_path / "out.npy"
+    assert cache.fetch(keys[0], out_path)
+    assert np.all(np.load(str(out_path)) == 0)
+
+    # a was used more recently than b, so b is evicted first.
+    cache.max_bytes = cache.size() - 1
+    assert cache.evict() == 1
+    assert keys[0] in cache
+    assert keys[1] not in cache
+
+def test_extract_from_wavs_uses_cache(tmp_path, create_sine, make_wav):
+    """Test that features of the same audio in another directory come from
+    the cache"""
+    from persephone.feat_cache import FeatCache
+    from persephone.preprocess import feat_extract
+    cache = FeatCache(tmp_path / "cache")
+    wav_paths = []
+    for corpus in ["first", "second"]:
+        org_dir = tmp_path / corpus / "wav"
+        org_dir.mkdir(parents=True)
+        for note in ["A", "B"]:
+            make_wav(create_sine(note=note), str(org_dir / "{}.wav".format(note)))
+        wav_paths.append(sorted(org_dir.glob("*.wav")))
+
+    first_feat_dir = tmp_path / "first" / "feat"
+    results = feat_extract.extract_from_wavs(wav_paths[0], first_feat_dir,
+                                             "fbank", num_workers=1,
+                                             feat_cache=cache)
+    assert len(results) == 2
+    assert len(cache.entries()) == 2
+
+    second_feat_dir = tmp_path / "second" / "feat"
+    results = feat_extract.extract_from_wavs(wav_paths[1], second_feat_dir,
+                                             "fbank", num_workers=1,
+                                             feat_cache=cache)
+    assert results == []
+    for note in ["A", "B"]:
+        np.testing.assert_array_equal(
+            np.load(str(first_feat_dir / "{}.fbank.npy".format(note))),
+            np.load(str(second_feat_dir / "{}.fbank.npy".format(note))))
+
+    # Other feature types are extracted separately.
+    results = feat_extract.extract_from_wavs(wav_paths[1], second_feat_dir,
+                                             "mfcc13_d", num_workers=1,
+                                             feat_cache=cache)
+    assert len(results) == 2
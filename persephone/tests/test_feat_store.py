@@ -0,0 +1,48 @@
+"""Tests for the packed feature store"""
+
+def test_packed_feat_store(tmp_path):
+    """Test that packed features match the per-utterance files and are used
+    by load_batch_x"""
+    import numpy as np
+    from persephone import feat_store
+    from persephone.utils import load_batch_x
+
+    feat_dir = tmp_path / "feat"
+    (feat_dir / "story").mkdir(parents=True)
+    feats = {"a": np.random.rand(5, 41, 3),
+             "story/b": np.random.rand(8, 41, 3)}
+    for prefix, feat in feats.items():
+        np.save(str(feat_dir / "{}.fbank.npy".format(prefix)), feat)
+
+    prefixes = feat_store.feat_prefixes(feat_dir, "fbank")
+    assert prefixes == ["a", "story/b"]
+    assert not feat_store.is_up_to_date(feat_dir, "fbank", prefixes)
+    store = feat_store.build(feat_dir, "fbank")
+    assert feat_store.is_up_to_date(feat_dir, "fbank", prefixes)
+    assert len(store) == 2
+    assert store.get("story/b").dtype == np.float32
+    np.testing.assert_allclose(store.get("story/b"), feats["story/b"], rtol=1e-6)
+
+    paths = [str(feat_dir / "a.fbank.npy"), str(feat_dir / "story" / "b.fbank.npy")]
+    # Remove the per-utterance file so that only the store can supply it.
+    (feat_dir / "a.fbank.npy").unlink()
+    batch, lens = load_batch_x(paths, feat_store=store)
+    assert batch.shape == (2, 8, 41, 3)
+    assert list(lens) == [5, 8]
+    np.testing.assert_allclose(batch[0, :5], feats["a"], rtol=1e-6)
+    assert not batch[0, 5:].any()
+
+def test_packed_feat_store_pickle(tmp_path):
+    """Test that pickling a store doesn't copy the mapped data"""
+    import pickle
+    import numpy as np
+    from persephone import feat_store
+
+    feat_dir = tmp_path / "feat"
+    feat_dir.mkdir()
+    np.save(str(feat_dir / "a.fbank.npy"), np.ones((1000, 123)))
+    store = feat_store.build(feat_dir, "fbank")
+    assert store.get("a").sum() == 123000
+    pickled = pickle.dumps(store)
+    assert len(pickled) < 10000
+    assert pickle.loads(pickled).get("a").shape == (1000, 123)
@@ -24,4 +24,128 @@ def test_empty_wave_skipped(tmp_path, make_wav):
     empty_wav_path = wavs_dir / "empty.wav"
     make_wav(no_data, str(empty_wav_path))
     with pytest.raises(PersephoneException):
-        feat_extract.from_dir(wavs_dir, "fbank")
\ No newline at end of file
+        feat_extract.from_dir(wavs_dir, "fbank")
+
+
+def test_from_dir_only_missing(tmp_path, create_sine, make_wav):
+    """Test that only WAVs without feature files are processed and that a
+    failure on one file doesn't stop extraction for the others."""
+    from persephone.preprocess import feat_extract
+    from persephone.exceptions import PersephoneException
+    wavs_dir = tmp_path / "feat"
+    wavs_dir.mkdir()
+    for note in ["A", "B", "C"]:
+        make_wav(create_sine(note=note), str(wavs_dir / "{}.wav".format(note)), framerate=16000)
+
+    results = feat_extract.from_dir(wavs_dir, "fbank", num_workers=2, chunksize=1)
+    assert sorted(r.wav_path for r in results) == sorted(
+        str(wavs_dir / "{}.wav".format(note)) for note in ["A", "B", "C"])
+    assert all(r.error is None for r in results)
+    assert (wavs_dir / "A.fbank.npy").is_file()
+
+    (wavs_dir / "B.fbank.npy").unlink()
+    make_wav([], str(wavs_dir / "empty.wav"))
+    with pytest.raises(PersephoneException):
+        feat_extract.from_dir(wavs_dir, "fbank", num_workers=1)
+    # The good file was still processed despite the empty one failing.
+    assert (wavs_dir / "B.fbank.npy").is_file()
+    assert feat_extract.unprocessed_wavs(wavs_dir, "fbank") == [str(wavs_dir / "empty.wav")]
+
+
+def test_convert_dir(tmp_path, create_sine, make_wav):
+    """Test that WAVs are converted to 16kHz mono in-process"""
+    import scipy.io.wavfile
+    from persephone.preprocess import feat_extract
+    org_dir = tmp_path / "wav"
+    org_dir.mkdir()
+    for note in ["A", "B", "C"]:
+        make_wav(create_sine(note=note), str(org_dir / "{}.wav".format(note)))
+    tgt_dir = tmp_path / "feat"
+    feat_extract.convert_dir(org_dir, tgt_dir, num_workers=2)
+    for note in ["A", "B", "C"]:
+        rate, samples = scipy.io.wavfile.read(str(tgt_dir / "{}.wav".format(note)))
+        assert rate == 16000
+        assert samples.shape == (16000,)
+
+
+def test_extract_from_wavs(tmp_path, create_sine, make_wav):
+    """Test that single-pass extraction matches converting then extracting,
+    and only writes normalized WAVs when asked to"""
+    import numpy as np
+    from persephone.preprocess import feat_extract
+    org_dir = tmp_path / "wav"
+    org_dir.mkdir()
+    for note in ["A", "B"]:
+        make_wav(create_sine(note=note), str(org_dir / "{}.wav".format(note)))
+    wav_paths = sorted(org_dir.glob("*.wav"))
+
+    two_stage_dir = tmp_path / "two_stage"
+    feat_extract.convert_dir(org_dir, two_stage_dir, num_workers=1)
+    feat_extract.from_dir(two_stage_dir, "fbank", num_workers=1)
+
+    feat_dir = tmp_path / "feat"
+    results = feat_extract.extract_from_wavs(wav_paths, feat_dir, "fbank",
+                                             num_workers=2)
+    assert len(results) == 2
+    assert not list(feat_dir.glob("*.wav"))
+    for note in ["A", "B"]:
+        np.testing.assert_array_equal(
+            np.load(str(feat_dir / "{}.fbank.npy".format(note))),
+            np.load(str(two_stage_dir / "{}.fbank.npy".format(note))))
+
+    # Existing features are skipped.
+    assert feat_extract.extract_from_wavs(wav_paths, feat_dir, "fbank") == []
+
+    kept_dir = tmp_path / "kept"
+    feat_extract.extract_from_wavs(wav_paths, kept_dir, "mfcc13_d",
+                                   keep_wavs=True, num_workers=1)
+    assert sorted(path.name for path in kept_dir.glob("*.wav")) == ["A.wav", "B.wav"]
+    assert (kept_dir / "A.mfcc13_d.npy").is_file()
+
+
+def test_fbank_engine_matches_python_speech_features():
+    """Test that batched fbanks match the per-utterance python_speech_features
+    computation they replace"""
+    import numpy as np
+    import python_speech_features
+    from persephone.preprocess import feat_extract
+    from persephone.preprocess.fbank_engine import FbankEngine
+
+    def reference_fbank(rate, sig):
+        fbank_feat = python_speech_features.logfbank(sig, rate, nfilt=40)
+        energy = feat_extract.extract_energy(rate, sig)
+        feat = np.hstack([energy, fbank_feat])
+        delta_feat = python_speech_features.delta(feat, 2)
+        delta_delta_feat = python_speech_features.delta(delta_feat, 2)
+        return [feat, delta_feat, delta_delta_feat]
+
+    rng = np.random.RandomState(0)
+    signals = [(rng.randn(length) * 3000).astype(np.int16)
+               for length in [100, 400, 401, 16000, 23456]]
+    # A small max_frames makes the spectra be computed in several blocks.
+    engine = FbankEngine(16000, max_frames=50)
+    for sig, feats in zip(signals, engine(signals)):
+        reference = reference_fbank(16000, sig)
+        np.testing.assert_allclose(feats, np.concatenate(reference, axis=1),
+                                   rtol=1e-10, atol=1e-10)
+        unflat = feat_extract.fbank_from_signal(16000, sig, flat=False)
+        expected = np.swapaxes(np.swapaxes(np.array(reference), 0, 1), 1, 2)
+        np.testing.assert_allclose(unflat, expected, rtol=1e-10, atol=1e-10)
+
+
+def test_extract_from_wavs_batch_failure(tmp_path, create_sine, make_wav):
+    """Test that an empty WAV in a batch doesn't stop the rest of the batch"""
+    from persephone.exceptions import PersephoneException
+    from persephone.preprocess import feat_extract
+    org_dir = tmp_path / "wav"
+    org_dir.mkdir()
+    make_wav(create_sine(note="A"), str(org_dir / "A.wav"))
+    make_wav([], str(org_dir / "empty.wav"))
+    make_wav(create_sine(note="B"), str(org_dir / "B.wav"))
+    feat_dir = tmp_path / "feat"
+    with pytest.raises(PersephoneException) as excinfo:
+        feat_extract.extract_from_wavs(sorted(org_dir.glob("*.wav")), feat_dir,
+                                       "fbank", num_workers=1)
+    assert "empty.wav" in str(excinfo.value)
+    assert (feat_dir / "A.fbank.npy").is_file()
+    assert (feat_dir / "B.fbank.npy").is_file()
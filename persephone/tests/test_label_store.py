@@ -0,0 +1,32 @@
+"""Tests for the store of pre-encoded transcriptions"""
+
+def test_label_store(tmp_path):
+    """Test that labels are encoded once, reloaded, and rebuilt on change"""
+    import os
+    from persephone import label_store
+    label_dir = tmp_path / "label"
+    label_dir.mkdir()
+    (label_dir / "a.phonemes").write_text("A B\n")
+    (label_dir / "b.phonemes").write_text("C\n")
+    label_to_index = {"pad": 0, "A": 1, "B": 2, "C": 3}
+
+    store = label_store.load_or_build(tmp_path, "phonemes", label_to_index, ["a", "b"])
+    assert store.get("a").tolist() == [1, 2]
+    assert store.load(str(label_dir / "b.phonemes")).tolist() == [3]
+    assert label_store.store_path(tmp_path, "phonemes").is_file()
+
+    reloaded = label_store.LabelStore.from_file(
+        label_store.store_path(tmp_path, "phonemes"), label_dir, "phonemes")
+    assert reloaded.prefixes == ["a", "b"]
+    assert reloaded.get("b").tolist() == [3]
+
+    # A label file that is newer than the store causes a rebuild.
+    (label_dir / "b.phonemes").write_text("C A\n")
+    store_mtime = label_store.store_path(tmp_path, "phonemes").stat().st_mtime
+    os.utime(str(label_dir / "b.phonemes"), (store_mtime + 10, store_mtime + 10))
+    store = label_store.load_or_build(tmp_path, "phonemes", label_to_index, ["a", "b"])
+    assert store.get("b").tolist() == [3, 1]
+
+    # Files not in the store are read directly.
+    (label_dir / "c.phonemes").write_text("B\n")
+    assert store.load(label_dir / "c.phonemes").tolist() == [2]
@@ -0,0 +1,45 @@
+"""Tests for the utterance size manifest"""
+
+def _write_utterance(tgt_dir, prefix, num_frames, labels):
+    import numpy as np
+    np.save(str(tgt_dir / "feat" / "{}.fbank.npy".format(prefix)),
+            np.ones((num_frames, 41, 3)))
+    (tgt_dir / "label" / "{}.phonemes".format(prefix)).write_text(labels)
+
+def test_manifest_sizes(tmp_path):
+    """Test that the manifest reports sizes and sorts/filters by them"""
+    from persephone.manifest import FeatManifest
+    (tmp_path / "feat").mkdir()
+    (tmp_path / "label").mkdir()
+    _write_utterance(tmp_path, "a", 30, "A B")
+    _write_utterance(tmp_path, "b", 10, "B")
+    _write_utterance(tmp_path, "c", 20, "A B C")
+
+    manifest = FeatManifest(tmp_path, "fbank", "phonemes")
+    entries = manifest.get(["a", "b", "c"])
+    assert [e.num_frames for e in entries] == [30, 10, 20]
+    assert [e.label_len for e in entries] == [2, 1, 3]
+    assert entries[0].feat_shape == (41, 3)
+    assert manifest.sort_by_size(["a", "b", "c"]) == ["b", "c", "a"]
+    assert manifest.filter_by_size(["a", "b", "c"], 20) == ["b", "c"]
+    assert manifest.total_frames(["a", "b"]) == 40
+    assert manifest.path.is_file()
+
+def test_manifest_persisted_and_updated(tmp_path):
+    """Test that the manifest is reloaded from disk and refreshed when a
+    feature file changes"""
+    import os
+    from persephone.manifest import FeatManifest
+    (tmp_path / "feat").mkdir()
+    (tmp_path / "label").mkdir()
+    _write_utterance(tmp_path, "a", 30, "A B")
+
+    FeatManifest(tmp_path, "fbank", "phonemes").get(["a"])
+    reloaded = FeatManifest(tmp_path, "fbank", "phonemes")
+    assert reloaded.entries["a"].num_frames == 30
+
+    _write_utterance(tmp_path, "a", 50, "A B")
+    feat_path = reloaded.feat_path("a")
+    os.utime(str(feat_path), (1, 1))
+    assert reloaded.get(["a"])[0].num_frames == 50
+    assert FeatManifest(tmp_path, "fbank", "phonemes").entries["a"].num_frames == 50
@@ -0,0 +1,99 @@
+"""Tests for the streaming Pangloss XML reader"""
+
+import pytest
+
+TEXT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<TEXT id="crdo-NRU_F4_STORY">
+  <HEADER><TITLE>A story</TITLE></HEADER>
+  <S id="S1">
+    <AUDIO start="0.5" end="2.25"/>
+    <FORM kindOf="ortho">ortho one</FORM>
+    <FORM kindOf="phono">phono one</FORM>
+    <TRANSL xml:lang="fr">un</TRANSL>
+    <TRANSL xml:lang="en">one</TRANSL>
+    <W><FORM>word</FORM></W>
+  </S>
+  <S id="S2">
+    <FORM>not aligned</FORM>
+  </S>
+  <S id="S3">
+    <AUDIO start="2.5" end="3.0"/>
+    <FORM>two</FORM>
+  </S>
+</TEXT>
+"""
+
+def test_iter_sents(tmp_path):
+    """Test that only aligned sentences are read, preferring phonological
+    forms, and that words within sentences aren't read as sentences"""
+    from persephone.preprocess import pangloss
+    xml_path = tmp_path / "story.xml"
+    xml_path.write_text(TEXT_XML, encoding="utf8")
+
+    assert pangloss.get_root_tag(xml_path) == "TEXT"
+    sents = list(pangloss.iter_sents(xml_path))
+    assert sents == [
+        pangloss.PanglossSent("phono one", 0.5, 2.25, ["un", "one"]),
+        pangloss.PanglossSent("two", 2.5, 3.0, [])]
+    rec_type, transcriptions, times, translations = (
+        pangloss.get_sents_times_and_translations(str(xml_path)))
+    assert rec_type == "TEXT"
+    assert transcriptions == ["phono one", "two"]
+    assert times == [(0.5, 2.25), (2.5, 3.0)]
+    assert translations == [["un", "one"], []]
+
+def test_load_sents_cache(tmp_path, monkeypatch):
+    """Test that a cached file is only read again once it changes, and that
+    the cache is bounded"""
+    import os
+    from persephone.preprocess import pangloss
+    xml_path = tmp_path / "story.xml"
+    xml_path.write_text(TEXT_XML, encoding="utf8")
+    cache = pangloss.SentsCache(max_files=2)
+
+    reads = []
+    iter_sents = pangloss.iter_sents
+    def counting_iter_sents(xml_fn):
+        reads.append(xml_fn)
+        return iter_sents(xml_fn)
+    monkeypatch.setattr(pangloss, "iter_sents", counting_iter_sents)
+
+    assert len(pangloss.load_sents(xml_path, cache)[1]) == 2
+    assert len(pangloss.load_sents(str(xml_path), cache)[1]) == 2
+    assert len(reads) == 1
+    # Without a cache, the file is always read.
+    pangloss.load_sents(xml_path)
+    assert len(reads) == 2
+
+    xml_path.write_text(TEXT_XML.replace('<S id="S3">', '<S id="S3" a="b">'),
+                        encoding="utf8")
+    os.utime(str(xml_path), (1, 1))
+    pangloss.load_sents(xml_path, cache)
+    assert len(reads) == 3
+
+    for i in range(3):
+        other_path = tmp_path / "other{}.xml".format(i)
+        other_path.write_text(TEXT_XML, encoding="utf8")
+        pangloss.load_sents(other_path, cache)
+    assert len(cache) == 2
+    pangloss.load_sents(xml_path, cache)
+    assert len(reads) == 7
+
+def test_wordlist_and_bad_root(tmp_path):
+    """Test reading a wordlist, and that other documents are rejected"""
+    from persephone.exceptions import PersephoneException
+    from persephone.preprocess import pangloss
+    entries = "".join(
+        '<W><AUDIO start="{0}" end="{1}"/><FORM>w{0}</FORM></W>'.format(i, i + 1)
+        for i in range(1000))
+    xml_path = tmp_path / "wordlist.xml"
+    xml_path.write_text("<WORDLIST>{}</WORDLIST>".format(entries), encoding="utf8")
+    rec_type, sents = pangloss.load_sents(xml_path)
+    assert rec_type == "WORDLIST"
+    assert len(sents) == 1000
+    assert sents[-1] == pangloss.PanglossSent("w999", 999.0, 1000.0, [])
+
+    bad_path = tmp_path / "bad.xml"
+    bad_path.write_text("<DOC><S/></DOC>", encoding="utf8")
+    with pytest.raises(PersephoneException):
+        list(pangloss.iter_sents(bad_path))
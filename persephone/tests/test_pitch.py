@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+def test_pitch_from_signal():
+    """Test that the pitch of a tone is tracked and framed like fbanks"""
+    from persephone.preprocess import feat_extract, pitch
+    rate = 16000
+    t = np.arange(rate) / rate
+    sig = (8000 * np.sin(2 * np.pi * 200 * t)).astype(np.int16)
+    feats = pitch.pitch_from_signal(rate, sig)
+    fbanks = feat_extract.fbank_from_signal(rate, sig)
+    assert feats.shape == (len(fbanks), 2)
+    # Ignore the frames running off the end of the signal.
+    voicing, f0 = feats[:-5, 0], feats[:-5, 1]
+    assert np.all(voicing > 0.9)
+    assert np.allclose(f0, 200, rtol=0.02)
+
+def test_pitch_silence():
+    """Test that silence isn't considered voiced"""
+    from persephone.preprocess import pitch
+    rate = 16000
+    rng = np.random.RandomState(0)
+    sig = np.zeros(rate)
+    sig[8000:] = 8000 * np.sin(2 * np.pi * 150 * np.arange(8000) / rate)
+    sig += rng.normal(scale=1, size=rate)
+    feats = pitch.pitch_from_signal(rate, sig)
+    assert np.all(feats[:40, 0] < 0.3)
+    assert np.allclose(feats[55:-5, 1], 150, rtol=0.02)
+    # Pitch is carried over unvoiced frames.
+    assert np.allclose(feats[:40, 1], 150, rtol=0.05)
+
+@pytest.mark.parametrize("feat_type,num_feats", [("pitch", 2),
+                                                 ("fbank_and_pitch", 125)])
+def test_extract_pitch_types(tmp_path, create_sine, make_wav, feat_type, num_feats):
+    """Test that pitch feature types are extracted without Kaldi"""
+    from persephone.preprocess import feat_extract
+    org_dir = tmp_path / "wav"
+    org_dir.mkdir()
+    make_wav(create_sine(note="C"), str(org_dir / "C.wav"))
+    feat_dir = tmp_path / "feat"
+    feat_extract.extract_from_wavs([org_dir / "C.wav"], feat_dir, feat_type,
+                                   num_workers=1)
+    feats = np.load(str(feat_dir / "C.{}.npy".format(feat_type)))
+    assert feats.shape[1] == num_feats
+    assert np.allclose(feats[:-5, -1], 261.63, rtol=0.02)
@@ -109,3 +109,125 @@ def test_model_train_callback(tmpdir, create_sine, make_wav, create_test_corpus)
     )
 
     assert mock_callback.call_count == 10
+
+def test_transcriber(tmpdir, create_sine, make_wav, create_test_corpus):
+    """Test that a Transcriber serves concurrent requests from one restored model"""
+    from concurrent.futures import ThreadPoolExecutor
+    from persephone.corpus_reader import CorpusReader
+    from persephone.rnn_ctc import Model
+    from persephone.transcriber import Transcriber
+    corpus = create_test_corpus()
+    corpus_r = CorpusReader(corpus, batch_size=1)
+    test_model = Model(corpus.tgt_dir, corpus_r, num_layers=1, hidden_size=10)
+    test_model.train(early_stopping_steps=1, min_epochs=1, max_epochs=2)
+
+    wav_path = str(tmpdir.join("to_decode.wav"))
+    make_wav(create_sine(note="C"), wav_path)
+    model_checkpoint_path = corpus.tgt_dir / "model" / "model_best.ckpt"
+    with Transcriber(model_checkpoint_path, corpus.labels, max_wait=0.05) as transcriber:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(transcriber.transcribe, [[wav_path]] * 8))
+        assert len(results) == 8
+        assert all(len(result) == 1 for result in results)
+        assert all(set(result[0]) <= {"A", "B", "C"} for result in results)
+
+    # Requests made after closing fail rather than wait forever.
+    import pytest
+    from persephone.exceptions import PersephoneException
+    with pytest.raises(PersephoneException):
+        transcriber.submit([wav_path])
+
+def test_model_valid_decoder(create_test_corpus):
+    """Test that the validation decoder can be chosen, and that the full
+    decoder is still used for evaluation"""
+    import pytest
+    from persephone.corpus_reader import CorpusReader
+    from persephone.exceptions import PersephoneException
+    from persephone.rnn_ctc import Model
+    corpus = create_test_corpus()
+    corpus_r = CorpusReader(corpus, num_train=1, batch_size=1)
+
+    full_model = Model(corpus.tgt_dir, corpus_r)
+    assert full_model.valid_decoder == "full"
+    assert full_model.valid_ler is None
+
+    greedy_model = Model(corpus.tgt_dir, corpus_r, valid_decoder="greedy")
+    assert greedy_model.valid_ler is not None
+    assert greedy_model.dense_decoded.name == "hyp_dense_decoded:0"
+
+    beam_model = Model(corpus.tgt_dir, corpus_r, valid_decoder="beam",
+                       valid_beam_width=4)
+    assert beam_model.valid_dense_decoded is not None
+
+    with pytest.raises(PersephoneException):
+        Model(corpus.tgt_dir, corpus_r, valid_decoder="viterbi")
+
+def test_model_towers(create_test_corpus):
+    """Test that a model can be trained with its batches split between
+    data parallel towers"""
+    from persephone.corpus_reader import CorpusReader
+    from persephone.rnn_ctc import Model
+    corpus = create_test_corpus()
+    corpus_r = CorpusReader(corpus, batch_size=2)
+
+    model = Model(corpus.tgt_dir, corpus_r, num_layers=1, hidden_size=10,
+                  num_towers=2)
+    assert model.train_ler is not None
+    model.train(early_stopping_steps=1, min_epochs=1, max_epochs=2)
+    assert model.saved_model_path
+
+def test_model_towers_small_batch(create_test_corpus):
+    """Test that a batch with fewer utterances than towers, leaving some
+    towers empty, can still be trained on"""
+    import math
+    import tensorflow as tf
+    from persephone.corpus_reader import CorpusReader
+    from persephone.rnn_ctc import Model
+    corpus = create_test_corpus()
+    corpus_r = CorpusReader(corpus, batch_size=2)
+
+    model = Model(corpus.tgt_dir, corpus_r, num_layers=1, hidden_size=10,
+                  num_towers=4)
+    batch_x, batch_x_lens, batch_y = next(corpus_r.train_batch_gen())
+    assert len(batch_x) < model.num_towers
+    with tf.Session() as sess:
+        sess.run(tf.global_variables_initializer())
+        _, cost, train_ler = sess.run(
+            [model.optimizer, model.cost, model.train_ler],
+            feed_dict={model.batch_x: batch_x,
+                       model.batch_x_lens: batch_x_lens,
+                       model.batch_y: batch_y})
+    assert math.isfinite(cost)
+    assert math.isfinite(train_ler)
+
+def test_model_cell_types(tmpdir, create_test_corpus):
+    """Test that models with block and fused LSTM cells train, and that
+    their checkpoints restore into models with the other cell types"""
+    import pytest
+    from persephone.corpus_reader import CorpusReader
+    from persephone.exceptions import PersephoneException
+    from persephone.rnn_ctc import Model, canonical_variable_name, convert_checkpoint
+    corpus = create_test_corpus()
+    corpus_r = CorpusReader(corpus, batch_size=2)
+
+    model = Model(corpus.tgt_dir, corpus_r, num_layers=2, hidden_size=10,
+                  cell_type="fused")
+    model.train(early_stopping_steps=1, min_epochs=1, max_epochs=2)
+    fused_path = model.saved_model_path
+
+    for cell_type in ["block", "standard"]:
+        other_model = Model(corpus.tgt_dir, corpus_r, num_layers=2,
+                            hidden_size=10, cell_type=cell_type)
+        other_model.eval(restore_model_path=fused_path)
+
+    assert (canonical_variable_name("layer_0/bidirectional_rnn/fw/lstm_fused_cell/kernel/Adam")
+            == "layer_0/bidirectional_rnn/fw/lstm_cell/kernel/Adam")
+    assert (canonical_variable_name("layer_1/bidirectional_rnn/bw/lstm_cell/biases")
+            == "layer_1/bidirectional_rnn/bw/lstm_cell/bias")
+    converted_path = str(tmpdir.join("converted.ckpt"))
+    assert convert_checkpoint(fused_path, converted_path) == {}
+    model = Model(corpus.tgt_dir, corpus_r, num_layers=2, hidden_size=10)
+    model.eval(restore_model_path=converted_path)
+
+    with pytest.raises(PersephoneException):
+        Model(corpus.tgt_dir, corpus_r, cell_type="gru")
@@ -0,0 +1,105 @@
+"""Tests for the transcription server, using a loopback client."""
+import json
+import threading
+import urllib.request
+
+import pytest
+
+class FakeTranscriber:
+    """Stands in for a Transcriber, returning the WAV file names."""
+    def __init__(self):
+        self.calls = []
+
+    def transcribe(self, paths):
+        self.calls.append(paths)
+        return [[path.name] for path in paths]
+
+@pytest.fixture
+def quiet_server_log():
+    """Keeps the server's request logs out of the handlers configured by
+    logging.ini, which append to log.txt in the working directory."""
+    import logging
+    logger = logging.getLogger("persephone.server")
+    handler = logging.NullHandler()
+    logger.addHandler(handler)
+    propagate, logger.propagate = logger.propagate, False
+    yield
+    logger.propagate = propagate
+    logger.removeHandler(handler)
+
+@pytest.fixture
+def running_server(quiet_server_log):
+    from persephone.server import TranscriptionServer
+    transcriber = FakeTranscriber()
+    server = TranscriptionServer(transcriber, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, transcriber
+    server.shutdown()
+    server.server_close()
+
+def _post(server, body, content_type):
+    url = "http://{}:{}/transcribe".format(*server.server_address)
+    request = urllib.request.Request(url, data=body,
+                                     headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode("utf8"))
+
+def _write_wav(path):
+    import numpy as np
+    import scipy.io.wavfile
+    scipy.io.wavfile.write(str(path), 16000, np.zeros(1600, dtype=np.int16))
+    return path
+
+def test_server_transcribes_paths_and_uploads(running_server, tmp_path):
+    server, transcriber = running_server
+    paths = [str(_write_wav(tmp_path / "x.wav")), str(_write_wav(tmp_path / "y.wav"))]
+    result = _post(server, json.dumps({"paths": paths}).encode(),
+                   "application/json")
+    assert result["transcripts"] == [["x.wav"], ["y.wav"]]
+    assert result["latency"] >= 0
+
+    wav_bytes = _write_wav(tmp_path / "upload_src.wav").read_bytes()
+    result = _post(server, wav_bytes, "audio/wav")
+    assert result["transcripts"] == [["upload.wav"]]
+
+    url = "http://{}:{}/metrics".format(*server.server_address)
+    with urllib.request.urlopen(url) as response:
+        metrics = json.loads(response.read().decode("utf8"))
+    assert metrics["requests"] == 2
+    assert metrics["utterances"] == 3
+
+def test_server_rejects_bad_requests(running_server):
+    import urllib.error
+    server, _ = running_server
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _post(server, b"{}", "application/json")
+    assert e.value.code == 400
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _post(server, b"hello", "text/plain")
+    assert e.value.code == 415
+
+def test_server_rejects_missing_paths(running_server, tmp_path):
+    import urllib.error
+    server, transcriber = running_server
+    paths = [str(_write_wav(tmp_path / "x.wav")), str(tmp_path / "missing.wav")]
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _post(server, json.dumps({"paths": paths}).encode(), "application/json")
+    assert e.value.code == 404
+    assert "missing.wav" in json.loads(e.value.read().decode("utf8"))["error"]
+    assert not transcriber.calls
+
+def test_server_rejects_invalid_wavs(running_server):
+    import urllib.error
+    server, transcriber = running_server
+    for body in [b"RIFF....", b"not a wav file", b""]:
+        with pytest.raises(urllib.error.HTTPError) as e:
+            _post(server, body, "audio/wav")
+        assert e.value.code == 415
+        assert "error" in json.loads(e.value.read().decode("utf8"))
+    assert not transcriber.calls
+
+    url = "http://{}:{}/metrics".format(*server.server_address)
+    with urllib.request.urlopen(url) as response:
+        metrics = json.loads(response.read().decode("utf8"))
+    assert metrics["errors"] == 3
@@ -0,0 +1,28 @@
+import pytest
+
+def test_session_config_proto():
+    import tensorflow as tf
+    from persephone.session_config import SessionConfig, config_proto
+
+    proto = SessionConfig(intra_op_threads=2, inter_op_threads=1,
+                          xla_jit=True, constant_folding=False).to_proto()
+    assert proto.intra_op_parallelism_threads == 2
+    assert proto.inter_op_parallelism_threads == 1
+    assert proto.gpu_options.allow_growth
+    optimizer_options = proto.graph_options.optimizer_options
+    assert optimizer_options.global_jit_level == tf.OptimizerOptions.ON_1
+    assert not optimizer_options.do_constant_folding
+
+    default = config_proto(None)
+    assert default.intra_op_parallelism_threads == 0
+    assert default.graph_options.optimizer_options.opt_level == tf.OptimizerOptions.L1
+    assert config_proto(proto) is proto
+
+def test_session_config_invalid():
+    from persephone.exceptions import PersephoneException
+    from persephone.session_config import SessionConfig
+
+    with pytest.raises(PersephoneException):
+        SessionConfig(intra_op_threads=-1)
+    with pytest.raises(PersephoneException):
+        SessionConfig(opt_level="L2")
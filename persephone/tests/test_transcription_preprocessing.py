@@ -60,4 +60,27 @@ def test_unicode_segmentation():
     ]
 
     for space_character in unicode_spaces:
-        assert segment_into_chars("hello"+space_character+"world") ==  "h e l l o w o r l d"
\ No newline at end of file
+        assert segment_into_chars("hello"+space_character+"world") ==  "h e l l o w o r l d"
+
+
+def test_token_segmenter():
+    """Test that the compiled segmenter takes the longest tokens, skips
+    unknown characters and segments batches and utterances"""
+    from pathlib import Path
+    from persephone.preprocess.labels import TokenSegmenter, segment_into_tokens
+    from persephone.utterance import Utterance
+
+    segmenter = TokenSegmenter(["a", "aa", "aaa", "b", "rr", "r", ""])
+    assert segmenter("aaaab") == "aaa a b"
+    assert segmenter("rrr?xb") == "rr r b"
+    assert segmenter("") == ""
+    assert segmenter.segment_all(["aab", "brr", "x"]) == ["aa b", "b rr", ""]
+    assert segment_into_tokens("aaaab", {"a", "aa", "aaa", "b"}) == "aaa a b"
+
+    # Tokens containing regular expression metacharacters are literal.
+    assert TokenSegmenter([".", "a*"])("a*.ab") == "a* ."
+
+    utter = Utterance(Path("a.wav"), Path("a.eaf"), "a.0", 0, 100, "brra", None)
+    label_segmenter = segmenter.label_segmenter()
+    assert label_segmenter.labels == {"a", "aa", "aaa", "b", "rr", "r"}
+    assert label_segmenter.segment_labels(utter) == utter._replace(text="b rr a")
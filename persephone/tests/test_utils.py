@@ -31,3 +31,108 @@ def test_zero_batch_size():
 
     with pytest.raises(ValueError):
         batches1 = make_batches(paths, 0)
+
+def test_prefetch_preserves_order():
+    """Test that prefetching yields results in order and records waiting"""
+    import time
+    from persephone.utils import prefetch, PrefetchStats
+
+    def slow_square(x):
+        time.sleep(0.01 * (x % 3))
+        return x * x
+
+    stats = PrefetchStats()
+    results = list(prefetch(slow_square, range(10), buffer_size=3,
+                            num_workers=3, stats=stats))
+    assert results == [x * x for x in range(10)]
+    assert stats.num_items == 10
+
+    with pytest.raises(ValueError):
+        list(prefetch(slow_square, range(3), buffer_size=0))
+
+def test_make_bucketed_batches():
+    """Test that batches group similar lengths within the frame budget"""
+    from persephone.utils import make_bucketed_batches
+    items = ["a", "b", "c", "d", "e"]
+    lens = [50, 1000, 60, 40, 900]
+
+    batches = make_bucketed_batches(items, lens, 1000)
+    assert batches == [["d", "a", "c"], ["e"], ["b"]]
+    # An item over the budget still gets a batch of its own.
+    assert make_bucketed_batches(items, lens, 100) == [["d", "a"], ["c"], ["e"], ["b"]]
+
+    with pytest.raises(ValueError):
+        make_bucketed_batches(items, lens[:2], 1000)
+
+def test_pad_batch_and_assembler():
+    """Test padded batch assembly, including reuse of a dirty buffer"""
+    import numpy as np
+    from persephone.utils import pad_batch, BatchAssembler
+    utterances = [np.ones((3, 2)), 2 * np.ones((5, 2))]
+
+    batch, lens = pad_batch(utterances)
+    assert batch.dtype == np.float32
+    assert batch.shape == (2, 5, 2)
+    assert list(lens) == [3, 5]
+    assert batch[0, 3:].sum() == 0 and batch[1].sum() == 20
+
+    assembler = BatchAssembler()
+    first, _ = assembler([2 * np.ones((5, 2)), 2 * np.ones((5, 2))])
+    second, _ = assembler(utterances)
+    assert second is first
+    np.testing.assert_array_equal(second, batch)
+
+    with pytest.raises(ValueError):
+        pad_batch(utterances, out=np.zeros((2, 4, 2), dtype=np.float32))
+
+def test_target_list_to_sparse_tensor():
+    """Test the sparse representation of a batch of targets"""
+    import numpy as np
+    from persephone.utils import target_list_to_sparse_tensor
+    indices, vals, shape = target_list_to_sparse_tensor([[3, 1], [], [2, 2, 4]])
+    assert indices.tolist() == [[0, 0], [0, 1], [2, 0], [2, 1], [2, 2]]
+    assert vals.tolist() == [3, 1, 2, 2, 4]
+    assert shape.tolist() == [3, 3]
+
+    indices, vals, shape = target_list_to_sparse_tensor([np.array([5], dtype=np.int32)])
+    assert indices.tolist() == [[0, 0]]
+    assert vals.tolist() == [5]
+    assert shape.tolist() == [1, 1]
+
+def test_edit_distance_totals():
+    """Test that the label error rate doesn't depend on how utterances are
+    split into sub-batches"""
+    import random
+    from persephone.utils import EditDistanceTotals, batch_per
+    random.seed(0)
+    refs = [[random.randint(1, 5) for _ in range(random.randint(1, 30))]
+            for _ in range(200)]
+    hyps = [[random.randint(1, 5) for _ in range(random.randint(0, 30))]
+            for _ in range(200)]
+
+    whole = EditDistanceTotals()
+    whole.add_transcripts(hyps, refs)
+    assert len(whole) == 200
+    assert whole.ler() == pytest.approx(batch_per(hyps, refs))
+
+    order = list(range(200))
+    random.shuffle(order)
+    chunked = EditDistanceTotals()
+    for start in range(0, 200, 7):
+        chunk = order[start:start+7]
+        chunked.add_transcripts([hyps[i] for i in chunk], [refs[i] for i in chunk])
+    assert chunked.ler() == pytest.approx(whole.ler())
+
+    with pytest.raises(ValueError):
+        EditDistanceTotals().ler()
+
+def test_edit_distance_totals_empty_refs():
+    """Test that empty references give the rates tf.edit_distance does,
+    rather than dividing by zero"""
+    import math
+    from persephone.utils import EditDistanceTotals
+    totals = EditDistanceTotals()
+    totals.add_transcripts([[], [1, 2]], [[], [1, 3]])
+    assert totals.ler() == pytest.approx(0.25)
+    totals.add_transcripts([[1]], [[]])
+    assert math.isinf(totals.ler())
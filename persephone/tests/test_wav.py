@@ -0,0 +1,52 @@
+"""Tests for cutting utterance WAVs out of source media"""
+
+def test_extract_wavs(tmp_path, create_note_sequence, make_wav):
+    """Test that utterances are cut from their source as 16kHz mono WAVs"""
+    import scipy.io.wavfile
+    from persephone.preprocess import wav
+    from persephone.utterance import Utterance
+
+    source_path = tmp_path / "source.wav"
+    make_wav(create_note_sequence(notes=["A", "B"], seconds=2), str(source_path),
+             duration=2)
+    utterances = [
+        Utterance(source_path, tmp_path / "source.eaf", "first", 0, 500, "a", None),
+        Utterance(source_path, tmp_path / "source.eaf", "second", 1000, 1750, "b", None),
+    ]
+    tgt_dir = tmp_path / "wav"
+    wav.extract_wavs(utterances, tgt_dir, lazy=True)
+
+    rate, samples = scipy.io.wavfile.read(str(tgt_dir / "first.wav"))
+    assert rate == 16000
+    assert samples.shape == (8000,)
+    rate, samples = scipy.io.wavfile.read(str(tgt_dir / "second.wav"))
+    assert samples.shape == (12000,)
+
+    # Lazily skipping existing files means the source needn't be decoded.
+    source_path.unlink()
+    wav.extract_wavs(utterances, tgt_dir, lazy=True)
+
+def test_to_mono_16k():
+    """Test downmixing and resampling"""
+    import numpy as np
+    from persephone.preprocess import wav
+    stereo = np.stack([np.full(44100, 1000, dtype=np.int16),
+                       np.full(44100, 3000, dtype=np.int16)], axis=1)
+    mono = wav.to_mono_16k(44100, stereo)
+    assert mono.dtype == np.int16
+    assert mono.shape == (16000,)
+    assert abs(int(mono[8000]) - 2000) <= 1
+
+def test_segment_mono_16k():
+    """Test that converting only an utterance's span of the source gives the
+    same samples as cutting it from the whole converted source"""
+    import numpy as np
+    from persephone.preprocess import wav
+    rng = np.random.RandomState(0)
+    for rate in [8000, 16000, 44100]:
+        stereo = (rng.randn(rate * 3, 2) * 3000).astype(np.int16)
+        whole = wav.to_mono_16k(rate, stereo)
+        for start, end in [(0, 800), (1234, 20000), (40000, 48000), (47000, 60000)]:
+            segment = wav.segment_mono_16k(rate, stereo, start, end)
+            assert segment.shape == whole[start:end].shape
+            assert np.abs(segment.astype(int) - whole[start:end]).max() <= 1
@@ -0,0 +1,251 @@
+""" A long-lived transcription engine that restores a trained model once and
+serves transcription requests from any number of threads. """
+
+from concurrent.futures import Future
+import json
+import logging
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Set, Union
+
+import numpy as np
+import tensorflow as tf
+
+from . import utils
+from .cmvn import CMVNStats
+from .exceptions import PersephoneException
+from .model import dense_to_human_readable, load_metagraph
+from .preprocess import feat_extract, labels
+from .session_config import SessionConfig, config_proto
+
+logger = logging.getLogger(__name__) # type: ignore
+
+# The placeholder and output names used if no model_description.json is found.
+DEFAULT_TOPOLOGY = {
+    "batch_x_name": "batch_x:0",
+    "batch_x_lens_name": "batch_x_lens:0",
+    "dense_decoded_name": "hyp_dense_decoded:0",
+}
+
+TranscriberInput = Union[Path, str, np.ndarray]
+
+def read_topology(exp_dir: Path) -> Dict[str, str]:
+    """ Reads the names of the input placeholders and decoded output of a
+    model from the model_description.json in its experiment directory,
+    falling back to the default names. """
+
+    topology = dict(DEFAULT_TOPOLOGY)
+    desc_path = Path(exp_dir) / "model_description.json"
+    if desc_path.is_file():
+        with desc_path.open() as desc_f:
+            topology.update(json.load(desc_f).get("topology", {}))
+    else:
+        logger.warning("No model description found at %s; using default"
+                       " tensor names %s", desc_path, topology)
+    return topology
+
+def wav_to_feats(wav_path: Path, feature_type: str) -> np.ndarray:
+    """ Normalizes a WAV file and extracts its features in memory, without
+    writing anything alongside the original file. """
+
+    rate, samples = feat_extract.read_mono16k(Path(wav_path))
+    return feat_extract.feats_from_signal(rate, samples, feature_type)
+
+class Transcriber:
+    """ Keeps a trained model restored in a TensorFlow session so that many
+    transcription requests can be served without reloading it.
+
+    `transcribe()` may be called concurrently from multiple threads. Requests
+    are queued and a background thread groups the requests that arrive within
+    `max_wait` seconds of each other into a single batch, up to
+    `max_batch_size` utterances, before running the model.
+
+    Use as a context manager, or call `close()` when done, to release the
+    session.
+    """
+
+    def __init__(self, model_path_prefix: Union[str, Path],
+                 label_set: Set[str],
+                 *,
+                 feature_type: str = "fbank",
+                 exp_dir: Optional[Union[str, Path]] = None,
+                 max_batch_size: int = 64,
+                 max_wait: float = 0.01,
+                 session_config: Union[None, SessionConfig, tf.ConfigProto] = None,
+                 cmvn_stats: Optional[CMVNStats] = None) -> None:
+        """
+        Args:
+            model_path_prefix: The path to the saved tensorflow model. This is
+                the full prefix to the ".ckpt" file.
+            label_set: The set of all the labels this model uses.
+            feature_type: The type of features this model uses.
+            exp_dir: The experiment directory whose model_description.json
+                gives the tensor names. Defaults to the parent of the directory
+                holding the checkpoint.
+            max_batch_size: The maximum number of utterances decoded at once.
+            max_wait: The number of seconds to wait for further requests to
+                batch with the first one.
+            session_config: The `SessionConfig` (or `tf.ConfigProto`) used to
+                create the session.
+            cmvn_stats: The `CMVNStats` that the model's training features
+                were normalized with, if any. Features are normalized with
+                the global statistics.
+        """
+
+        self.model_path_prefix = str(model_path_prefix)
+        self.feature_type = feature_type
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.cmvn_stats = cmvn_stats
+        self.indices_to_labels = labels.make_indices_to_labels(label_set)
+        if exp_dir is None:
+            exp_dir = Path(self.model_path_prefix).parent.parent
+        self.topology = read_topology(Path(exp_dir))
+
+        start = time.perf_counter()
+        self.graph = tf.Graph()
+        with self.graph.as_default(): #type: ignore
+            saver = load_metagraph(self.model_path_prefix)
+            self.session = tf.Session(graph=self.graph, config=config_proto(session_config))
+            saver.restore(self.session, self.model_path_prefix)
+            self.batch_x = self.graph.get_tensor_by_name(self.topology["batch_x_name"])
+            self.batch_x_lens = self.graph.get_tensor_by_name(self.topology["batch_x_lens_name"])
+            self.dense_decoded = self.graph.get_tensor_by_name(self.topology["dense_decoded_name"])
+        logger.info("Restored model %s in %0.3fs", self.model_path_prefix,
+                    time.perf_counter() - start)
+
+        self._requests = queue.Queue() # type: queue.Queue
+        # Guards _closed, so that no request is queued after the sentinel
+        # that stops the worker.
+        self._lock = threading.Lock()
+        self._closed = False
+        self._worker = threading.Thread(target=self._serve, daemon=True,
+                                        name="Transcriber")
+        self._worker.start()
+
+    def __enter__(self) -> "Transcriber":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ Finishes any queued requests and releases the session. Requests
+        submitted afterwards raise a `PersephoneException`. """
+
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._requests.put(None)
+        self._worker.join()
+        # Fail anything the worker didn't get to, rather than leave its
+        # caller waiting forever.
+        while True:
+            try:
+                request = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request[1].set_exception(
+                    PersephoneException("Transcriber has been closed."))
+        self.session.close()
+
+    def load(self, inputs: Sequence[TranscriberInput]) -> List[np.ndarray]:
+        """ Converts WAV paths to feature arrays. Arrays are assumed to already
+        be features of the model's feature type and are passed through. """
+
+        feats = []
+        for inp in inputs:
+            if isinstance(inp, np.ndarray):
+                feats.append(inp)
+            else:
+                if not Path(inp).exists():
+                    raise PersephoneException(
+                        "The WAV file path {} does not exist".format(inp))
+                feats.append(wav_to_feats(Path(inp), self.feature_type))
+        return feats
+
+    def transcribe(self, inputs: Sequence[TranscriberInput]) -> List[List[str]]:
+        """ Transcribes WAV files or feature arrays, returning a list of labels
+        for each input, in order. Blocks until the transcripts are ready. """
+
+        return self.submit(inputs).result()
+
+    def submit(self, inputs: Sequence[TranscriberInput]) -> Future:
+        """ Queues inputs for transcription, returning a `Future` whose result
+        is what `transcribe()` would return. Feature extraction of WAV files
+        happens in the calling thread. """
+
+        if self._closed:
+            raise PersephoneException("Transcriber has been closed.")
+        future = Future() # type: Future
+        if not inputs:
+            future.set_result([])
+            return future
+        feats = self.load(inputs)
+        with self._lock:
+            if self._closed:
+                raise PersephoneException("Transcriber has been closed.")
+            self._requests.put((feats, future))
+        return future
+
+    def _next_requests(self) -> Optional[List]:
+        """ Blocks for a request, then gathers any others that arrive within
+        max_wait, up to max_batch_size utterances. Returns None on shutdown. """
+
+        first = self._requests.get()
+        if first is None:
+            return None
+        requests = [first]
+        num_utters = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while num_utters < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                # Serve what we have, then stop.
+                self._requests.put(None)
+                break
+            requests.append(request)
+            num_utters += len(request[0])
+        return requests
+
+    def _serve(self) -> None:
+        while True:
+            requests = self._next_requests()
+            if requests is None:
+                return
+            try:
+                feats = [feat for request_feats, _ in requests
+                         for feat in request_feats]
+                transcripts = self._decode(feats)
+            except Exception as e: # pylint: disable=broad-except
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for request_feats, future in requests:
+                future.set_result(transcripts[offset:offset+len(request_feats)])
+                offset += len(request_feats)
+
+    def _decode(self, feats: Sequence[np.ndarray]) -> List[List[str]]:
+        transcripts = [] # type: List[List[str]]
+        for feat_batch in utils.make_batches(feats, self.max_batch_size):
+            batch_x, batch_x_lens = utils.pad_batch(feat_batch)
+            if self.cmvn_stats is not None:
+                self.cmvn_stats.normalize(batch_x, batch_x_lens)
+            dense_decoded = self.session.run(
+                self.dense_decoded,
+                feed_dict={self.batch_x: batch_x,
+                           self.batch_x_lens: batch_x_lens})
+            transcripts.extend(
+                dense_to_human_readable(dense_decoded, self.indices_to_labels))
+        return transcripts
@@ -1,11 +1,16 @@
 """ Miscellaneous utility functions. """
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import logging.config
+import math
 import os
 from pathlib import Path
 import subprocess
 from subprocess import PIPE
-from typing import List, Sequence, Tuple, TypeVar
+import time
+from typing import (Callable, Deque, Dict, Iterable, Iterator, List, Optional,
+                    Sequence, Tuple, TypeVar)
 
 import numpy as np # type: ignore
 from nltk.metrics import distance
@@ -15,6 +20,7 @@ from . import config
 logger = logging.getLogger(__name__) # type: ignore
 
 T = TypeVar("T")
+U = TypeVar("U")
 
 def target_list_to_sparse_tensor(target_list):
     """ Make tensorflow SparseTensor from list of targets, with each element in
@@ -23,14 +29,20 @@ def target_list_to_sparse_tensor(target_list):
     https://github.com/tensorflow/tensorflow/blob/master/tensorflow/
     contrib/ctc/ctc_loss_op_test.py for example of SparseTensor format
     """
-    indices = []
-    vals = []
-    for t_i, target in enumerate(target_list):
-        for seq_i, val in enumerate(target):
-            indices.append([t_i, seq_i])
-            vals.append(val)
-    shape = [len(target_list), np.asarray(indices).max(0)[1]+1]
-    return (np.array(indices), np.array(vals), np.array(shape))
+    lens = np.array([len(target) for target in target_list], dtype=np.int64)
+    if lens.sum() == 0:
+        vals = np.zeros(0, dtype=np.int64)
+    else:
+        vals = np.concatenate([np.asarray(target, dtype=np.int64)
+                               for target in target_list])
+    # The index of each value in its target sequence is its position in the
+    # concatenated values less the start offset of its sequence.
+    starts = np.cumsum(lens) - lens
+    t_indices = np.repeat(np.arange(len(target_list)), lens)
+    seq_indices = np.arange(len(vals)) - np.repeat(starts, lens)
+    indices = np.stack([t_indices, seq_indices], axis=1)
+    shape = [len(target_list), lens.max() if len(lens) else 0]
+    return (indices, vals, np.array(shape))
 
 def zero_pad(matrix, to_length):
     """ Zero pads along the 0th dimension to make sure the utterance array
@@ -59,26 +71,90 @@ def collapse(batch_x, time_major=False):
         new_batch_x = np.transpose(new_batch_x, (1, 0, 2))
     return new_batch_x
 
+def pad_batch(utterances: Sequence[np.ndarray], dtype=np.float32,
+              out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """ Assembles utterances of varying length into a single zero padded
+    batch of shape (batch_size, max_len, ...), copying each utterance
+    directly into its slice of the batch.
+
+    Args:
+        utterances: Feature matrices with time as the first dimension.
+        dtype: The dtype of the batch.
+        out: An array to write the batch into instead of allocating a new
+            one. It must have the batch's shape and dtype. Padding in it is
+            zeroed.
+
+    Returns:
+        A tuple of the batch and an array of the utterance lengths.
+    """
+
+    utter_lens = [utterance.shape[0] for utterance in utterances]
+    max_len = max(utter_lens)
+    shape = (len(utterances), max_len) + tuple(utterances[0].shape[1:])
+    if out is None:
+        batch = np.zeros(shape, dtype=dtype)
+    else:
+        if out.shape != shape or out.dtype != dtype:
+            raise ValueError("Output array of shape {} and dtype {} doesn't"
+                             " match batch of shape {} and dtype {}".format(
+                                 out.shape, out.dtype, shape, np.dtype(dtype)))
+        batch = out
+    for i, (utt, utter_len) in enumerate(zip(utterances, utter_lens)):
+        batch[i, :utter_len] = utt
+        if out is not None:
+            batch[i, utter_len:] = 0
+    return batch, np.array(utter_lens)
+
+class BatchAssembler:
+    """ Assembles padded batches like `pad_batch()`, but reuses one buffer
+    per batch shape rather than allocating a new batch each time.
+
+    A batch returned by an assembler is overwritten by the next batch of the
+    same shape, so it mustn't be used once another batch has been assembled.
+    In particular, don't share an assembler with `prefetch()`.
+    """
+
+    def __init__(self, dtype=np.float32) -> None:
+        self.dtype = dtype
+        self.buffers = {} # type: Dict[Tuple[int, ...], np.ndarray]
+
+    def __call__(self, utterances: Sequence[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        max_len = max(utterance.shape[0] for utterance in utterances)
+        shape = (len(utterances), max_len) + tuple(utterances[0].shape[1:])
+        if shape not in self.buffers:
+            self.buffers[shape] = np.zeros(shape, dtype=self.dtype)
+        return pad_batch(utterances, self.dtype, out=self.buffers[shape])
+
 #def load_batch_x(path_batch: Sequence[Path],
 #                 flatten: bool = False,
 #                 time_major: bool = False):
 def load_batch_x(path_batch,
                  flatten = False,
-                 time_major = False):
+                 time_major = False,
+                 feat_store = None,
+                 dtype = np.float32,
+                 assembler = None,
+                 cmvn_stats = None):
     """ Loads a batch of input features given a list of paths to numpy
-    arrays in that batch."""
+    arrays in that batch. If a `PackedFeatStore` is supplied as feat_store,
+    the features are read from it where possible rather than from the
+    individual files. The batch has the given dtype, unless an assembler
+    (such as a `BatchAssembler`) is supplied to build the batch. If
+    `CMVNStats` are supplied, the batch is normalized with them in place."""
 
-    utterances = [np.load(str(path)) for path in path_batch]
-    utter_lens = [utterance.shape[0] for utterance in utterances]
-    max_len = max(utter_lens)
-    batch_size = len(path_batch)
-    shape = (batch_size, max_len) + tuple(utterances[0].shape[1:])
-    batch = np.zeros(shape)
-    for i, utt in enumerate(utterances):
-        batch[i] = zero_pad(utt, max_len)
+    if feat_store is not None:
+        utterances = [feat_store.load(path) for path in path_batch]
+    else:
+        utterances = [np.load(str(path)) for path in path_batch]
+    if assembler is not None:
+        batch, utter_lens = assembler(utterances)
+    else:
+        batch, utter_lens = pad_batch(utterances, dtype)
+    if cmvn_stats is not None:
+        cmvn_stats.normalize(batch, utter_lens, path_batch)
     if flatten:
         batch = collapse(batch, time_major=time_major)
-    return batch, np.array(utter_lens)
+    return batch, utter_lens
 
 def batch_per(hyps: Sequence[Sequence[T]],
               refs: Sequence[Sequence[T]]) -> float:
@@ -91,6 +167,59 @@ def batch_per(hyps: Sequence[Sequence[T]],
         macro_per += distance.edit_distance(ref, hyp)/len(ref)
     return macro_per/len(hyps)
 
+def _normalized_distance(dist: int, ref_len: int) -> float:
+    if ref_len == 0:
+        return math.inf if dist else 0.0
+    return dist / ref_len
+
+class EditDistanceTotals:
+    """ Accumulates the edit distances and reference lengths of utterances
+    decoded over several sub-batches.
+
+    The label error rate is the mean over utterances of the edit distance
+    divided by the reference length, as with `tf.edit_distance`. The sum is
+    computed with `math.fsum` in double precision, so the rate doesn't depend
+    on how the utterances were split into sub-batches or the order they were
+    decoded in. It agrees with the mean of Tensorflow's float32 rates up to
+    rounding, rather than exactly.
+    """
+
+    def __init__(self) -> None:
+        self.distances = [] # type: List[int]
+        self.ref_lens = [] # type: List[int]
+
+    def add(self, distances: Sequence[int], ref_lens: Sequence[int]) -> None:
+        """ Adds the edit distances and reference lengths of a sub-batch. """
+
+        if len(distances) != len(ref_lens):
+            raise ValueError("Got {} distances but {} reference lengths".format(
+                len(distances), len(ref_lens)))
+        self.distances.extend(int(dist) for dist in distances)
+        self.ref_lens.extend(int(ref_len) for ref_len in ref_lens)
+
+    def add_transcripts(self, hyps: Sequence[Sequence[T]],
+                        refs: Sequence[Sequence[T]]) -> None:
+        """ Adds the edit distances of hypotheses from their references. """
+
+        self.add([distance.edit_distance(ref, hyp) for hyp, ref in zip(hyps, refs)],
+                 [len(ref) for ref in refs])
+
+    def __len__(self) -> int:
+        return len(self.distances)
+
+    def ler(self) -> float:
+        """ The label error rate of the utterances added so far. As with
+        `tf.edit_distance`, an utterance with an empty reference has a rate of
+        0 if its hypothesis is also empty, and infinity otherwise. """
+
+        if not self.distances:
+            raise ValueError("No utterances have been added.")
+        return math.fsum(_normalized_distance(dist, ref_len) for dist, ref_len
+                         in zip(self.distances, self.ref_lens)) / len(self.distances)
+
+    def __repr__(self) -> str:
+        return "EditDistanceTotals(num_utterances={})".format(len(self))
+
 def get_prefixes(dirname: str, extension: str) -> List[str]:
     """ Returns a list of prefixes to files in the directory (which might be a whole
     corpus, or a train/valid/test subset. The prefixes include the path leading
@@ -106,13 +235,19 @@ def get_prefixes(dirname: str, extension: str) -> List[str]:
                 prefixes.append(os.path.join(root, filename.split(".")[0]))
     return sorted(prefixes)
 
+def npy_shape(path: Path) -> Tuple[int, ...]:
+    """ Returns the shape of the array stored in a `.npy` file without reading
+    the array data. Only the header is parsed; the data is memory mapped but
+    never touched."""
+
+    return np.load(str(path), mmap_mode="r").shape
+
 def get_prefix_lens(feat_dir: Path, prefixes: List[str],
                     feat_type: str) -> List[Tuple[str,int]]:
     prefix_lens = []
     for prefix in prefixes:
-        path = feat_dir / ("%s.%s.npy" % (prefix, feat_type))
-        _, batch_x_lens = load_batch_x([str(path)], flatten=False)
-        prefix_lens.append((prefix, batch_x_lens[0]))
+        path = Path(feat_dir) / ("%s.%s.npy" % (prefix, feat_type))
+        prefix_lens.append((prefix, npy_shape(path)[0]))
     return prefix_lens
 
 def filter_by_size(feat_dir: Path, prefixes: List[str], feat_type: str,
@@ -161,3 +296,97 @@ def make_batches(paths: Sequence[Path], batch_size: int) -> List[Sequence[Path]]
 
     return [paths[i:i+batch_size]
             for i in range(0, len(paths), batch_size)]
+
+def make_bucketed_batches(items: Sequence[T], lens: Sequence[int],
+                          max_frames: int) -> List[List[T]]:
+    """ Groups items into batches of similar length, where the number of
+    items in each batch is limited such that the batch, once zero padded to
+    its longest item, has no more than max_frames frames. Items longer than
+    max_frames are put in a batch of their own.
+
+    Args:
+        items: The items (typically feature and label paths) to batch.
+        lens: The number of frames in each item.
+        max_frames: The maximum number of padded frames in a batch.
+
+    Returns:
+        Batches in order of increasing length.
+    """
+
+    if max_frames < 1:
+        raise ValueError("max_frames must be positive, got {}".format(max_frames))
+    if len(items) != len(lens):
+        raise ValueError("Got {} items but {} lengths".format(len(items), len(lens)))
+
+    batches = [] # type: List[List[T]]
+    batch = [] # type: List[T]
+    for i in sorted(range(len(items)), key=lambda i: lens[i]):
+        # Since items are visited in order of length, the current item is the
+        # longest in the batch and determines the padded length.
+        if batch and lens[i] * (len(batch) + 1) > max_frames:
+            batches.append(batch)
+            batch = []
+        batch.append(items[i])
+    if batch:
+        batches.append(batch)
+    return batches
+
+class PrefetchStats:
+    """ Accumulates how long a consumer of `prefetch()` spent blocked waiting
+    for items that weren't ready yet. """
+
+    def __init__(self) -> None:
+        self.wait_seconds = 0.0
+        self.num_items = 0
+
+    def __repr__(self) -> str:
+        return "PrefetchStats(wait_seconds={:0.3f}, num_items={})".format(
+            self.wait_seconds, self.num_items)
+
+def prefetch(load_fn: Callable[[T], U], items: Iterable[T], *,
+             buffer_size: int = 2, num_workers: int = 1,
+             stats: Optional[PrefetchStats] = None) -> Iterator[U]:
+    """ Applies load_fn to each item in a pool of background threads, keeping
+    up to buffer_size results loaded ahead of the consumer. Results are
+    yielded in the same order as items, so the output is deterministic
+    regardless of the number of workers.
+
+    Args:
+        load_fn: The function to apply to each item, typically something that
+            loads a batch from disk.
+        items: The inputs to load_fn.
+        buffer_size: The maximum number of results that are in flight or
+            waiting to be consumed.
+        num_workers: The number of loader threads.
+        stats: If supplied, records the time spent waiting on results.
+    """
+
+    if buffer_size < 1:
+        raise ValueError("buffer_size must be at least 1, got {}".format(buffer_size))
+    pending = deque() # type: Deque
+    item_iter = iter(items)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+
+        def submit_next() -> None:
+            """ Starts loading the next item, if there is one."""
+            for item in item_iter:
+                pending.append(executor.submit(load_fn, item))
+                return
+
+        try:
+            for _ in range(buffer_size):
+                submit_next()
+            while pending:
+                future = pending.popleft()
+                start = time.perf_counter()
+                result = future.result()
+                if stats is not None:
+                    stats.wait_seconds += time.perf_counter() - start
+                    stats.num_items += 1
+                # Top the buffer back up before handing over the result, so the
+                # next item loads while the consumer is busy with this one.
+                submit_next()
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
@@ -64,6 +64,16 @@ def write_transcriptions(utterances: List[Utterance],
         with out_path.open("w") as f:
             print(utter.text, file=f)
 
+def write_speakers(utterances: List[Utterance], speakers_path: Path) -> None:
+    """ Writes the speaker of each utterance to a file, one
+    "<prefix> <speaker>" pair per line. Utterances without a speaker are
+    left out. """
+
+    with speakers_path.open("w") as f:
+        for utter in utterances:
+            if utter.speaker:
+                print(utter.prefix, utter.speaker, file=f)
+
 def remove_duplicates(utterances: List[Utterance]) -> List[Utterance]:
     """ Removes utterances with the same start_time, end_time and text. Other
     metadata isn't considered.